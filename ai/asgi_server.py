@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Elacity Async Backend Server
+ASGI counterpart of server.py with the same response contracts for the routes it serves:
+/api/analyze, /api/section, /api/qa, /api/related, /api/health, /api/cache, /api/metrics
+and /api/test. Streaming (/api/analyze/stream), reading lists (/api/analyze/batch) and
+background jobs (/api/jobs) are only served by server.py.
+Paper downloads use an async HTTP client and analyses use the async OpenAI client,
+so a single worker can hold hundreds of in-flight analyses.
+
+Run with: hypercorn asgi_server:app --bind 0.0.0.0:8000 (from the ai/ folder)
+"""
+
+import os
+import asyncio
+import time
+import metrics
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+from pipeline import run_analysis_async, analysis_cache, async_in_flight, usage_headers, usage_totals, TEST_ANALYSIS
+from prompt import document_store
+from async_prompt import close_http_client
+from ratelimit import Overloaded, client_limiter, client_key, openai_admission
+from mapreduce import mode_error, notes_cache
+from sections import section_cache, analyze_section_async, PaperTextUnavailable, SectionNotFound
+from qa import qa_cache, answer_question_async, QA_MAX_QUESTION_CHARS
+from fingerprint import fingerprints
+from related import related_to, get_index as related_index, NotIndexed, DEFAULT_RESULTS, MAX_RESULTS
+from dotenv import load_dotenv
+
+# Load environment variables from root directory
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+
+app = Quart(__name__)
+app = cors(app, allow_origin='*', expose_headers=['Retry-After', 'X-Elacity-Cache', 'X-Elacity-Prompt-Tokens', 'X-Elacity-Cached-Tokens', 'X-Elacity-Completion-Tokens'])  # Enable CORS for browser extension requests
+
+
+@app.after_serving
+async def shutdown():
+    """Release pooled HTTP connections."""
+    await close_http_client()
+
+def _too_many_requests(error, retry_after):
+    """429 response telling the client when to come back."""
+    return jsonify({'error': error, 'retry_after': retry_after}), 429, {'Retry-After': str(retry_after)}
+
+@app.route('/api/analyze', methods=['POST'])
+async def analyze_paper():
+    """Analyze a paper from URL."""
+    started = time.perf_counter()
+    retry_after = client_limiter.check(client_key(request.headers, request.remote_addr))
+    if retry_after:
+        return _too_many_requests('Too many requests', retry_after)
+
+    try:
+        data = await request.get_json()
+
+        # Extract parameters
+        url = data.get('url')
+        analysis_type = data.get('type', 'full')
+        eli12 = data.get('eli12', False)
+
+        if not url:
+            return jsonify({'error': 'URL is required'}), 400
+
+        # 'long' covers the whole paper with several OpenAI calls (see mapreduce.py)
+        mode = data.get('mode', 'standard')
+        mode_problem = mode_error(mode, analysis_type)
+        if mode_problem:
+            return jsonify({'error': mode_problem}), 400
+
+        # Cache controls: no_cache skips the lookup, invalidate drops the stored entry
+        no_cache = bool(data.get('no_cache', False))
+        invalidate = bool(data.get('invalidate', False))
+
+        payload, cache_status = await run_analysis_async(url, analysis_type, eli12, no_cache=no_cache, invalidate=invalidate, mode=mode)
+
+        with metrics.timer('serialize'):
+            response = jsonify(payload)
+        response.headers['X-Elacity-Cache'] = cache_status
+        response.headers.update(usage_headers())
+
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint='analyze', cache=cache_status, **metrics.current_labels())
+        return response
+
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/section', methods=['POST'])
+async def analyze_paper_section():
+    """Explain one section of a paper, or list its sections when no section index is given."""
+    started = time.perf_counter()
+    retry_after = client_limiter.check(client_key(request.headers, request.remote_addr))
+    if retry_after:
+        return _too_many_requests('Too many requests', retry_after)
+
+    data = await request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    index = data.get('section')
+    if index is not None and (isinstance(index, bool) or not isinstance(index, int)):
+        return jsonify({'error': 'section must be a section index from the outline'}), 400
+
+    try:
+        payload, cache_status = await analyze_section_async(url, index, data.get('eli12', False))
+    except PaperTextUnavailable as e:
+        return jsonify({'error': str(e)}), 422
+    except SectionNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(payload)
+    response.headers['X-Elacity-Cache'] = cache_status
+    response.headers.update(usage_headers())
+    metrics.request_seconds.observe(time.perf_counter() - started, endpoint='section', cache=cache_status, **metrics.current_labels())
+    return response
+
+@app.route('/api/qa', methods=['POST'])
+async def ask_question():
+    """Answer a question about a paper from its most relevant passages."""
+    started = time.perf_counter()
+    retry_after = client_limiter.check(client_key(request.headers, request.remote_addr))
+    if retry_after:
+        return _too_many_requests('Too many requests', retry_after)
+
+    data = await request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    question = data.get('question')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    if not isinstance(question, str) or not question.strip():
+        return jsonify({'error': 'question is required'}), 400
+    if len(question) > QA_MAX_QUESTION_CHARS:
+        return jsonify({'error': f'question must be at most {QA_MAX_QUESTION_CHARS} characters'}), 400
+
+    try:
+        payload, cache_status = await answer_question_async(url, question.strip(), data.get('eli12', False))
+    except PaperTextUnavailable as e:
+        return jsonify({'error': str(e)}), 422
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(payload)
+    response.headers['X-Elacity-Cache'] = cache_status
+    response.headers.update(usage_headers())
+    metrics.request_seconds.observe(time.perf_counter() - started, endpoint='qa', cache=cache_status, **metrics.current_labels())
+    return response
+
+@app.route('/api/related', methods=['GET'])
+async def related_papers():
+    """Papers from our own corpus most similar to the one at ?url=."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    try:
+        n = min(max(int(request.args.get('n', DEFAULT_RESULTS)), 1), MAX_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'n must be a number'}), 400
+
+    try:
+        results = await asyncio.to_thread(related_to, url, n)
+    except NotIndexed as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'url': url, 'related': results})
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Simple health check endpoint."""
+    return jsonify({
+        'status': 'healthy',
+        'openai_configured': bool(os.getenv('OPENAI_API_KEY') and os.getenv('OPENAI_API_KEY') != 'your-actual-api-key-here')
+    })
+
+@app.route('/api/cache', methods=['GET'])
+async def cache_stats():
+    """Analysis and document cache hit/miss counters and in-flight analyses."""
+    stats = analysis_cache.stats()
+    stats['in_flight'] = async_in_flight.in_flight()
+    stats['documents'] = document_store.stats()
+    stats['openai_usage'] = usage_totals.stats()
+    stats['openai_admission'] = openai_admission.stats()
+    stats['rate_limit'] = client_limiter.stats()
+    stats['related_index'] = related_index().stats()
+    stats['fingerprints'] = fingerprints.stats()
+    stats['long_notes'] = notes_cache.stats()
+    stats['sections'] = section_cache.stats()
+    stats['qa'] = qa_cache.stats()
+    return jsonify(stats)
+
+@app.route('/api/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Stage latency histograms, cache and in-flight gauges in Prometheus text format."""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/test', methods=['POST'])
+async def test_analysis():
+    """Test endpoint with mock data."""
+    return jsonify(TEST_ANALYSIS)
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 8000))
+
+    print(f"🚀 Starting Elacity async API server on port {port}")
+    print(f"🔑 OpenAI API configured: {bool(os.getenv('OPENAI_API_KEY') and os.getenv('OPENAI_API_KEY') != 'your-actual-api-key-here')}")
+
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Elacity Async Paper Fetching and Analysis
+Non-blocking counterparts of the fetch_*_text functions and analyze_paper_with_openai,
+used by the ASGI server. HTML parsing, PDF extraction and prompt building are shared
+with prompt.py and run off the event loop, as does any other work over a whole paper's
+text (segmenting, chunking, indexing, fingerprinting), which tokenizes or hashes all of it.
+"""
+
+import os
+import asyncio
+import httpx
+import metrics
+import deadline
+from openai import AsyncOpenAI
+from log import get_logger
+from ratelimit import openai_admission
+from prompt import (
+    HEADERS,
+    document_store,
+    source_type,
+    arxiv_pdf_url,
+    extract_pdf_text,
+    parse_philpapers_html,
+    parse_harvard_html,
+    harvard_full_text,
+    parse_personal_essay_html,
+    parse_generic_html,
+    build_chat_request,
+    usage_summary
+)
+
+logger = get_logger('async_prompt')
+
+# Initialize async OpenAI client (retries go through the admission controller instead)
+async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+
+_http_client = None
+
+
+def get_http_client():
+    """Shared async HTTP client (connection pooling across requests)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=30,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Close the shared HTTP client on server shutdown."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+@metrics.timed('fetch')
+async def _download(url, headers=None):
+    """GET url and return the response body, raising on HTTP errors or once the analysis deadline passes."""
+    try:
+        response = await asyncio.wait_for(
+            get_http_client().get(url, headers=headers),
+            timeout=deadline.timeout(reason=deadline.PARTIAL_TEXT)
+        )
+    except asyncio.TimeoutError:
+        deadline.note(deadline.PARTIAL_TEXT)
+        raise deadline.DeadlineExceeded('Analysis deadline exceeded while downloading')
+    response.raise_for_status()
+    return response.content
+
+
+@document_store.cached
+async def fetch_arxiv_paper_text_async(url):
+    """Fetch and extract text from arXiv paper PDF."""
+    try:
+        content = await _download(arxiv_pdf_url(url))
+
+        # PDF extraction is CPU-bound; keep it off the event loop
+        return await asyncio.to_thread(extract_pdf_text, content)
+
+    except Exception as e:
+        logger.warning("Error fetching arXiv paper", url=url, error=str(e))
+        return None
+
+
+@document_store.cached
+async def fetch_philpapers_text_async(url):
+    """Fetch and extract text from PhilPapers page or PDF."""
+    try:
+        if url.endswith('.pdf'):
+            content = await _download(url)
+            return await asyncio.to_thread(extract_pdf_text, content)
+
+        content = await _download(url, headers=HEADERS)
+        return await asyncio.to_thread(parse_philpapers_html, content)
+
+    except Exception as e:
+        logger.warning("Error fetching PhilPapers content", url=url, error=str(e))
+        return None
+
+
+@document_store.cached
+async def fetch_harvard_paper_text_async(url):
+    """Fetch and extract text from Harvard Math department page."""
+    try:
+        # If URL is a direct PDF, extract from PDF immediately
+        if url.lower().endswith('.pdf'):
+            try:
+                content = await _download(url, headers=HEADERS)
+                pdf_text = await asyncio.to_thread(extract_pdf_text, content)
+                if pdf_text:
+                    return pdf_text
+            except Exception as pdf_e:
+                logger.warning("Error fetching PDF directly from Harvard", url=url, error=str(pdf_e))
+                return None
+
+        content = await _download(url, headers=HEADERS)
+        title, text, pdf_url = await asyncio.to_thread(parse_harvard_html, url, content)
+
+        # Fall back to the linked PDF if HTML content is insufficient
+        if pdf_url:
+            try:
+                pdf_content = await _download(pdf_url, headers=HEADERS)
+                pdf_text = await asyncio.to_thread(extract_pdf_text, pdf_content)
+                if pdf_text:
+                    text = pdf_text
+            except Exception as pdf_e:
+                logger.warning("Error fetching PDF from Harvard page", url=url, error=str(pdf_e))
+
+        return harvard_full_text(title, text)
+
+    except Exception as e:
+        logger.warning("Error fetching Harvard content", url=url, error=str(e))
+        return None
+
+
+@document_store.cached
+async def fetch_personal_essay_text_async(url):
+    """Fetch and extract text from personal essay site."""
+    try:
+        content = await _download(url, headers=HEADERS)
+        return await asyncio.to_thread(parse_personal_essay_html, content)
+
+    except Exception as e:
+        logger.warning("Error fetching personal essay", url=url, error=str(e))
+        return None
+
+
+@document_store.cached
+async def fetch_generic_web_text_async(url):
+    """Generic web page text fetcher for unknown sources."""
+    try:
+        content = await _download(url, headers=HEADERS)
+        return await asyncio.to_thread(parse_generic_html, content)
+
+    except Exception as e:
+        logger.warning("Error fetching generic web content", url=url, error=str(e))
+        return None
+
+
+async def fetch_paper_text_async(url):
+    """Fetch and extract text from various paper sources without blocking the event loop."""
+    fetchers = {
+        'arxiv': fetch_arxiv_paper_text_async,
+        'philpapers': fetch_philpapers_text_async,
+        'harvard': fetch_harvard_paper_text_async,
+        'essay': fetch_personal_essay_text_async,
+        'generic': fetch_generic_web_text_async
+    }
+    try:
+        return await fetchers[source_type(url)](url)
+    except Exception as e:
+        logger.warning("Error in fetch_paper_text_async", url=url, error=str(e))
+        return None
+
+
+@metrics.timed('llm')
+async def call_openai_async(request):
+    """Run one chat completion with the async client. Returns (content, usage) like call_openai."""
+    response, estimated = await openai_admission.call_async(async_client.chat.completions.create, request)
+    usage = usage_summary(response.usage)
+    openai_admission.settle(estimated, usage)
+    return response.choices[0].message.content, usage
+
+
+async def analyze_paper_with_openai_async(url, analysis_type="full", eli12=False):
+    """Analyze paper using the async OpenAI client. The result holds both regular and ELI12 variants."""
+    try:
+        paper_text = await fetch_paper_text_async(url)
+        request = await asyncio.to_thread(build_chat_request, url, paper_text, analysis_type)
+        content, _ = await call_openai_async(request)
+
+        return content
+
+    except Exception as e:
+        return f"Error analyzing paper: {str(e)}"
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Elacity Bulk Pre-Analysis
+Pre-warms the analysis cache through the OpenAI Batch API: prompts for a list of
+papers are written to a JSONL file, submitted as one batch (half the price of
+synchronous calls, no load on the interactive path), polled until done, and the
+completed analyses are stored in the analysis cache under the same keys
+/api/analyze looks up. Like live analyses, they are added to the related-paper
+index and their texts fingerprinted for mirror dedup.
+
+Point --base-url (or OPENAI_BASE_URL) at batch_standin.py to try it locally.
+"""
+
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI
+import related
+import fingerprint
+from cache import cache_key_paper_id
+from prompt import fetch_paper_text, build_chat_request, usage_summary, document_store
+from pipeline import analysis_cache, analysis_cache_key, parse_analysis_result
+from reading_list import PER_HOST_FETCHES
+from log import get_logger
+
+logger = get_logger('batch')
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def build_batch_requests(urls, analysis_type="full", refresh=False):
+    """
+    Batch request lines for every paper in urls that is not already cached
+    (all of them with refresh). custom_id is the analysis cache key, so results
+    can be stored without any other bookkeeping. Papers whose text cannot be
+    fetched are skipped. Returns (requests, skipped_urls).
+    """
+    papers = {}
+    for url in urls:
+        key = analysis_cache_key(url, analysis_type)
+        if key in papers or (not refresh and analysis_cache.get(key) is not None):
+            continue
+        papers[key] = url
+
+    def prepare(item):
+        key, url = item
+        paper_text = fetch_paper_text(url)
+        if not paper_text:
+            return key, url, None
+        return key, url, build_chat_request(url, paper_text, analysis_type)
+
+    requests, skipped = [], []
+    # Nightly lists are mostly arXiv, so keep to the per-host download limit
+    with ThreadPoolExecutor(max_workers=PER_HOST_FETCHES) as pool:
+        for key, url, body in pool.map(prepare, papers.items()):
+            if body is None:
+                skipped.append(url)
+                continue
+            requests.append({
+                'custom_id': key,
+                'method': 'POST',
+                'url': BATCH_ENDPOINT,
+                'body': body
+            })
+
+    return requests, skipped
+
+
+def write_batch_file(requests, path):
+    """Write batch request lines as JSONL."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in requests:
+            f.write(json.dumps(line) + '\n')
+
+
+def submit_batch(client, path, description=None):
+    """Upload a JSONL request file and start a batch. Returns the batch object."""
+    with open(path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose='batch')
+
+    return client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window='24h',
+        metadata={'description': description or 'elacity cache prewarm'}
+    )
+
+
+def wait_for_batch(client, batch_id, poll_seconds=60, timeout_seconds=None):
+    """Poll until the batch reaches a terminal status (or timeout_seconds passes). Returns the batch."""
+    started = time.time()
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if timeout_seconds is not None and time.time() - started > timeout_seconds:
+            return batch
+
+        counts = batch.request_counts
+        progress = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+        logger.info("Batch in progress", batch_id=batch_id, status=batch.status, progress=progress)
+        time.sleep(poll_seconds)
+
+
+def _index_paper(key, payload):
+    """Add a batched analysis's paper to the related index and fingerprints, from its stored text."""
+    paper_id = cache_key_paper_id(key)
+    url = document_store.url_for(paper_id)
+    text = document_store.get(url) if url else None
+    if not text:
+        return
+    related.record(url, text, payload)
+    if fingerprint.CONTENT_DEDUP:
+        fingerprint.record(paper_id, url, text)
+
+
+def ingest_batch_results(client, batch):
+    """
+    Store every successful analysis from a finished batch in the analysis cache.
+    Returns counts of stored, unparseable and failed requests, and the batch's token usage.
+    """
+    counts = {'stored': 0, 'unparseable': 0, 'failed': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                logger.warning("Batch request failed", custom_id=record.get('custom_id'),
+                               error=record.get('error') or response.get('status_code'))
+                counts['failed'] += 1
+                continue
+
+            usage = usage_summary(response['body'].get('usage'))
+            for name, value in (usage or {}).items():
+                counts[name] += value
+
+            content = response['body']['choices'][0]['message']['content']
+            payload, ok = parse_analysis_result(content)
+            if ok and 'error' not in payload:
+                analysis_cache.set(record['custom_id'], payload)
+                _index_paper(record['custom_id'], payload)
+                counts['stored'] += 1
+            else:
+                counts['unparseable'] += 1
+
+    if batch.error_file_id:
+        errors = client.files.content(batch.error_file_id).text
+        counts['failed'] += sum(1 for line in errors.splitlines() if line.strip())
+
+    return counts
+
+
+def prewarm(urls, analysis_type="full", client=None, refresh=False, poll_seconds=60, work_dir=None):
+    """Build, submit, wait for and ingest one batch for urls. Returns the ingest counts (None if nothing to do)."""
+    client = client or OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+    requests, skipped = build_batch_requests(urls, analysis_type, refresh=refresh)
+    for url in skipped:
+        logger.warning("Skipping paper: could not fetch paper text", url=url)
+    if not requests:
+        logger.info("Nothing to submit: every paper is already cached or unavailable")
+        return None
+
+    work_dir = work_dir or os.path.join(os.path.dirname(analysis_cache.db_path), 'batches')
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, f"{analysis_type}-{int(time.time())}.jsonl")
+    write_batch_file(requests, path)
+
+    batch = submit_batch(client, path)
+    logger.info("Submitted batch", batch_id=batch.id, requests=len(requests), path=path)
+
+    batch = wait_for_batch(client, batch.id, poll_seconds)
+    if batch.status != 'completed':
+        logger.warning("Batch did not complete", batch_id=batch.id, status=batch.status)
+    return ingest_batch_results(client, batch)
+
+
+def _print_usage():
+    print("Usage: python ai/batch.py <urls_file> [full|quick] [--refresh] [--base-url URL] [--poll SECONDS]")
+    print("       python ai/batch.py --ingest <batch_id> [--base-url URL]")
+    print("urls_file has one paper URL per line; cached papers are skipped unless --refresh is given")
+
+
+def main():
+    """Main function for command line usage."""
+    if len(sys.argv) < 2:
+        _print_usage()
+        return
+
+    analysis_type = "full"
+    refresh = False
+    base_url = None
+    poll_seconds = 60
+    ingest_id = None
+    urls_file = None
+
+    # Parse arguments
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg == '--refresh':
+            refresh = True
+        elif arg == '--base-url':
+            base_url = next(args)
+        elif arg == '--poll':
+            poll_seconds = float(next(args))
+        elif arg == '--ingest':
+            ingest_id = next(args)
+        elif arg in ('full', 'quick'):
+            analysis_type = arg
+        else:
+            urls_file = arg
+
+    if not ingest_id and not urls_file:
+        _print_usage()
+        return
+
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=base_url)
+
+    if ingest_id:
+        # Pick up a batch submitted earlier (e.g. after the submitting process exited)
+        counts = ingest_batch_results(client, wait_for_batch(client, ingest_id, poll_seconds))
+    else:
+        with open(urls_file, encoding='utf-8') as f:
+            urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        counts = prewarm(urls, analysis_type, client=client, refresh=refresh, poll_seconds=poll_seconds)
+
+    if counts:
+        print(f"Stored {counts['stored']} analyses ({counts['unparseable']} unparseable, {counts['failed']} failed)")
+        print(f"Tokens: {counts['prompt_tokens']} prompt ({counts['cached_tokens']} cached), {counts['completion_tokens']} completion")
+
+
+if __name__ == "__main__":
+    main()
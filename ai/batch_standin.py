@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Elacity Batch API Stand-in
+Minimal local imitation of the OpenAI Files and Batches endpoints used by batch.py,
+for trying bulk pre-analysis without spending money or waiting hours.
+
+Batches move validating -> in_progress -> completed on successive status polls.
+Each request is answered with a canned analysis, or, with --forward, by a real
+synchronous chat completion.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+from flask import Flask, request, jsonify, Response
+
+app = Flask(__name__)
+
+files = {}
+batches = {}
+FORWARD = False
+
+
+def _file_object(file_id, filename, purpose, data):
+    return {
+        'id': file_id,
+        'object': 'file',
+        'bytes': len(data),
+        'created_at': int(time.time()),
+        'filename': filename,
+        'purpose': purpose
+    }
+
+
+def _store_file(filename, purpose, data):
+    file_id = f"file-{uuid.uuid4().hex}"
+    files[file_id] = {'meta': _file_object(file_id, filename, purpose, data), 'data': data}
+    return files[file_id]['meta']
+
+
+def _canned_completion(body):
+    """A chat completion whose content is a well-formed analysis for the request's prompt."""
+    # The output schema is in the system message (see prompt.QUICK_SUMMARY_SYSTEM_PROMPT)
+    system = body['messages'][0]['content']
+    if '"quick_summary"' in system:
+        content = {
+            'title': 'Stand-in Paper',
+            'quick_summary': 'A stand-in quick summary.',
+            'main_finding': 'No real finding.',
+            'relevance': 'Local testing only.',
+            'eli12': {
+                'quick_summary': 'A pretend summary.',
+                'main_finding': 'Nothing real.',
+                'relevance': 'Just for testing.'
+            }
+        }
+    else:
+        content = {
+            'title': 'Stand-in Paper',
+            'scores': {'methodological_rigor': 5, 'data_quality': 5, 'innovation_level': 5},
+            'summary': {'regular': 'A stand-in analysis.', 'eli12': 'A pretend analysis.'},
+            'key_insights': []
+        }
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': json.dumps(content)}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    }
+
+
+def _forwarded_completion(body):
+    from openai import OpenAI
+    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    return client.chat.completions.create(**body).model_dump()
+
+
+def _run_batch(batch):
+    """Answer every request line of the batch and attach the output file."""
+    lines = files[batch['input_file_id']]['data'].decode('utf-8').splitlines()
+    output = []
+    completed = failed = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        try:
+            body = _forwarded_completion(item['body']) if FORWARD else _canned_completion(item['body'])
+            response = {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': body}
+            error = None
+            completed += 1
+        except Exception as e:
+            response = None
+            error = {'code': 'server_error', 'message': str(e)}
+            failed += 1
+        output.append(json.dumps({'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': item['custom_id'], 'response': response, 'error': error}))
+
+    output_file = _store_file(f"{batch['id']}_output.jsonl", 'batch_output', ('\n'.join(output) + '\n').encode('utf-8'))
+    batch.update({
+        'status': 'completed',
+        'output_file_id': output_file['id'],
+        'completed_at': int(time.time()),
+        'request_counts': {'total': completed + failed, 'completed': completed, 'failed': failed}
+    })
+
+
+@app.route('/v1/files', methods=['POST'])
+def create_file():
+    upload = request.files['file']
+    return jsonify(_store_file(upload.filename, request.form.get('purpose', 'batch'), upload.read()))
+
+
+@app.route('/v1/files/<file_id>', methods=['GET'])
+def retrieve_file(file_id):
+    if file_id not in files:
+        return jsonify({'error': {'message': 'No such file', 'type': 'invalid_request_error'}}), 404
+    return jsonify(files[file_id]['meta'])
+
+
+@app.route('/v1/files/<file_id>/content', methods=['GET'])
+def file_content(file_id):
+    if file_id not in files:
+        return jsonify({'error': {'message': 'No such file', 'type': 'invalid_request_error'}}), 404
+    return Response(files[file_id]['data'], mimetype='application/jsonl')
+
+
+@app.route('/v1/batches', methods=['POST'])
+def create_batch():
+    data = request.get_json()
+    if data.get('input_file_id') not in files:
+        return jsonify({'error': {'message': 'No such input file', 'type': 'invalid_request_error'}}), 400
+
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    batches[batch_id] = {
+        'id': batch_id,
+        'object': 'batch',
+        'endpoint': data['endpoint'],
+        'input_file_id': data['input_file_id'],
+        'completion_window': data.get('completion_window', '24h'),
+        'status': 'validating',
+        'output_file_id': None,
+        'error_file_id': None,
+        'created_at': int(time.time()),
+        'completed_at': None,
+        'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+        'metadata': data.get('metadata')
+    }
+    return jsonify(batches[batch_id])
+
+
+@app.route('/v1/batches/<batch_id>', methods=['GET'])
+def retrieve_batch(batch_id):
+    batch = batches.get(batch_id)
+    if batch is None:
+        return jsonify({'error': {'message': 'No such batch', 'type': 'invalid_request_error'}}), 404
+
+    # Advance one step per poll so clients exercise their waiting loop
+    if batch['status'] == 'validating':
+        batch['status'] = 'in_progress'
+    elif batch['status'] == 'in_progress':
+        _run_batch(batch)
+    return jsonify(batch)
+
+
+if __name__ == '__main__':
+    FORWARD = '--forward' in sys.argv
+    port = int(os.getenv('BATCH_STANDIN_PORT', 8089))
+    print(f"Batch API stand-in on http://localhost:{port}/v1 (forwarding: {FORWARD})")
+    app.run(host='127.0.0.1', port=port)
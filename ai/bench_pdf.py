@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Elacity PDF Backend Benchmark
+Measures extraction speed (pages/sec) and text fidelity of each PDF backend on a local corpus.
+
+Fidelity is the word-level F1 against a ground-truth <name>.txt next to each PDF when one
+exists, otherwise against the reference backend's output.
+"""
+
+import os
+import re
+import sys
+import time
+from collections import Counter
+from pdf_extract import BACKENDS, available_backends, iter_page_texts
+
+
+def word_f1(candidate, reference):
+    """Word-bag F1 between two texts (1.0 = same words with the same counts)."""
+    candidate_words = Counter(re.findall(r'\w+', candidate.lower()))
+    reference_words = Counter(re.findall(r'\w+', reference.lower()))
+    if not candidate_words or not reference_words:
+        return 0.0
+
+    overlap = sum((candidate_words & reference_words).values())
+    precision = overlap / sum(candidate_words.values())
+    recall = overlap / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall) if overlap else 0.0
+
+
+def extract_all(content, backend):
+    """Full-document extraction with one backend. Returns (text, pages, seconds)."""
+    start = time.perf_counter()
+    pages = list(iter_page_texts(content, backend))
+    elapsed = time.perf_counter() - start
+    text = re.sub(r'\s+', ' ', ' '.join(pages)).strip()
+    return text, len(pages), elapsed
+
+
+def run_benchmark(corpus_dir, backends, reference, repeat=1):
+    """Benchmark every backend on every PDF in corpus_dir; returns per-backend totals."""
+    pdf_paths = sorted(
+        os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir) if name.lower().endswith('.pdf')
+    )
+    if not pdf_paths:
+        raise SystemExit(f"No PDFs found in {corpus_dir}")
+
+    totals = {name: {'documents': 0, 'pages': 0, 'seconds': 0.0, 'fidelity': [], 'failures': 0} for name in backends}
+
+    for path in pdf_paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+
+        truth_path = os.path.splitext(path)[0] + '.txt'
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding='utf-8') as f:
+                truth = f.read()
+        else:
+            truth = extract_all(content, reference)[0]
+
+        for name in backends:
+            try:
+                timings = [extract_all(content, name) for _ in range(repeat)]
+            except Exception as e:
+                print(f"  {name} failed on {os.path.basename(path)}: {e}")
+                totals[name]['failures'] += 1
+                continue
+
+            text, pages, _ = timings[0]
+            totals[name]['documents'] += 1
+            totals[name]['pages'] += pages
+            totals[name]['seconds'] += min(elapsed for _, _, elapsed in timings)
+            totals[name]['fidelity'].append(word_f1(text, truth))
+
+    return totals
+
+
+def print_report(totals, reference):
+    """Print a results table, fastest backend first."""
+    print(f"\n{'backend':<10} {'docs':>5} {'pages':>6} {'seconds':>9} {'pages/sec':>10} {'fidelity':>9} {'failures':>9}")
+    rows = sorted(totals.items(), key=lambda item: item[1]['seconds'] / max(item[1]['pages'], 1))
+    for name, total in rows:
+        pages_per_sec = total['pages'] / total['seconds'] if total['seconds'] else 0.0
+        fidelity = sum(total['fidelity']) / len(total['fidelity']) if total['fidelity'] else 0.0
+        print(f"{name:<10} {total['documents']:>5} {total['pages']:>6} {total['seconds']:>9.3f} "
+              f"{pages_per_sec:>10.1f} {fidelity:>9.3f} {total['failures']:>9}")
+    print(f"\nFidelity is word F1 against <name>.txt ground truth, or against '{reference}' output.")
+    print("Pick a backend with ELACITY_PDF_BACKEND=<name> (default: auto).")
+
+
+def main():
+    """Main function for command line usage."""
+    if len(sys.argv) < 2:
+        print("Usage: python ai/bench_pdf.py <pdf_directory> [backend ...] [--reference NAME] [--repeat N]")
+        print(f"Backends: {', '.join(BACKENDS)} (available here: {', '.join(available_backends())})")
+        return
+
+    corpus_dir = sys.argv[1]
+    backends = []
+    reference = None
+    repeat = 1
+
+    # Parse arguments
+    args = iter(sys.argv[2:])
+    for arg in args:
+        if arg == '--reference':
+            reference = next(args)
+        elif arg == '--repeat':
+            repeat = int(next(args))
+        else:
+            backends.append(arg)
+
+    available = available_backends()
+    backends = backends or available
+    missing = [name for name in backends if name not in available]
+    if missing:
+        raise SystemExit(f"Backend(s) not available here: {', '.join(missing)}")
+
+    # pdfminer is the slowest but usually the most faithful layout-aware extractor
+    reference = reference or ('pdfminer' if 'pdfminer' in available else backends[0])
+
+    print(f"Benchmarking {', '.join(backends)} on {corpus_dir} (reference: {reference})")
+    print_report(run_benchmark(corpus_dir, backends, reference, repeat), reference)
+
+
+if __name__ == "__main__":
+    main()
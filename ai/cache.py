@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Elacity Analysis Cache
+Two-tier cache for analysis results: an in-memory LRU in front of a SQLite store.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Default location for everything the backend persists between restarts
+CACHE_DIR = os.getenv('ELACITY_CACHE_DIR', os.path.join(os.path.dirname(__file__), '.cache'))
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with optional TTL expiry.
+    When max_size is set, entries are also evicted once the summed
+    sizeof(value) of all entries exceeds it.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=None, max_size=None, sizeof=len):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, stored_at = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, stored_at=None):
+        """Store value under key, evicting the least recently used entries."""
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, stored_at or time.time())
+            if self.max_size is not None:
+                self.size += self.sizeof(value)
+
+            while len(self._entries) > self.max_entries or (
+                self.max_size is not None and self.size > self.max_size and len(self._entries) > 1
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Remove key if present."""
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is not None and self.max_size is not None:
+            self.size -= self.sizeof(entry[0])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class AnalysisCache:
+    """Analysis results keyed by paper identity, kept in memory and on disk."""
+
+    def __init__(self, db_path, max_entries=256, ttl_seconds=7 * 24 * 3600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.memory = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'invalidations': 0
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS analyses ('
+                'key TEXT PRIMARY KEY, '
+                'value TEXT NOT NULL, '
+                'created_at REAL NOT NULL)'
+            )
+            self._conn.commit()
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def lookup(self, key):
+        """
+        Return (value, tier) for key, where tier is 'memory', 'disk' or None on a miss.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value, 'memory'
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM analyses WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is not None:
+            raw_value, created_at = row
+            if self.ttl_seconds and time.time() - created_at > self.ttl_seconds:
+                self.invalidate(key, count=False)
+            else:
+                value = json.loads(raw_value)
+                self.memory.set(key, value, stored_at=created_at)
+                self._count('disk_hits')
+                return value, 'disk'
+
+        self._count('misses')
+        return None, None
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        return self.lookup(key)[0]
+
+    def peek(self, key):
+        """Like get, but without counting a hit or miss or refreshing the memory tier."""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM analyses WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None or (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """Store a JSON-serialisable value in both tiers."""
+        created_at = time.time()
+        self.memory.set(key, value, stored_at=created_at)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO analyses (key, value, created_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), created_at)
+            )
+            self._conn.commit()
+            self._counters['writes'] += 1
+
+    def invalidate(self, key, count=True):
+        """Drop key from both tiers."""
+        self.memory.delete(key)
+        with self._lock:
+            self._conn.execute('DELETE FROM analyses WHERE key = ?', (key,))
+            self._conn.commit()
+            if count:
+                self._counters['invalidations'] += 1
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            counters = dict(self._counters)
+            disk_entries = self._conn.execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        hits = counters['memory_hits'] + counters['disk_hits']
+        counters.update({
+            'memory_entries': len(self.memory),
+            'disk_entries': disk_entries,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+        })
+        return counters
+
+
+def make_cache_key(paper_id, analysis_type, model, prompt_version, mode=None):
+    """
+    Build the cache key for one analysis of a paper (regular and ELI12 share it).
+    mode distinguishes alternative pipelines (e.g. 'long'); the standard one has none.
+    """
+    parts = [
+        paper_id,
+        analysis_type,
+        model,
+        f'prompt-v{prompt_version}'
+    ]
+    if mode:
+        parts.append(f'mode-{mode}')
+    return '|'.join(parts)
+
+
+def cache_key_paper_id(key):
+    """The paper ID a make_cache_key key was built from."""
+    parts = key.split('|')
+    if parts[-1].startswith('mode-'):
+        parts.pop()
+    return '|'.join(parts[:-3])
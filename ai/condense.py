@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Elacity Paper Condensation
+Fits extracted paper text into a token budget for the prompt. Sections are detected
+from their headings (abstract, introduction, method, results, conclusion, ...), references,
+acknowledgments, appendices and publisher boilerplate are dropped, and the budget is
+filled by section priority, so results and conclusions survive instead of being cut off.
+
+Tokens are counted with the target model's tiktoken encoding when tiktoken (and its
+encoding files) are available, otherwise estimated at ~4 characters per token.
+"""
+
+import os
+import re
+from log import get_logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Rough characters per token for English prose when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+OMISSION = ' [...] '
+
+# Heading phrases for each section kind, longest first within a kind
+SECTION_HEADINGS = {
+    'abstract': ['abstract'],
+    'introduction': ['introduction'],
+    'related': ['related work', 'related works', 'background', 'preliminaries', 'literature review', 'prior work'],
+    'method': ['methodology', 'methods', 'method', 'proposed method', 'our approach', 'approach', 'model architecture', 'model', 'framework'],
+    'results': ['experimental results', 'experimental setup', 'experiments', 'experiment', 'results', 'empirical evaluation', 'evaluation'],
+    'discussion': ['discussion', 'limitations', 'analysis'],
+    'conclusion': ['conclusions and future work', 'conclusion and future work', 'concluding remarks', 'conclusions', 'conclusion', 'summary'],
+    'references': ['references', 'bibliography'],
+    'acknowledgments': ['acknowledgments', 'acknowledgements', 'acknowledgment', 'acknowledgement'],
+    'appendix': ['appendices', 'appendix', 'supplementary material'],
+}
+
+# Never sent to the model
+DROPPED_KINDS = ('references', 'acknowledgments', 'appendix')
+
+# First pass: each kind gets up to this share of the budget, in this order.
+# 'front' is the title/author block before the first heading, 'body' a numbered
+# section whose heading is not one of the known names.
+SECTION_SHARES = [
+    ('abstract', 0.15),
+    ('conclusion', 0.15),
+    ('results', 0.20),
+    ('introduction', 0.15),
+    ('method', 0.15),
+    ('body', 0.15),
+    ('discussion', 0.10),
+    ('front', 0.05),
+    ('related', 0.05),
+]
+
+# Text without recognizable sections: share of the budget taken from the start (the rest from the end)
+HEAD_SHARE = 0.75
+
+_KNOWN_PHRASES = sorted(
+    ((phrase, kind) for kind, phrases in SECTION_HEADINGS.items() for phrase in phrases),
+    key=lambda item: -len(item[0])
+)
+
+# "3 Model Architecture", "4. Results", "II. RELATED WORK"
+_NUMBERED_HEADING = re.compile(r'(?<![\w.,(\[])(\d{1,2}|[IVX]{1,4})\.?\s+(?=[A-Z])')
+# "Abstract", "References", "ACKNOWLEDGMENTS" with no number
+_UNNUMBERED_HEADING = re.compile(
+    r'(?<![\w-])(' + '|'.join(re.escape(p) for p, _ in _KNOWN_PHRASES) + r')\b',
+    re.IGNORECASE
+)
+# Words that put a number in running text rather than in a heading ("Table 2 Results")
+_REFERENCE_WORDS = re.compile(r'(?<!\w)(?:table|tab|figure|fig|section|sec|eq|equation|algorithm|step|chapter|and|or|in|of|to|see|with)\.?\s*$', re.IGNORECASE)
+
+_BOILERPLATE = [
+    re.compile(r'arXiv:\d{4}\.\d{4,5}(?:v\d+)?\s*\[[\w.\-]+\]\s*\d{1,2}\s+\w{3}\s+\d{4}'),
+    re.compile(r'\d+(?:st|nd|rd|th) Conference on [^.]{5,200}?\(\w+ \d{4}\)[^.]{0,80}\.'),
+    re.compile(r'Preprint\. Under review\.'),
+    re.compile(r'Permission to make digital or hard copies of (?:all or )?part of this work.{0,600}?(?:\$\d+\.\d{2}|permissions@acm\.org)\.?', re.IGNORECASE),
+    re.compile(r'Provided proper attribution is provided, .{0,300}?scholarly works\.'),
+]
+
+# Small words that may appear inside a section title ("Analysis of the Results")
+_TITLE_JOINERS = {'a', 'an', 'and', 'as', 'for', 'from', 'in', 'of', 'on', 'the', 'to', 'via', 'vs', 'with'}
+
+# Words of search terms (index_terms), and the ones too common to help
+_WORD = re.compile(r'[a-z0-9]+')
+_STOPWORDS = frozenset(
+    'a an and are as at be been but by can did do does for from had has have how i if in into is it its '
+    'of on or our paper that the their them then there these they this those to was we were what when '
+    'where which while who why will with would you'.split()
+)
+
+_ROMAN = {'I': 1, 'II': 2, 'III': 3, 'IV': 4, 'V': 5, 'VI': 6, 'VII': 7, 'VIII': 8, 'IX': 9, 'X': 10, 'XI': 11, 'XII': 12}
+
+_encodings = {}
+
+logger = get_logger('condense')
+
+
+def get_encoding(model=None):
+    """tiktoken encoding for model (default OPENAI_MODEL), or None if unavailable."""
+    model = model or os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+    if model not in _encodings:
+        encoding = None
+        if tiktoken is not None:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    # Unknown (newer) model name: use the current OpenAI encoding
+                    encoding = tiktoken.get_encoding('o200k_base')
+            except Exception as e:
+                # Encoding files are downloaded on first use and may be unreachable
+                logger.warning("tiktoken unavailable; estimating tokens from length", model=model, error=str(e))
+        _encodings[model] = encoding
+    return _encodings[model]
+
+
+def count_tokens(text, model=None):
+    """Number of tokens text takes in model's prompt."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _cut(text, max_tokens, model, from_end=False):
+    """The first (or last) max_tokens tokens of text, cut at a word boundary."""
+    if max_tokens <= 0:
+        return ''
+    encoding = get_encoding(model)
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        if len(text) <= limit:
+            return text
+        piece = text[-limit:] if from_end else text[:limit]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        piece = encoding.decode(tokens[-max_tokens:] if from_end else tokens[:max_tokens])
+
+    # Drop the partial word at the cut
+    if from_end:
+        return piece.split(' ', 1)[1] if ' ' in piece else piece
+    return piece.rsplit(' ', 1)[0] if ' ' in piece else piece
+
+
+def split_by_tokens(text, max_tokens, model=None):
+    """Split text into consecutive pieces of at most max_tokens tokens, at word boundaries."""
+    pieces = []
+    while text:
+        piece = _cut(text, max_tokens, model)
+        if not piece:
+            # A single word longer than the limit
+            piece = text.split(' ', 1)[0]
+        pieces.append(piece)
+        text = text[len(piece):].lstrip()
+    return pieces
+
+
+def index_terms(text):
+    """Search terms in text: lowercase words and numbers without stopwords, plural 's' removed."""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word in _STOPWORDS or len(word) < 2:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def strip_boilerplate(text):
+    """Remove arXiv stamps, venue footers and copyright notices."""
+    for pattern in _BOILERPLATE:
+        text = pattern.sub(' ', text)
+    return re.sub(r'\s{2,}', ' ', text).strip()
+
+
+def _char_before(text, index):
+    """The last non-space character before index ('' at the start of text)."""
+    index -= 1
+    while index >= 0 and text[index].isspace():
+        index -= 1
+    return text[index] if index >= 0 else ''
+
+
+def _heading_kind(title):
+    lowered = title.lower()
+    for phrase, kind in _KNOWN_PHRASES:
+        if lowered.startswith(phrase) and (len(lowered) == len(phrase) or not lowered[len(phrase)].isalpha()):
+            return kind
+    return None
+
+
+def section_title(kind, body):
+    """
+    The heading at the start of a section's text as returned by find_sections
+    ("3 Model Architecture", "Abstract"); the title block before the first heading is 'Front matter'.
+    """
+    if kind == 'front':
+        return 'Front matter'
+
+    number = re.match(r'(?:\d{1,2}|[IVX]{1,4})\.?\s+', body)
+    prefix = number.end() if number else 0
+    rest = body[prefix:]
+    lowered = rest.lower()
+    for phrase, _ in _KNOWN_PHRASES:
+        if lowered.startswith(phrase):
+            return body[:prefix + len(phrase)]
+
+    # Unknown names: the capitalized words before the text starts, less the sentence's first word
+    words = []
+    for word in rest.split(' ', 12)[:12]:
+        if not (word[:1].isupper() or word[:1].isdigit() or (words and word in _TITLE_JOINERS)):
+            words = words[:-1] if len(words) > 1 else words
+            break
+        words.append(word)
+        if word[-1:] in '.,:;':
+            break
+    while words and words[-1] in _TITLE_JOINERS:
+        words.pop()
+    return (body[:prefix] + ' '.join(words)).strip(' .,:;') or kind.title()
+
+
+def find_sections(text):
+    """
+    Split whitespace-normalized paper text at its section headings.
+    Returns a list of (kind, start, end) covering the text in order; text before
+    the first heading is 'front'. Numbered headings are only accepted in sequence
+    (1, 2, 3, ...) so numbers in running text are not mistaken for them.
+    """
+    headings = []
+    numbered_ends = set()
+    expected = 1
+
+    for match in _NUMBERED_HEADING.finditer(text):
+        number = match.group(1)
+        number = _ROMAN.get(number) if number.isalpha() else int(number)
+        if number != expected or _REFERENCE_WORDS.search(text[max(0, match.start() - 12):match.start()]):
+            continue
+
+        kind = _heading_kind(text[match.end():match.end() + 40])
+        if kind is None:
+            # Unknown section names only count where a heading can start: after a sentence
+            before = _char_before(text, match.start())
+            if before and before not in '.:;!?)"':
+                continue
+            kind = 'body'
+        headings.append((match.start(), kind))
+        numbered_ends.add(match.end())
+        expected += 1
+
+    abstract_found = False
+    for match in _UNNUMBERED_HEADING.finditer(text):
+        if match.start() in numbered_ends:
+            continue
+
+        word = match.group(1)
+        kind = _heading_kind(word)
+        position = match.start() / max(len(text), 1)
+        before = _char_before(text, match.start())
+
+        if word.isupper() and len(word) > 1:
+            pass
+        elif word[0].isupper() and kind in ('abstract', 'references', 'acknowledgments', 'appendix'):
+            # Title-case headings without a number: only at a sentence or block boundary,
+            # except the abstract, which often follows an author's email or affiliation
+            if kind != 'abstract' and before and before not in '.:;!?)"' and not before.isdigit():
+                continue
+        else:
+            continue
+
+        # Abstracts open a paper (only the first one is a heading); references and appendices close it
+        if kind == 'abstract':
+            if position > 0.2 or abstract_found:
+                continue
+            abstract_found = True
+        if kind in DROPPED_KINDS and position < 0.4:
+            continue
+        headings.append((match.start(), kind))
+
+    sections = []
+    previous_start, previous_kind = 0, 'front'
+    for start, kind in sorted(headings):
+        if start > previous_start:
+            sections.append((previous_kind, previous_start, start))
+        previous_start, previous_kind = start, kind
+    sections.append((previous_kind, previous_start, len(text)))
+
+    # Anything after the references is back matter (unlabelled appendices)
+    for index, (kind, _, _) in enumerate(sections):
+        if kind in ('references', 'appendix'):
+            sections[index + 1:] = [('appendix', start, end) for _, start, end in sections[index + 1:]]
+            break
+
+    return sections
+
+
+def condense_text(text, token_budget, model=None):
+    """
+    Reduce paper text to at most token_budget tokens, keeping the most useful sections.
+    Text already within budget is returned with only references and boilerplate removed.
+    """
+    if not text:
+        return text
+
+    text = strip_boilerplate(text)
+    sections = [
+        (kind, text[start:end].strip())
+        for kind, start, end in find_sections(text)
+        if kind not in DROPPED_KINDS
+    ]
+    sections = [(kind, body) for kind, body in sections if body]
+    if not sections:
+        # Nothing but back matter was recognized; better the start than nothing
+        return _cut(text, token_budget, model)
+
+    counts = [count_tokens(body, model) for _, body in sections]
+    if sum(counts) <= token_budget:
+        return ' '.join(body for _, body in sections)
+
+    if len(sections) == 1:
+        # No structure found: opening plus ending, where conclusions usually are
+        head = _cut(text, int(token_budget * HEAD_SHARE), model)
+        tail = _cut(text[len(head):], token_budget - count_tokens(head, model) - 2, model, from_end=True)
+        return head + OMISSION + tail if tail else head
+
+    allowed = [0] * len(sections)
+    remaining = token_budget
+
+    def grant(index, tokens):
+        nonlocal remaining
+        extra = max(0, min(tokens, counts[index] - allowed[index], remaining))
+        allowed[index] += extra
+        remaining -= extra
+
+    # First pass: capped share per kind; second pass: leftovers in the same priority order
+    for kind, share in SECTION_SHARES:
+        kind_budget = int(token_budget * share)
+        for index, (section_kind, _) in enumerate(sections):
+            if section_kind == kind:
+                granted = allowed[index]
+                grant(index, kind_budget)
+                kind_budget -= allowed[index] - granted
+    for kind, _ in SECTION_SHARES:
+        for index, (section_kind, _) in enumerate(sections):
+            if section_kind == kind:
+                grant(index, remaining)
+
+    # Each omission marker costs a few tokens; keep the result inside the budget
+    pieces = []
+    for index, (_, body) in enumerate(sections):
+        if allowed[index] >= counts[index]:
+            pieces.append(body)
+        elif allowed[index] > 8:
+            pieces.append(_cut(body, allowed[index] - 4, model) + OMISSION.rstrip())
+    return ' '.join(pieces)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Elacity Request Deadlines
+A per-analysis deadline (ANALYSIS_TIMEOUT_SECONDS) carried in a context variable,
+so downloads, PDF extraction, admission waits and the OpenAI call all bound their
+own timeouts by the time the request has left without extra arguments.
+
+Stages that run out of time record why (e.g. 'partial_text') on the deadline; the
+pipeline reports those reasons with the result and does not cache it.
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+ANALYSIS_TIMEOUT_SECONDS = float(os.getenv('ANALYSIS_TIMEOUT_SECONDS', 30))
+
+# Degradation reasons
+PARTIAL_TEXT = 'partial_text'    # fetching or extraction stopped early; the text is incomplete
+NO_TEXT = 'no_text'              # no paper text (not in time, or none extracted); analyzed from the URL alone
+QUICK_SUMMARY = 'quick_summary'  # too little time left for a full analysis
+
+
+class DeadlineExceeded(Exception):
+    """Raised by a stage that cannot start or continue because the deadline has passed."""
+
+
+class Deadline:
+    """An absolute expiry time plus the degradation reasons recorded against it."""
+
+    def __init__(self, expires, degraded=None):
+        self.expires = expires
+        # Shared with nested deadlines so their reasons reach the request
+        self.degraded = degraded if degraded is not None else []
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+
+_current = contextvars.ContextVar('elacity_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds=ANALYSIS_TIMEOUT_SECONDS):
+    """
+    Run the block under a deadline seconds from now (None or <= 0 for no deadline).
+    An enclosing deadline that expires sooner stays in force.
+    """
+    outer = _current.get()
+    if not seconds or seconds <= 0 or (outer is not None and outer.remaining() <= seconds):
+        yield
+        return
+
+    token = _current.set(Deadline(time.monotonic() + seconds))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def reserve(seconds):
+    """Run the block under a deadline seconds earlier than the current one, keeping that time for later stages."""
+    outer = _current.get()
+    if outer is None:
+        yield
+        return
+
+    token = _current.set(Deadline(outer.expires - seconds, outer.degraded))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def detached():
+    """Run the block with no deadline, e.g. background work started on behalf of a request."""
+    token = _current.set(None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline (negative once passed), or None without one."""
+    current = _current.get()
+    return current.remaining() if current is not None else None
+
+
+def expired():
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def note(reason):
+    """Record that a stage degraded its result because of the deadline."""
+    current = _current.get()
+    if current is not None and reason not in current.degraded:
+        current.degraded.append(reason)
+
+
+def degraded():
+    """Degradation reasons recorded under the current deadline."""
+    current = _current.get()
+    return list(current.degraded) if current is not None else []
+
+
+def check(reason=None):
+    """Raise DeadlineExceeded (recording reason) if the deadline has passed."""
+    if expired():
+        if reason:
+            note(reason)
+        raise DeadlineExceeded('Analysis deadline exceeded')
+
+
+def timeout(default=None, reason=None):
+    """
+    A timeout for the next blocking call: default, shortened to the time left before the
+    deadline (default None means no limit of its own). Raises DeadlineExceeded if none is left.
+    """
+    check(reason)
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Elacity Document Store
+Extracted, normalized paper text per canonical URL, shared by every analysis mode.
+Documents are bounded by total size in memory and zlib-compressed on disk.
+Indexes built from a document's text (e.g. the Q&A search index) are kept next to it.
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import inspect
+import functools
+import threading
+from urllib.parse import urlsplit, urlunsplit
+from cache import LRUCache
+import deadline
+
+
+def canonical_url(url):
+    """Normalize a URL so trivial variants (case, fragment, trailing slash) share a document."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https', host, path, parts.query, ''))
+
+
+class DocumentStore:
+    """Two-tier store of extracted paper text, consulted before any network fetch."""
+
+    def __init__(self, db_path, key_fn=canonical_url, max_memory_chars=8_000_000, ttl_seconds=30 * 24 * 3600):
+        self.db_path = db_path
+        self.key_fn = key_fn
+        self.ttl_seconds = ttl_seconds
+        self.memory = LRUCache(max_entries=4096, ttl_seconds=ttl_seconds, max_size=max_memory_chars)
+
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS documents ('
+                'key TEXT PRIMARY KEY, '
+                'url TEXT NOT NULL, '
+                'text BLOB NOT NULL, '
+                'chars INTEGER NOT NULL, '
+                'created_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS indexes ('
+                'key TEXT NOT NULL, '
+                'name TEXT NOT NULL, '
+                'digest TEXT NOT NULL, '
+                'data BLOB NOT NULL, '
+                'created_at REAL NOT NULL, '
+                'PRIMARY KEY (key, name))'
+            )
+            self._conn.commit()
+
+    def get(self, url):
+        """Return the stored text for url, or None."""
+        key = self.key_fn(url)
+
+        text = self.memory.get(key)
+        if text is not None:
+            self._count('memory_hits')
+            return text
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT text, created_at FROM documents WHERE key = ?', (key,)
+            ).fetchone()
+
+        if row is not None and not (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+            text = zlib.decompress(row[0]).decode('utf-8')
+            self.memory.set(key, text, stored_at=row[1])
+            self._count('disk_hits')
+            return text
+
+        self._count('misses')
+        return None
+
+    def url_for(self, key):
+        """The URL the document stored under key (a key_fn value) was fetched from, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT url FROM documents WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, url, text):
+        """Store extracted text for url in both tiers."""
+        key = self.key_fn(url)
+        created_at = time.time()
+        self.memory.set(key, text, stored_at=created_at)
+
+        blob = zlib.compress(text.encode('utf-8'), 6)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents (key, url, text, chars, created_at) VALUES (?, ?, ?, ?, ?)',
+                (key, url, blob, len(text), created_at)
+            )
+            self._conn.commit()
+            self._counters['writes'] += 1
+
+    def invalidate(self, url):
+        """Drop the stored document for url, and the indexes built from it."""
+        key = self.key_fn(url)
+        self.memory.delete(key)
+        with self._lock:
+            self._conn.execute('DELETE FROM documents WHERE key = ?', (key,))
+            self._conn.execute('DELETE FROM indexes WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def items(self):
+        """Yield (url, text) for every stored document that has not expired, oldest first."""
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute('SELECT key FROM documents ORDER BY created_at')]
+        for key in keys:
+            with self._lock:
+                row = self._conn.execute('SELECT url, text, created_at FROM documents WHERE key = ?', (key,)).fetchone()
+            if row is not None and not (self.ttl_seconds and time.time() - row[2] > self.ttl_seconds):
+                yield row[0], zlib.decompress(row[1]).decode('utf-8')
+
+    def get_index(self, url, name, digest):
+        """
+        Return the JSON-serialisable index called name stored for url, or None if there is
+        none or it was built from other text (digest identifies the text it was built from).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT digest, data, created_at FROM indexes WHERE key = ? AND name = ?', (self.key_fn(url), name)
+            ).fetchone()
+        if row is None or row[0] != digest or (self.ttl_seconds and time.time() - row[2] > self.ttl_seconds):
+            return None
+        return json.loads(zlib.decompress(row[1]).decode('utf-8'))
+
+    def put_index(self, url, name, digest, index):
+        """Store an index built from url's text (identified by digest), replacing any older one."""
+        blob = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'), 6)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO indexes (key, name, digest, data, created_at) VALUES (?, ?, ?, ?, ?)',
+                (self.key_fn(url), name, digest, blob, time.time())
+            )
+            self._conn.commit()
+
+    def cached(self, fetcher):
+        """
+        Decorator for fetch_*_text functions (sync or async): serve from the store, remember
+        fresh results. Text cut short by the analysis deadline is returned but not stored.
+        """
+        if inspect.iscoroutinefunction(fetcher):
+            @functools.wraps(fetcher)
+            async def async_wrapper(url, *args, **kwargs):
+                text = self.get(url)
+                if text is not None:
+                    return text
+
+                text = await fetcher(url, *args, **kwargs)
+                if text and deadline.PARTIAL_TEXT not in deadline.degraded():
+                    self.put(url, text)
+                return text
+
+            return async_wrapper
+
+        @functools.wraps(fetcher)
+        def wrapper(url, *args, **kwargs):
+            text = self.get(url)
+            if text is not None:
+                return text
+
+            text = fetcher(url, *args, **kwargs)
+            if text and deadline.PARTIAL_TEXT not in deadline.degraded():
+                self.put(url, text)
+            return text
+
+        return wrapper
+
+    def stats(self):
+        """Return hit/miss counters and store sizes."""
+        with self._lock:
+            counters = dict(self._counters)
+            disk_entries, disk_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(LENGTH(text)), 0) FROM documents'
+            ).fetchone()
+
+        counters.update({
+            'memory_entries': len(self.memory),
+            'memory_chars': self.memory.size,
+            'disk_entries': disk_entries,
+            'disk_bytes': disk_bytes
+        })
+        return counters
+
+    def _count(self, counter):
+        with self._lock:
+            self._counters[counter] += 1
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Elacity Content Fingerprints
+Recognizes the same paper reached through different sites (arXiv, a PhilPapers archive
+PDF, an author's home page, ...), where URL-based identity cannot, so a mirror copy
+reuses the existing analysis instead of calling OpenAI again.
+
+Each extracted text gets a fingerprint: a SHA-256 of its normalized words (exact copies)
+and a MinHash sketch of its word shingles (near copies whose extraction differs slightly).
+Sketches are found through LSH bands and confirmed by their estimated Jaccard similarity
+(ELACITY_DUPLICATE_THRESHOLD).
+"""
+
+import os
+import re
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import NamedTuple
+import numpy as np
+from cache import CACHE_DIR
+from condense import strip_boilerplate
+
+CONTENT_DEDUP = os.getenv('ELACITY_CONTENT_DEDUP', 'true').lower() == 'true'
+# Estimated share of shingles two texts must have in common to count as the same paper
+DUPLICATE_THRESHOLD = float(os.getenv('ELACITY_DUPLICATE_THRESHOLD', 0.8))
+# Shorter texts (error pages, stubs) are too generic to match on
+MIN_WORDS = 300
+
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+# Fixed seed: signatures must be comparable across processes and restarts
+_MERSENNE = np.uint64((1 << 61) - 1)
+_random = np.random.RandomState(20240101)
+_A = _random.randint(1, 1 << 32, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _random.randint(0, 1 << 32, NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+class Fingerprint(NamedTuple):
+    """Exact hash of the normalized text and its MinHash signature."""
+    exact: str
+    signature: np.ndarray
+
+
+def fingerprint(text):
+    """Fingerprint extracted paper text, or None if it is too short to identify a paper."""
+    words = _WORD.findall(strip_boilerplate(text).lower())
+    if len(words) < MIN_WORDS:
+        return None
+
+    exact = hashlib.sha256(' '.join(words).encode('utf-8')).hexdigest()
+    shingles = {
+        zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    # One universal hash per permutation; keep each one's minimum over the shingles
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _MERSENNE
+    return Fingerprint(exact, permuted.min(axis=1).astype(np.uint32))
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.mean(signature == other))
+
+
+def _band_hashes(signature):
+    return [
+        hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+class FingerprintIndex:
+    """Fingerprints of every analyzed paper in SQLite, keyed by paper key, with LSH band lookups."""
+
+    def __init__(self, db_path, threshold=DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._reused = 0
+        with self._lock:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS fingerprints ('
+                'key TEXT PRIMARY KEY, '
+                'url TEXT NOT NULL, '
+                'exact TEXT NOT NULL, '
+                'signature BLOB NOT NULL, '
+                'created_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS fingerprints_exact ON fingerprints (exact)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS bands ('
+                'band INTEGER NOT NULL, '
+                'hash TEXT NOT NULL, '
+                'key TEXT NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS bands_lookup ON bands (band, hash)')
+            self._conn.commit()
+
+    def add(self, key, url, fp):
+        """Record the fingerprint of paper key (reached at url), replacing an older one."""
+        with self._lock:
+            self._conn.execute('DELETE FROM bands WHERE key = ?', (key,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO fingerprints (key, url, exact, signature, created_at) VALUES (?, ?, ?, ?, ?)',
+                (key, url, fp.exact, fp.signature.tobytes(), time.time())
+            )
+            self._conn.executemany(
+                'INSERT INTO bands (band, hash, key) VALUES (?, ?, ?)',
+                [(band, value, key) for band, value in enumerate(_band_hashes(fp.signature))]
+            )
+            self._conn.commit()
+
+    def matches(self, fp, exclude=None):
+        """Other papers with the same content as fp, as [(url, similarity)], most similar first."""
+        with self._lock:
+            rows = self._conn.execute('SELECT key, url FROM fingerprints WHERE exact = ?', (fp.exact,)).fetchall()
+            found = {key: (url, 1.0) for key, url in rows}
+
+            candidates = set()
+            for band, value in enumerate(_band_hashes(fp.signature)):
+                candidates.update(
+                    key for (key,) in self._conn.execute('SELECT key FROM bands WHERE band = ? AND hash = ?', (band, value))
+                )
+            for key in candidates - set(found):
+                row = self._conn.execute('SELECT url, signature FROM fingerprints WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    score = similarity(fp.signature, np.frombuffer(row[1], dtype=np.uint32))
+                    if score >= self.threshold:
+                        found[key] = (row[0], score)
+
+        found.pop(exclude, None)
+        return sorted(found.values(), key=lambda match: -match[1])
+
+    def count_reuse(self):
+        with self._lock:
+            self._reused += 1
+
+    def stats(self):
+        with self._lock:
+            papers = self._conn.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+            return {'papers': papers, 'reused': self._reused}
+
+
+# Shared by every entry point, next to the analysis cache
+fingerprints = FingerprintIndex(os.getenv('ELACITY_FINGERPRINT_DB', os.path.join(CACHE_DIR, 'fingerprints.sqlite3')))
+
+
+def record(key, url, text):
+    """Fingerprint text and record it for paper key. Returns the fingerprint (None for texts too short to identify)."""
+    fp = fingerprint(text)
+    if fp is not None:
+        fingerprints.add(key, url, fp)
+    return fp
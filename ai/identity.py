@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Elacity Paper Identity
+Maps every URL variant of a paper to one stable key, so the analysis cache, document
+store, reading-list dedup and request coalescing all see the same paper however the
+user reached it: abs or pdf pages, a trailing .pdf, version suffixes (v1, v2, ...),
+export.arxiv.org and other arxiv.org mirrors, query strings and fragments, and
+old-style archive IDs (hep-th/9901001).
+
+URLs are dispatched on their host to a few precompiled path patterns, so an arXiv-like
+number elsewhere in an unrelated URL is never taken for a paper ID.
+
+arXiv versions: keys leave the version out by default, so every version of a paper
+shares one analysis (the text of whichever version was fetched first). Set
+ELACITY_ARXIV_VERSIONED_KEYS=true to key explicitly versioned URLs per version.
+"""
+
+import os
+import re
+import functools
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+from docstore import canonical_url
+
+ARXIV_VERSIONED_KEYS = os.getenv('ELACITY_ARXIV_VERSIONED_KEYS', 'false').lower() == 'true'
+
+# New-style (2401.01234) and old-style (hep-th/9901001, math.AG/0601001) identifiers
+_ARXIV_ID = r'(?P<id>\d{4}\.\d{4,5}|[a-z][a-z-]*(?:\.[A-Z]{2})?/\d{7})(?:v(?P<version>\d+))?'
+
+_ARXIV_PATH = re.compile(r'^/(?:abs|pdf|html|format|ps)/' + _ARXIV_ID + r'(?:\.pdf)?/?$')
+# "arXiv:1706.03762" pasted instead of a URL
+_ARXIV_TEXT = re.compile(r'^arxiv:\s*' + _ARXIV_ID + r'$', re.IGNORECASE)
+_PHILPAPERS_PATH = re.compile(r'^/(?:archive|rec|browse)/(?P<id>[A-Z0-9][A-Z0-9-]*)(?:\.pdf)?/?$')
+_HARVARD_PATH = re.compile(r'^/~(?P<user>[^/]+)(?P<rest>/.*)?$')
+_ESSAY_PATH = re.compile(r'^/essays/(?P<slug>[^/]+)')
+
+# Key prefixes per source
+_PREFIXES = {'arxiv': 'arXiv', 'philpapers': 'PhilPapers', 'harvard': 'Harvard', 'essay': 'Essay'}
+
+
+class PaperIdentity(NamedTuple):
+    """A paper's source, its ID within that source (None for an unrecognized page) and arXiv version."""
+    source: str
+    id: Optional[str] = None
+    version: Optional[int] = None
+
+    @property
+    def key(self):
+        """The stable key for this paper ('arXiv:1706.03762'), or None without an ID."""
+        if self.id is None:
+            return None
+        if self.version is not None and ARXIV_VERSIONED_KEYS:
+            return f"{_PREFIXES[self.source]}:{self.id}v{self.version}"
+        return f"{_PREFIXES[self.source]}:{self.id}"
+
+
+def _arxiv(path):
+    match = _ARXIV_PATH.match(path)
+    if match is None:
+        return PaperIdentity('arxiv')
+    version = match.group('version')
+    return PaperIdentity('arxiv', match.group('id'), int(version) if version else None)
+
+
+def _philpapers(path):
+    match = _PHILPAPERS_PATH.match(path)
+    return PaperIdentity('philpapers', match.group('id') if match else None)
+
+
+def _harvard(path):
+    match = _HARVARD_PATH.match(path)
+    if match is None:
+        return PaperIdentity('harvard')
+    # Pages and PDFs under an author's directory are different papers
+    rest = (match.group('rest') or '').rstrip('/')
+    return PaperIdentity('harvard', f"{match.group('user')}{rest}")
+
+
+def _essay(path):
+    match = _ESSAY_PATH.match(path)
+    return PaperIdentity('essay', match.group('slug')) if match else None
+
+
+def _host_resolver(host):
+    """The path resolver for a host, or None for hosts without one."""
+    if host == 'arxiv.org' or host.endswith('.arxiv.org'):
+        return _arxiv
+    if host == 'philpapers.org':
+        return _philpapers
+    if host == 'people.math.harvard.edu':
+        return _harvard
+    if host == 'abrahamdada.com':
+        return _essay
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def resolve(url):
+    """The PaperIdentity of url; source 'generic' (with no ID) for pages no resolver knows."""
+    url = url.strip()
+    match = _ARXIV_TEXT.match(url)
+    if match:
+        version = match.group('version')
+        return PaperIdentity('arxiv', match.group('id'), int(version) if version else None)
+
+    parts = urlsplit(url if '://' in url else f'https://{url}')
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+
+    resolver = _host_resolver(host)
+    identity = resolver(parts.path) if resolver else None
+    return identity or PaperIdentity('generic')
+
+
+def paper_key(url):
+    """The stable key for url: the paper's key when its source has IDs, else the canonical URL."""
+    return resolve(url).key or canonical_url(url)
+
+
+def arxiv_pdf_url(url):
+    """The PDF download URL for an arXiv paper URL (keeping an explicit version); other URLs are returned unchanged."""
+    identity = resolve(url)
+    if identity.source != 'arxiv' or identity.id is None:
+        return url
+    version = f'v{identity.version}' if identity.version is not None else ''
+    return f"https://arxiv.org/pdf/{identity.id}{version}.pdf"
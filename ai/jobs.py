@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Elacity Analysis Jobs
+Bounded queue of analysis jobs drained by a fixed-size pool of worker threads,
+so request latency is decoupled from LLM latency and concurrency has a ceiling.
+"""
+
+import time
+import uuid
+import queue
+import threading
+from log import get_logger
+
+logger = get_logger('jobs')
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its configured depth."""
+
+    def __init__(self, retry_after):
+        super().__init__('Analysis queue is full')
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Analysis jobs with status tracking; finished jobs are kept for result_ttl_seconds."""
+
+    def __init__(self, handler, workers=4, max_queue=100, result_ttl_seconds=3600):
+        self.handler = handler
+        self.workers = workers
+        self.result_ttl_seconds = result_ttl_seconds
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._durations = []
+
+    def submit(self, params):
+        """Enqueue a job for handler(**params); returns its record or raises QueueFull."""
+        self._start_workers()
+        self._prune()
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'status': 'queued',
+            'params': params,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'cache': None,
+            'error': None
+        }
+
+        with self._lock:
+            try:
+                # Registered before queueing so a fast worker always finds it
+                self._jobs[job['job_id']] = job
+                self._queue.put_nowait(job['job_id'])
+                accepted = True
+            except queue.Full:
+                del self._jobs[job['job_id']]
+                accepted = False
+
+        if not accepted:
+            raise QueueFull(self.retry_after())
+        return dict(job)
+
+    def get(self, job_id):
+        """Return a copy of the job record, or None if unknown or expired."""
+        self._prune()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def retry_after(self):
+        """Seconds a rejected client should wait: queued work divided across the workers."""
+        with self._lock:
+            recent = self._durations[-50:]
+        average = sum(recent) / len(recent) if recent else 30
+        return max(1, int(average * (self._queue.qsize() + 1) / max(self.workers, 1)))
+
+    def stats(self):
+        """Queue depth and job counts by status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'workers': self.workers,
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self._queue.maxsize,
+            'jobs': counts
+        }
+
+    def _start_workers(self):
+        # Started on first use so importing the module never spawns threads
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'elacity-job-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job['status'] = 'running'
+                    job['started_at'] = time.time()
+            if job is None:
+                # Pruned while queued; still mark the queue entry done
+                self._queue.task_done()
+                continue
+
+            try:
+                result, cache_status = self.handler(**job['params'])
+                update = {'status': 'done', 'result': result, 'cache': cache_status}
+            except Exception as e:
+                logger.exception("Analysis job failed", job_id=job_id)
+                update = {'status': 'failed', 'error': str(e)}
+
+            with self._lock:
+                job.update(update)
+                job['finished_at'] = time.time()
+                self._durations.append(job['finished_at'] - job['started_at'])
+                del self._durations[:-50]
+            self._queue.task_done()
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl_seconds
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['finished_at'] is not None and job['finished_at'] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Elacity Incremental JSON Parser
+Consumes JSON text as it streams in and reports each value the moment it is complete,
+so partial analyses can be sent to the extension before the model finishes.
+"""
+
+import json
+
+_SCALAR_START = set('-0123456789tfn')
+_SCALAR_END = set(',}] \t\r\n')
+
+
+class _Frame:
+    """An open object or array and where its next child value goes."""
+
+    def __init__(self, kind, path, start):
+        self.kind = kind
+        self.path = path
+        self.start = start
+        self.key = None
+        self.expecting_key = kind == 'object'
+        self.index = 0
+
+
+class IncrementalJSONParser:
+    """
+    Feed JSON text in chunks with feed(); each call returns a list of
+    (path, value) pairs for values completed by that chunk. A path is a tuple
+    of object keys and array indexes, e.g. ('summary', 'regular') or
+    ('key_insights', 0); the finished document is reported with path ().
+    Values nested deeper than max_depth are not reported individually.
+    Text before the first '{' or '[' (such as a stray code fence) is ignored.
+    """
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.buffer = ''
+        self.done = False
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._string_is_key = False
+        self._scalar_start = None
+
+    def feed(self, chunk):
+        """Add text; return the (path, value) pairs completed by it."""
+        self.buffer += chunk
+        completed = []
+
+        while self._pos < len(self.buffer) and not self.done:
+            char = self.buffer[self._pos]
+
+            if self._in_string:
+                self._scan_string(char, completed)
+            elif self._scalar_start is not None and char in _SCALAR_END:
+                # Scalar ends before this character, which is then handled normally
+                self._complete(self._value_path(), self._scalar_start, self._pos, completed)
+                self._scalar_start = None
+                continue
+            elif self._scalar_start is None:
+                self._scan_structure(char, completed)
+
+            self._pos += 1
+
+        return completed
+
+    def _scan_string(self, char, completed):
+        if self._escape:
+            self._escape = False
+        elif char == '\\':
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._stack[-1].key = json.loads(self.buffer[self._string_start:self._pos + 1])
+            else:
+                self._complete(self._value_path(), self._string_start, self._pos + 1, completed)
+
+    def _scan_structure(self, char, completed):
+        top = self._stack[-1] if self._stack else None
+
+        if char in '{[':
+            kind = 'object' if char == '{' else 'array'
+            path = self._value_path() if top else ()
+            self._stack.append(_Frame(kind, path, self._pos))
+        elif top is None:
+            # Ignore anything outside the top-level value
+            return
+        elif char in '}]':
+            frame = self._stack.pop()
+            self._complete(frame.path, frame.start, self._pos + 1, completed)
+            if not self._stack:
+                self.done = True
+        elif char == '"':
+            self._in_string = True
+            self._string_start = self._pos
+            self._string_is_key = top.kind == 'object' and top.expecting_key
+        elif char == ':':
+            top.expecting_key = False
+        elif char == ',':
+            if top.kind == 'object':
+                top.expecting_key = True
+            else:
+                top.index += 1
+        elif char in _SCALAR_START:
+            self._scalar_start = self._pos
+
+    def _value_path(self):
+        top = self._stack[-1]
+        if top.kind == 'object':
+            return top.path + (top.key,)
+        return top.path + (top.index,)
+
+    def _complete(self, path, start, end, completed):
+        if len(path) > self.max_depth:
+            return
+        try:
+            completed.append((path, json.loads(self.buffer[start:end])))
+        except json.JSONDecodeError:
+            # Malformed fragment; the final full-document parse reports the error
+            pass
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Elacity Logging
+Structured (JSON-lines) logs on stderr, filtered by ELACITY_LOG_LEVEL.
+
+Records are handed to a bounded queue and written by a background thread, so a
+request never waits on the log sink; if the sink falls behind, records are dropped
+and counted rather than blocking. Paper text and raw model output are only logged
+at debug level, for a sampled fraction of requests, and cut to a size cap.
+"""
+
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+# Load environment variables from root directory
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+
+LOG_LEVEL = os.getenv('ELACITY_LOG_LEVEL', 'info').upper()
+
+# Fraction of payload debug records (paper excerpts, raw model output) that are kept
+PAYLOAD_SAMPLE_RATE = float(os.getenv('ELACITY_LOG_PAYLOAD_SAMPLE_RATE', 0.05))
+# Longest payload written into any record
+MAX_PAYLOAD_CHARS = int(os.getenv('ELACITY_LOG_MAX_PAYLOAD_CHARS', 1000))
+# Records waiting for the writer thread before new ones are dropped
+QUEUE_SIZE = int(os.getenv('ELACITY_LOG_QUEUE_SIZE', 10000))
+
+
+def truncate(text, limit=None):
+    """text cut to limit (default MAX_PAYLOAD_CHARS) characters, noting how much was cut."""
+    limit = MAX_PAYLOAD_CHARS if limit is None else limit
+    text = text if isinstance(text, str) else repr(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, then the record's fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Tracebacks can't cross to the writer thread; render them here, leave JSON encoding to it
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class StructuredLogger:
+    """Logger taking keyword fields: logger.info('Fetched paper', url=url, chars=n)."""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, **fields):
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg, **fields):
+        """Error record with the current exception's traceback."""
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+    def payload(self, msg, text, **fields):
+        """
+        Debug record carrying a (truncated) payload such as paper text or model output.
+        Only a PAYLOAD_SAMPLE_RATE fraction are written, each with the payload's full length.
+        """
+        if not self._logger.isEnabledFor(logging.DEBUG) or random.random() >= PAYLOAD_SAMPLE_RATE:
+            return
+        fields['payload_chars'] = len(text) if text is not None else None
+        fields['payload'] = truncate(text) if text is not None else None
+        self._log(logging.DEBUG, msg, fields)
+
+
+_root = logging.getLogger('elacity')
+_root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+_root.propagate = False
+
+_handler = _QueueHandler(queue.Queue(maxsize=QUEUE_SIZE))
+_root.addHandler(_handler)
+
+_stream = logging.StreamHandler(sys.stderr)
+_stream.setFormatter(JSONFormatter())
+_listener = logging.handlers.QueueListener(_handler.queue, _stream)
+_listener.start()
+# Flush whatever is still queued when the process exits
+atexit.register(_listener.stop)
+
+
+def get_logger(name):
+    """Structured logger for an Elacity module (e.g. get_logger('pipeline'))."""
+    return StructuredLogger(_root.getChild(name))
+
+
+def dropped_records():
+    """Records dropped because the writer thread fell behind."""
+    return _handler.dropped
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Elacity Long-Paper Analysis
+Opt-in map-reduce pipeline ("mode": "long") that covers a paper's whole extracted text
+instead of a condensed excerpt.
+
+The text is split into section-aligned chunks. Each chunk gets a small, cheap
+note-taking call (run concurrently, within the OpenAI admission limits), and one
+final call turns the notes into the usual full-analysis JSON. Chunk notes are cached
+by the chunk's content, in their own cache apart from analyses, so re-analyzing a
+paper only repeats the final call.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from condense import (
+    find_sections,
+    strip_boilerplate,
+    count_tokens,
+    split_by_tokens,
+    condense_text,
+    DROPPED_KINDS
+)
+from cache import AnalysisCache, make_cache_key, CACHE_DIR
+from prompt import (
+    SYSTEM_PREAMBLE,
+    call_openai,
+    chat_completion_request,
+    extract_paper_id
+)
+from async_prompt import call_openai_async
+from log import get_logger
+
+logger = get_logger('mapreduce')
+
+MODES = ('standard', 'long')
+
+# Paper tokens per note-taking call, and the most calls per paper (chunks grow to fit)
+CHUNK_TOKENS = int(os.getenv('ELACITY_LONG_CHUNK_TOKENS', 3000))
+MAX_CHUNKS = int(os.getenv('ELACITY_LONG_MAX_CHUNKS', 16))
+# Note-taking calls in flight per paper
+CONCURRENCY = int(os.getenv('ELACITY_LONG_CONCURRENCY', 4))
+# Note-taking can use a cheaper model than the final analysis
+MAP_MODEL = os.getenv('ELACITY_LONG_MAP_MODEL') or os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+MAP_MAX_TOKENS = int(os.getenv('ELACITY_LONG_MAP_MAX_TOKENS', 700))
+# Paper tokens (abstract first) sent alongside the notes in the final call
+OPENING_TOKENS = int(os.getenv('ELACITY_LONG_OPENING_TOKENS', 800))
+# Long analyses make several calls; they get this deadline instead of ANALYSIS_TIMEOUT_SECONDS
+TIMEOUT_SECONDS = float(os.getenv('ELACITY_LONG_TIMEOUT_SECONDS', 120))
+
+# Bump whenever CHUNK_SYSTEM_PROMPT changes so cached notes are not reused
+MAP_PROMPT_VERSION = "1"
+
+# Chunk notes, kept apart so they neither evict analyses nor skew the analysis cache counters
+notes_cache = AnalysisCache(
+    db_path=os.getenv('ELACITY_LONG_NOTES_DB', os.path.join(CACHE_DIR, 'chunk_notes.sqlite3')),
+    max_entries=int(os.getenv('ELACITY_LONG_NOTES_MEMORY_ENTRIES', 128)),
+    ttl_seconds=int(os.getenv('ELACITY_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+)
+
+# Degradation reason: some chunks produced no notes, so the analysis covers part of the paper
+MISSING_CHUNKS = 'missing_chunks'
+
+CHUNK_SYSTEM_PROMPT = SYSTEM_PREAMBLE + """
+
+You will be given one part of a longer academic paper, with the names of the sections it comes from. Take notes that another analyst, who will only see your notes for every part, can use to summarize and score the whole paper.
+
+Return ONLY a JSON object with this structure (use empty lists for anything this part does not contain):
+
+{
+  "key_points": ["[Main ideas and claims made in this part]"],
+  "methods": ["[Methods, models, experimental setup]"],
+  "results": ["[Findings, with specific numbers and metrics]"],
+  "data": ["[Datasets, sample sizes, data sources]"],
+  "limitations": ["[Limitations, weaknesses, threats to validity - stated or apparent]"]
+}
+
+Be specific and terse: at most 5 items per list, one sentence each."""
+
+
+def mode_error(mode, analysis_type):
+    """Why mode cannot be used for analysis_type (an API error message), or None if it can."""
+    if mode not in MODES:
+        return f"mode must be one of: {', '.join(MODES)}"
+    if mode == 'long' and analysis_type != 'full':
+        return "mode 'long' is only available for full analyses"
+    return None
+
+
+def split_into_chunks(text, chunk_tokens=CHUNK_TOKENS, max_chunks=MAX_CHUNKS):
+    """
+    Split paper text into section-aligned chunks of about chunk_tokens tokens (larger if
+    needed to stay within max_chunks). References, acknowledgments and appendices are
+    dropped. Returns a list of (section_kinds, text).
+    """
+    text = strip_boilerplate(text)
+    pieces = []
+    for kind, start, end in find_sections(text):
+        if kind in DROPPED_KINDS:
+            continue
+        body = text[start:end].strip()
+        if body:
+            pieces.append((kind, body, count_tokens(body)))
+
+    total = sum(tokens for _, _, tokens in pieces)
+    chunk_tokens = max(chunk_tokens, -(-total // max(max_chunks, 1)))
+
+    while True:
+        chunks = []
+        kinds, parts, size = [], [], 0
+        for kind, body, tokens in pieces:
+            # Sections longer than a chunk are split; shorter ones are packed together
+            for part in (split_by_tokens(body, chunk_tokens) if tokens > chunk_tokens else [body]):
+                part_tokens = tokens if part is body else count_tokens(part)
+                if parts and size + part_tokens > chunk_tokens:
+                    chunks.append((kinds, ' '.join(parts)))
+                    kinds, parts, size = [], [], 0
+                if kind not in kinds:
+                    kinds.append(kind)
+                parts.append(part)
+                size += part_tokens
+        if parts:
+            chunks.append((kinds, ' '.join(parts)))
+
+        if len(chunks) <= max_chunks:
+            return chunks
+        # Packing wastes space at section boundaries; loosen until it fits
+        chunk_tokens = int(chunk_tokens * 1.2) + 1
+
+
+def chunk_cache_key(chunk_text):
+    """Cache key for one chunk's notes: its content, the note-taking model and prompt version."""
+    digest = hashlib.sha256(chunk_text.encode('utf-8')).hexdigest()
+    return make_cache_key(f'chunk:{digest}', 'notes', MAP_MODEL, MAP_PROMPT_VERSION)
+
+
+def chunk_request(kinds, chunk_text, index, count):
+    """chat.completions.create arguments for the notes on one chunk."""
+    return {
+        'model': MAP_MODEL,
+        'response_format': {"type": "json_object"},
+        'messages': [
+            {"role": "system", "content": CHUNK_SYSTEM_PROMPT},
+            {"role": "user", "content": f"PART {index + 1} OF {count} (sections: {', '.join(kinds)})\n\n{chunk_text}"}
+        ],
+        'max_completion_tokens': MAP_MAX_TOKENS
+    }
+
+
+def _parse_notes(content):
+    try:
+        notes = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    return notes if isinstance(notes, dict) else None
+
+
+def reduce_request(url, paper_text, chunks, notes):
+    """The final full-analysis request: the paper's opening plus the notes on every part, in order."""
+    paper_id = extract_paper_id(url) or '[Unknown source]'
+    sections = []
+    for index, ((kinds, _), part_notes) in enumerate(zip(chunks, notes)):
+        if part_notes is not None:
+            sections.append(f"NOTES ON PART {index + 1} OF {len(chunks)} ({', '.join(kinds)}):\n{json.dumps(part_notes, ensure_ascii=False)}")
+
+    prompt = f"""Please analyze this academic paper. It is too long to send in full, so its opening is followed by notes taken from each part of the full text, in order. Base the scores and insights on the whole paper as the notes describe it.
+
+PAPER ID: {paper_id}
+
+PAPER OPENING:
+{condense_text(paper_text, OPENING_TOKENS)}
+
+{chr(10).join(sections)}"""
+    # Same system message as a standard analysis, so the cached prompt prefix is shared
+    return chat_completion_request(prompt, "full")
+
+
+def _add_usage(total, usage):
+    for name, value in (usage or {}).items():
+        total[name] = total.get(name, 0) + value
+
+
+def _cached_notes(chunks):
+    """Cached notes per chunk (None where missing) and the cache keys."""
+    keys = [chunk_cache_key(chunk_text) for _, chunk_text in chunks]
+    return [notes_cache.get(key) for key in keys], keys
+
+
+def _finish_map(keys, notes, index, content):
+    parsed = _parse_notes(content)
+    if parsed is not None:
+        notes_cache.set(keys[index], parsed)
+    notes[index] = parsed
+
+
+def _check_coverage(notes, errors):
+    """Raise if no chunk has notes (with the first failure, so an Overloaded still becomes a 429)."""
+    if all(part_notes is None for part_notes in notes):
+        raise errors[0] if errors else RuntimeError('No part of the paper could be analyzed')
+
+
+def analyze_long(url, paper_text):
+    """
+    Map-reduce analysis of the whole paper text. Chunk notes are read from and written to
+    notes_cache. Returns (content, usage, missing_chunks): the final completion, usage summed
+    over every call made, and how many chunks had no notes (and so were not covered).
+    """
+    chunks = split_into_chunks(paper_text)
+    notes, keys = _cached_notes(chunks)
+    missing = [index for index, part_notes in enumerate(notes) if part_notes is None]
+    usage, errors = {}, []
+    logger.info("Long analysis", url=url, chunks=len(chunks), cached_chunks=len(chunks) - len(missing))
+
+    def take_notes(index):
+        kinds, chunk_text = chunks[index]
+        return call_openai(chunk_request(kinds, chunk_text, index, len(chunks)))
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(CONCURRENCY, len(missing)), thread_name_prefix='elacity-long') as pool:
+            # Each call runs in a copy of this context, so it keeps the deadline and metric labels
+            futures = {index: pool.submit(contextvars.copy_context().run, take_notes, index) for index in missing}
+            for index, future in futures.items():
+                try:
+                    content, call_usage = future.result()
+                except Exception as e:
+                    logger.warning("Chunk notes failed", url=url, chunk=index, error=str(e))
+                    errors.append(e)
+                    continue
+                _add_usage(usage, call_usage)
+                _finish_map(keys, notes, index, content)
+
+    _check_coverage(notes, errors)
+
+    content, call_usage = call_openai(reduce_request(url, paper_text, chunks, notes))
+    _add_usage(usage, call_usage)
+    return content, usage, sum(1 for part_notes in notes if part_notes is None)
+
+
+async def analyze_long_async(url, paper_text):
+    """Event-loop counterpart of analyze_long."""
+    chunks = await asyncio.to_thread(split_into_chunks, paper_text)
+    notes, keys = _cached_notes(chunks)
+    missing = [index for index, part_notes in enumerate(notes) if part_notes is None]
+    usage, errors = {}, []
+    logger.info("Long analysis", url=url, chunks=len(chunks), cached_chunks=len(chunks) - len(missing))
+
+    limit = asyncio.Semaphore(CONCURRENCY)
+
+    async def take_notes(index):
+        kinds, chunk_text = chunks[index]
+        async with limit:
+            return await call_openai_async(chunk_request(kinds, chunk_text, index, len(chunks)))
+
+    results = await asyncio.gather(*(take_notes(index) for index in missing), return_exceptions=True)
+    for index, result in zip(missing, results):
+        if isinstance(result, Exception):
+            logger.warning("Chunk notes failed", url=url, chunk=index, error=str(result))
+            errors.append(result)
+            continue
+        content, call_usage = result
+        _add_usage(usage, call_usage)
+        _finish_map(keys, notes, index, content)
+
+    _check_coverage(notes, errors)
+
+    request = await asyncio.to_thread(reduce_request, url, paper_text, chunks, notes)
+    content, call_usage = await call_openai_async(request)
+    _add_usage(usage, call_usage)
+    return content, usage, sum(1 for part_notes in notes if part_notes is None)
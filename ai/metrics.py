@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Elacity Metrics
+Per-stage latency histograms and cache/in-flight gauges in the Prometheus text format,
+served at /api/metrics.
+
+Each analysis is timed in stages - fetch (download), extract (PDF/HTML to text),
+prompt (condense + build), llm (OpenAI), parse (JSON) and serialize (response body) -
+labeled with the paper's source type and the analysis type. Labels are carried in a
+context variable set once per analysis, so the timed functions need no extra arguments.
+"""
+
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from log import get_logger
+
+logger = get_logger('metrics')
+
+STAGES = ('fetch', 'extract', 'prompt', 'llm', 'parse', 'serialize')
+
+# Seconds; spans a cached lookup up to a long OpenAI completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Labels for whatever the current request/thread is analyzing
+_labels = contextvars.ContextVar('elacity_metric_labels', default={'source': 'unknown', 'analysis_type': 'unknown'})
+
+
+def set_labels(source, analysis_type):
+    """Label stage timings recorded from here on in this context."""
+    _labels.set({'source': source, 'analysis_type': analysis_type})
+
+
+def current_labels():
+    return dict(_labels.get())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed label set."""
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: dict(value, counts=list(value['counts'])) for key, value in self._series.items()}
+
+        for key in sorted(series):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series[key]['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[key]['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[key]['count']}")
+        return lines
+
+
+class Registry:
+    """Histograms plus collector callbacks that report gauges and counters at scrape time."""
+
+    def __init__(self):
+        self._histograms = []
+        self._collectors = []
+
+    def histogram(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def add_collector(self, collector):
+        """
+        Register collector(), which returns (name, type, help, samples) tuples with
+        samples a list of (labels_dict, value). Called on every scrape.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception:
+                logger.exception("Metrics collector failed", collector=getattr(collector, '__name__', repr(collector)))
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    'elacity_stage_duration_seconds',
+    'Time spent in each analysis stage.',
+    ('stage', 'source', 'analysis_type')
+)
+
+request_seconds = registry.histogram(
+    'elacity_request_duration_seconds',
+    'End-to-end API request latency.',
+    ('endpoint', 'source', 'analysis_type', 'cache')
+)
+
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage, **_labels.get())
+
+
+@contextmanager
+def timer(stage):
+    """Time the enclosed block as stage (errors are timed too)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """Decorator timing every call of a function or coroutine function as stage."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
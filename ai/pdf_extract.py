@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Elacity PDF Extraction
+Pluggable PDF-to-text backends behind a single page-streaming extraction function.
+
+Backends in auto order: pdftotext (poppler-utils binary), PyPDF2, pypdf, pdfminer.six.
+Set ELACITY_PDF_BACKEND to pick one explicitly; the default "auto" uses the first
+one available and falls back to the next if it fails on a document.
+Run bench_pdf.py on a local corpus to choose the fastest backend for a deployment.
+
+Parsing is CPU-bound, so it runs in a bounded process pool (ELACITY_PDF_WORKERS,
+0 = in-process) instead of on the request thread. With the page-addressable
+backends (PyPDF2, pypdf), large documents are split into page ranges that are
+extracted by several workers at once and reassembled in order. Workers read the
+document from a temporary file rather than receiving its bytes with every range, and
+start without re-running the parent's __main__ (server.py and its app, caches and queues).
+"""
+
+import io
+import os
+import re
+import shutil
+import tempfile
+import hashlib
+import threading
+import subprocess
+import multiprocessing
+from multiprocessing import spawn
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+import deadline
+from log import get_logger
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+try:
+    from pdfminer.high_level import extract_pages as pdfminer_extract_pages
+    from pdfminer.layout import LTTextContainer
+except ImportError:
+    pdfminer_extract_pages = None
+
+PDFTOTEXT_PATH = shutil.which('pdftotext')
+
+
+def _pdftotext_pages(content):
+    """Pages from poppler's pdftotext, which separates pages with form feeds."""
+    result = subprocess.run(
+        [PDFTOTEXT_PATH, '-q', '-enc', 'UTF-8', '-', '-'],
+        input=content,
+        capture_output=True,
+        timeout=deadline.timeout(60, deadline.PARTIAL_TEXT),
+        check=True
+    )
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    # Output ends with a form feed, leaving an empty chunk after the last page
+    if pages and not pages[-1].strip():
+        pages.pop()
+    for page_text in pages:
+        yield page_text
+
+
+def _pypdf_pages(content):
+    for page in pypdf.PdfReader(io.BytesIO(content)).pages:
+        yield page.extract_text() or ""
+
+
+def _pypdf2_pages(content):
+    for page in PyPDF2.PdfReader(io.BytesIO(content)).pages:
+        yield page.extract_text() or ""
+
+
+def _pdf_reader(content, backend):
+    """Random-access reader for the page-addressable backends."""
+    module = pypdf if backend == 'pypdf' else PyPDF2
+    return module.PdfReader(io.BytesIO(content))
+
+
+def _pdfminer_pages(content):
+    for layout in pdfminer_extract_pages(io.BytesIO(content)):
+        yield ''.join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+
+
+# Name -> (page iterator, available), in auto-selection order
+BACKENDS = {
+    'pdftotext': (_pdftotext_pages, PDFTOTEXT_PATH is not None),
+    'pypdf2': (_pypdf2_pages, PyPDF2 is not None),
+    'pypdf': (_pypdf_pages, pypdf is not None),
+    'pdfminer': (_pdfminer_pages, pdfminer_extract_pages is not None),
+}
+
+
+def available_backends():
+    """Names of the backends usable in this environment, in auto-selection order."""
+    return [name for name, (_, available) in BACKENDS.items() if available]
+
+
+def backend_order(backend=None):
+    """Backends to try for one document: the configured one first, then the rest."""
+    backend = (backend or os.getenv('ELACITY_PDF_BACKEND', 'auto')).lower()
+    order = available_backends()
+    if backend != 'auto':
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown PDF backend '{backend}'. Choose from: auto, {', '.join(BACKENDS)}")
+        if backend in order:
+            order.remove(backend)
+            order.insert(0, backend)
+    return order
+
+
+# Backends whose pages can be extracted independently by range
+PAGE_RANGE_BACKENDS = ('pypdf2', 'pypdf')
+
+PDF_WORKERS = int(os.getenv('ELACITY_PDF_WORKERS', os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.getenv('ELACITY_PDF_PAGES_PER_TASK', 8))
+
+logger = get_logger('pdf_extract')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Set on the thread starting a pool worker, so only that spawn leaves out __main__
+_starting_worker = threading.local()
+_preparation_data = spawn.get_preparation_data
+
+
+def _worker_preparation_data(name):
+    """spawn's preparation data, without the main module when a pool worker is being started."""
+    data = _preparation_data(name)
+    if getattr(_starting_worker, 'active', False):
+        data.pop('init_main_from_name', None)
+        data.pop('init_main_from_path', None)
+    return data
+
+
+spawn.get_preparation_data = _worker_preparation_data
+
+
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    """A spawned pool worker that starts with a bare __main__ instead of re-running the parent's."""
+
+    def start(self):
+        _starting_worker.active = True
+        try:
+            super().start()
+        finally:
+            _starting_worker.active = False
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+def get_pool():
+    """Shared extraction process pool, created on first use (None when disabled)."""
+    global _pool
+    if PDF_WORKERS <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=_WorkerContext())
+        return _pool
+
+
+def _reset_pool():
+    """Drop a broken pool so the next extraction starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def iter_page_texts(content, backend):
+    """Raw text of each page of a PDF, in order, using the named backend."""
+    return BACKENDS[backend][0](content)
+
+
+def extract_text(content, char_limit=None, backend=None):
+    """
+    Extract whitespace-normalized text from PDF bytes, one page at a time.
+    Stops reading pages as soon as more than char_limit characters have been
+    collected (the caller truncates). Falls back to the next available backend
+    if one fails. Under an analysis deadline, returns the pages read so far when
+    time runs out (raising DeadlineExceeded if there are none).
+    """
+    order = backend_order(backend)
+    if not order:
+        raise RuntimeError("No PDF extraction backend available - install PyPDF2, pypdf or pdfminer.six")
+
+    error = None
+    for name in order:
+        pool = get_pool()
+        try:
+            if pool is None or name == 'pdftotext':
+                # pdftotext already parses in its own process
+                return _extract_with(content, char_limit, name)
+            if name in PAGE_RANGE_BACKENDS:
+                return _extract_parallel(pool, content, char_limit, name)
+            return _result(pool.submit(_extract_with, content, char_limit, name))
+        except Exception as e:
+            if isinstance(e, deadline.DeadlineExceeded) or deadline.expired():
+                # Another backend would not finish in time either
+                deadline.note(deadline.PARTIAL_TEXT)
+                raise
+            logger.warning("PDF backend failed", backend=name, error=str(e))
+            if type(e).__name__ == 'BrokenProcessPool':
+                _reset_pool()
+            error = e
+    raise error
+
+
+def _result(future):
+    """A pool task's result, waiting no longer than the analysis deadline allows."""
+    try:
+        return future.result(timeout=deadline.timeout(reason=deadline.PARTIAL_TEXT))
+    except FutureTimeout:
+        future.cancel()
+        deadline.note(deadline.PARTIAL_TEXT)
+        raise deadline.DeadlineExceeded('Analysis deadline exceeded during PDF extraction')
+
+
+def _normalize_page(page_text):
+    # Replace multiple whitespace with single space
+    return re.sub(r'\s+', ' ', page_text).strip()
+
+
+def _extract_with(content, char_limit, backend):
+    parts = []
+    length = 0
+    for page_text in iter_page_texts(content, backend):
+        if parts and deadline.expired():
+            # Out of time: the opening pages (abstract, introduction) are better than nothing
+            deadline.note(deadline.PARTIAL_TEXT)
+            break
+        page_text = _normalize_page(page_text)
+        if not page_text:
+            continue
+
+        parts.append(page_text)
+        length += len(page_text) + 1
+        if char_limit is not None and length > char_limit:
+            break
+
+    return ' '.join(parts)
+
+
+# Per-worker-process (digest, backend, reader) of the last document parsed
+_worker_reader = None
+
+
+def _extract_page_range(path, digest, backend, start, stop):
+    """Worker task: normalized text of pages [start, stop) of the PDF at path, plus its page count."""
+    global _worker_reader
+    if _worker_reader is None or _worker_reader[:2] != (digest, backend):
+        with open(path, 'rb') as f:
+            _worker_reader = (digest, backend, _pdf_reader(f.read(), backend))
+    reader = _worker_reader[2]
+
+    page_count = len(reader.pages)
+    texts = [_normalize_page(reader.pages[index].extract_text() or "") for index in range(start, min(stop, page_count))]
+    return texts, page_count
+
+
+def _extract_parallel(pool, content, char_limit, backend):
+    """
+    Extract page ranges across the pool in waves, reassembling them in page order
+    and stopping (cancelling outstanding ranges) once char_limit is exceeded.
+    """
+    parts = []
+    length = 0
+
+    def consume(texts):
+        nonlocal length
+        for page_text in texts:
+            if not page_text:
+                continue
+            parts.append(page_text)
+            length += len(page_text) + 1
+            if char_limit is not None and length > char_limit:
+                return True
+        return False
+
+    # Workers read the document from disk; the digest tells them when it is one they have parsed
+    digest = hashlib.sha1(content).digest()
+    fd, path = tempfile.mkstemp(prefix='elacity-', suffix='.pdf')
+    with os.fdopen(fd, 'wb') as document:
+        document.write(content)
+
+    futures = []
+
+    def submit(start, stop):
+        future = pool.submit(_extract_page_range, path, digest, backend, start, stop)
+        futures.append(future)
+        return future
+
+    try:
+        # The first range also tells us how many pages there are
+        texts, page_count = _result(submit(0, PAGES_PER_TASK))
+        if consume(texts) or page_count <= PAGES_PER_TASK:
+            return ' '.join(parts)
+
+        ranges = [(start, start + PAGES_PER_TASK) for start in range(PAGES_PER_TASK, page_count, PAGES_PER_TASK)]
+        while ranges:
+            wave, ranges = ranges[:PDF_WORKERS], ranges[PDF_WORKERS:]
+            for future in [submit(start, stop) for start, stop in wave]:
+                try:
+                    done = consume(_result(future)[0])
+                except deadline.DeadlineExceeded:
+                    # Keep the pages already in order
+                    done = True
+                if done:
+                    return ' '.join(parts)
+        return ' '.join(parts)
+    finally:
+        _remove_when_idle(path, futures)
+
+
+def _remove_when_idle(path, futures):
+    """Cancel the ranges not yet started and delete the document at path once the running ones finish."""
+    running = [future for future in futures if not future.cancel() and not future.done()]
+    left = [len(running)]
+    lock = threading.Lock()
+
+    def remove():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def finished(_):
+        with lock:
+            left[0] -= 1
+            last = left[0] == 0
+        if last:
+            remove()
+
+    if not running:
+        remove()
+    for future in running:
+        future.add_done_callback(finished)
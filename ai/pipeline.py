@@ -0,0 +1,642 @@
+#!/usr/bin/env python3
+"""
+Elacity Analysis Pipeline
+Runs a paper URL through OpenAI analysis and JSON parsing, backed by the result cache.
+"""
+
+import os
+import json
+import queue
+import asyncio
+import threading
+import contextvars
+import metrics
+import log
+import deadline
+import mapreduce
+import related
+import fingerprint
+from prompt import (
+    fetch_paper_text,
+    build_chat_request,
+    call_openai,
+    stream_openai,
+    source_type,
+    document_key,
+    extract_paper_id,
+    select_analysis_view,
+    document_store,
+    PROMPT_VERSION
+)
+from jsonstream import IncrementalJSONParser
+from cache import AnalysisCache, make_cache_key, CACHE_DIR
+from singleflight import SingleFlight, AsyncSingleFlight
+from ratelimit import Overloaded, openai_admission
+from async_prompt import fetch_paper_text_async, call_openai_async
+
+# Shared result cache for every entry point (API server, CLI tools)
+analysis_cache = AnalysisCache(
+    db_path=os.getenv('ELACITY_CACHE_DB', os.path.join(CACHE_DIR, 'analyses.sqlite3')),
+    max_entries=int(os.getenv('ELACITY_CACHE_MAX_ENTRIES', 512)),
+    ttl_seconds=int(os.getenv('ELACITY_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+)
+
+logger = log.get_logger('pipeline')
+
+# Seconds kept back from fetching and extraction so a quick summary can still be produced
+QUICK_SUMMARY_SECONDS = float(os.getenv('ELACITY_QUICK_SUMMARY_SECONDS', 8))
+# Time a full analysis needs after fetching; with less, a quick summary is returned instead
+FULL_ANALYSIS_MIN_SECONDS = float(os.getenv('ELACITY_FULL_ANALYSIS_MIN_SECONDS', 15))
+
+# Concurrent identical requests share one fetch + OpenAI run
+in_flight = SingleFlight()
+async_in_flight = AsyncSingleFlight()
+
+
+class UsageTotals:
+    """Running OpenAI token counts, including prompt tokens served from OpenAI's prompt cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+
+    def add(self, usage):
+        with self._lock:
+            self._totals['requests'] += 1
+            for name in ('prompt_tokens', 'cached_tokens', 'completion_tokens'):
+                self._totals[name] += usage.get(name, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._totals)
+        stats['cached_ratio'] = round(stats['cached_tokens'] / stats['prompt_tokens'], 3) if stats['prompt_tokens'] else 0.0
+        return stats
+
+
+usage_totals = UsageTotals()
+
+# Usage of the OpenAI call made for the current request, if it made one
+last_usage = contextvars.ContextVar('elacity_last_usage', default=None)
+
+# Mock analysis returned by /api/test
+TEST_ANALYSIS = {
+    'title': 'Test Paper Analysis',
+    'arxiv_id': '2023.01234',
+    'scores': {
+        'methodological_rigor': 8,
+        'data_quality': 9,
+        'innovation_level': 7
+    },
+    'summary': {
+        'regular': 'This is a test summary of the paper with technical details about the methodology and findings.',
+        'eli12': 'This is a simple explanation that a 12-year-old could understand, using analogies and simple language.'
+    },
+    'key_insights': [
+        {
+            'insight': 'key_findings',
+            'level': 'Insight',
+            'description': 'Novel approach shows significant improvements over baseline methods',
+            'eli12_description': 'The new method works much better than old ways of doing things',
+            'color': '#3b82f6'
+        },
+        {
+            'insight': 'methodology_strength',
+            'level': 'Insight',
+            'description': 'Comprehensive evaluation across multiple datasets and metrics',
+            'eli12_description': 'The scientists tested their idea in many different ways to make sure it works',
+            'color': '#3b82f6'
+        }
+    ]
+}
+
+
+def _collect_metrics():
+    """Cache, document store, in-flight and token counters for /api/metrics."""
+    cache = analysis_cache.stats()
+    documents = document_store.stats()
+    usage = usage_totals.stats()
+    admission = openai_admission.stats()
+    return [
+        ('elacity_analysis_cache_entries', 'gauge', 'Cached analyses per tier.',
+         [({'tier': 'memory'}, cache['memory_entries']), ({'tier': 'disk'}, cache['disk_entries'])]),
+        ('elacity_analysis_cache_lookups_total', 'counter', 'Analysis cache lookups by outcome.',
+         [({'result': 'memory_hit'}, cache['memory_hits']), ({'result': 'disk_hit'}, cache['disk_hits']),
+          ({'result': 'miss'}, cache['misses'])]),
+        ('elacity_analysis_cache_writes_total', 'counter', 'Analyses written to the cache.',
+         [({}, cache['writes'])]),
+        ('elacity_document_store_entries', 'gauge', 'Stored paper texts per tier.',
+         [({'tier': 'memory'}, documents['memory_entries']), ({'tier': 'disk'}, documents['disk_entries'])]),
+        ('elacity_document_store_lookups_total', 'counter', 'Document store lookups by outcome.',
+         [({'result': 'memory_hit'}, documents['memory_hits']), ({'result': 'disk_hit'}, documents['disk_hits']),
+          ({'result': 'miss'}, documents['misses'])]),
+        ('elacity_in_flight_analyses', 'gauge', 'Distinct analyses currently running.',
+         [({'mode': 'thread'}, in_flight.in_flight()), ({'mode': 'async'}, async_in_flight.in_flight())]),
+        ('elacity_in_flight_waiters', 'gauge', 'Requests waiting on another request\'s analysis.',
+         [({}, in_flight.waiting())]),
+        ('elacity_openai_requests_total', 'counter', 'OpenAI completions made.',
+         [({}, usage['requests'])]),
+        ('elacity_openai_tokens_total', 'counter', 'OpenAI tokens by kind (cached is a subset of prompt).',
+         [({'kind': 'prompt'}, usage['prompt_tokens']), ({'kind': 'cached'}, usage['cached_tokens']),
+          ({'kind': 'completion'}, usage['completion_tokens'])]),
+        ('elacity_openai_admissions_total', 'counter', 'OpenAI calls by admission outcome (delayed and retried are subsets of admitted).',
+         [({'outcome': outcome}, admission[outcome]) for outcome in ('admitted', 'delayed', 'shed', 'retried')]),
+        ('elacity_duplicate_analyses_total', 'counter', 'Analyses reused from another URL with the same paper text.',
+         [({}, fingerprint.fingerprints.stats()['reused'])]),
+        ('elacity_log_records_dropped_total', 'counter', 'Log records dropped because the log writer fell behind.',
+         [({}, log.dropped_records())]),
+    ]
+
+
+metrics.registry.add_collector(_collect_metrics)
+
+
+def record_usage(key, usage):
+    """Count an OpenAI call's tokens and make them visible to the current request."""
+    if not usage:
+        return
+    usage_totals.add(usage)
+    last_usage.set(usage)
+    logger.info("OpenAI usage", key=key, **usage)
+
+
+def usage_headers():
+    """Response headers with the current request's OpenAI token usage (none if it made no call)."""
+    usage = last_usage.get()
+    if not usage:
+        return {}
+    return {
+        'X-Elacity-Prompt-Tokens': str(usage['prompt_tokens']),
+        'X-Elacity-Cached-Tokens': str(usage['cached_tokens']),
+        'X-Elacity-Completion-Tokens': str(usage['completion_tokens'])
+    }
+
+
+def analysis_cache_key(url, analysis_type="full", mode="standard"):
+    """Cache key for an analysis request, falling back to the URL for unknown sources."""
+    paper_id = document_key(url)
+    model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+    # Standard keys carry no mode, so they still match entries cached before long mode.
+    # Harvard and unknown-site keys changed with identity.py (they now include the path);
+    # their older entries are never hit again and expire after ELACITY_CACHE_TTL_SECONDS.
+    return make_cache_key(paper_id, analysis_type, model, PROMPT_VERSION,
+                          mode=mode if mode != 'standard' else None)
+
+
+def _timeout_for_mode(timeout, mode):
+    """Long analyses make several OpenAI calls, so their deadline is at least mapreduce.TIMEOUT_SECONDS."""
+    if mode == 'long' and timeout:
+        return max(timeout, mapreduce.TIMEOUT_SECONDS)
+    return timeout
+
+
+@metrics.timed('parse')
+def parse_analysis_result(result):
+    """
+    Turn raw OpenAI output into a response payload.
+    Returns (payload, ok) where ok is False for empty or unparseable output.
+    """
+    logger.payload("Raw OpenAI result", result)
+
+    # Check if result is empty or None
+    if not result or result.strip() == "":
+        logger.warning("Empty result from OpenAI API")
+        return {
+            'title': 'Analysis Error',
+            'error': 'OpenAI API returned empty response',
+            'raw_analysis': result
+        }, False
+
+    # Strip all markdown and parse JSON - BULLETPROOF approach
+    clean_result = result.strip()
+
+    # Remove any ```json or ``` at the start
+    if clean_result.startswith('```json'):
+        clean_result = clean_result[7:]  # Remove ```json
+    elif clean_result.startswith('```'):
+        clean_result = clean_result[3:]   # Remove ```
+
+    # Remove any ``` at the end
+    if clean_result.endswith('```'):
+        clean_result = clean_result[:-3]  # Remove trailing ```
+
+    # Strip whitespace and newlines
+    clean_result = clean_result.strip()
+
+    try:
+        return json.loads(clean_result), True
+    except json.JSONDecodeError as e:
+        logger.warning("JSON parsing failed", error=str(e), chars=len(clean_result), start=log.truncate(clean_result, 200))
+        return {
+            'title': 'Analysis Complete',
+            'raw_analysis': result,
+            'clean_result': clean_result,
+            'error': 'Could not parse analysis as structured data'
+        }, False
+
+
+def run_analysis(url, analysis_type="full", eli12=False, no_cache=False, invalidate=False,
+                 timeout=deadline.ANALYSIS_TIMEOUT_SECONDS, mode="standard"):
+    """
+    Analyze a paper, serving repeat requests from the cache.
+
+    One combined (regular + ELI12) result is produced and cached per paper;
+    eli12 only selects which view of it is returned.
+
+    no_cache skips the cache lookup (a fresh result is still stored);
+    invalidate drops any cached entry (and the stored document text) before analyzing.
+    Otherwise a paper whose text matches one already analyzed under another URL reuses
+    that analysis (see fingerprint.py).
+    Concurrent requests for the same key attach to a single running analysis.
+    The analysis runs under a deadline of timeout seconds (None for none); if time
+    runs short the payload is degraded (see _analyze_and_store) rather than late.
+    mode 'long' analyzes the whole paper text with map-reduce (see mapreduce.py)
+    instead of a condensed excerpt; it is cached separately from standard analyses.
+    Returns (payload, cache_status) where cache_status is one of
+    'memory', 'disk', 'miss', 'bypass' or 'coalesced'. When this call ran the
+    OpenAI request itself, its token usage is left in last_usage.
+    """
+    key = analysis_cache_key(url, analysis_type, mode)
+    last_usage.set(None)
+    metrics.set_labels(source_type(url), analysis_type)
+
+    if invalidate:
+        analysis_cache.invalidate(key)
+        document_store.invalidate(url)
+
+    if not no_cache:
+        cached, tier = analysis_cache.lookup(key)
+        if cached is not None:
+            return select_analysis_view(cached, analysis_type, eli12), tier
+
+    with deadline.deadline(_timeout_for_mode(timeout, mode)):
+        payload, shared = in_flight.do(key, _analyze_and_store, key, url, analysis_type, mode,
+                                     not (no_cache or invalidate))
+    payload = _select_view(payload, analysis_type, eli12)
+    if shared:
+        return payload, 'coalesced'
+
+    return payload, 'bypass' if no_cache else 'miss'
+
+
+def error_payload(error):
+    """Response payload for an analysis that failed before producing any model output."""
+    return {
+        'title': 'Analysis Error',
+        'error': f"Error analyzing paper: {str(error)}"
+    }
+
+
+def _store_parsed(cache, key, result):
+    payload, ok = parse_analysis_result(result)
+    if ok and 'error' not in payload and not deadline.degraded():
+        cache.set(key, payload)
+    return payload
+
+
+def call_and_store(cache, key, request):
+    """
+    Make one OpenAI call and keep its parsed result in cache under key, unless it failed
+    or the deadline degraded it (the section and Q&A endpoints).
+    Raises Overloaded when OpenAI has no capacity.
+    """
+    try:
+        result, usage = call_openai(request)
+        record_usage(key, usage)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("OpenAI call failed", key=key)
+        return error_payload(e)
+    return _store_parsed(cache, key, result)
+
+
+async def call_and_store_async(cache, key, request):
+    """Event-loop counterpart of call_and_store."""
+    try:
+        result, usage = await call_openai_async(request)
+        record_usage(key, usage)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("OpenAI call failed", key=key)
+        return error_payload(e)
+    return _store_parsed(cache, key, result)
+
+
+def _select_view(payload, analysis_type, eli12):
+    # A full analysis degraded to a quick summary is viewed as one
+    if deadline.QUICK_SUMMARY in payload.get('degraded', ()):
+        analysis_type = 'quick'
+    return select_analysis_view(payload, analysis_type, eli12)
+
+
+def _type_for_time_left(analysis_type, paper_text):
+    """The analysis to run with the time left before the deadline, recording any degradation."""
+    if paper_text is None and deadline.degraded():
+        deadline.note(deadline.NO_TEXT)
+
+    left = deadline.remaining()
+    if analysis_type == 'full' and left is not None and left < FULL_ANALYSIS_MIN_SECONDS:
+        deadline.note(deadline.QUICK_SUMMARY)
+        return 'quick'
+    return analysis_type
+
+
+def _runs_long(mode, run_type, paper_text):
+    """Whether to map-reduce: long mode, a full analysis (not degraded to quick) and text to split."""
+    return mode == 'long' and run_type == 'full' and bool(paper_text)
+
+
+def _result_reasons(paper_text, missing):
+    """Degradation reasons the deadline does not record: no paper text (with or without a deadline) and chunks left out."""
+    reasons = [] if paper_text else [deadline.NO_TEXT]
+    if missing:
+        reasons.append(mapreduce.MISSING_CHUNKS)
+    return reasons
+
+
+def _store_result(key, url, payload, reasons=()):
+    """
+    Cache a successful analysis, marking degraded ones. A quick summary produced in place
+    of a full analysis is cached as the paper's quick summary; results from partial or
+    missing text (or chunks) are not cached, so the next request gets a complete analysis.
+    reasons adds degradation reasons not recorded on the deadline.
+    """
+    reasons = deadline.degraded() + [reason for reason in reasons if reason not in deadline.degraded()]
+    if not reasons:
+        analysis_cache.set(key, payload)
+        return payload
+
+    if reasons == [deadline.QUICK_SUMMARY]:
+        analysis_cache.set(analysis_cache_key(url, 'quick'), payload)
+    logger.info("Analysis degraded", key=key, reasons=reasons)
+    return dict(payload, degraded=reasons)
+
+
+def _duplicate_analysis(key, url, paper_text, analysis_type, mode, reuse=True):
+    """
+    Record this paper's fingerprint for later copies and, with reuse, return a cached
+    analysis of the same text reached through another URL (a mirror or publisher copy),
+    relabelled with this paper's ID, or None. Text cut short by the deadline is neither
+    recorded nor matched.
+    """
+    if not fingerprint.CONTENT_DEDUP or not paper_text or deadline.PARTIAL_TEXT in deadline.degraded():
+        return None
+    paper = document_key(url)
+    with metrics.timer('prompt'):
+        fp = fingerprint.record(paper, url, paper_text)
+    if fp is None or not reuse:
+        return None
+
+    for other_url, similarity in fingerprint.fingerprints.matches(fp, exclude=paper):
+        # Probing mirrors is not a lookup of this request, so it must not count as a hit or miss
+        payload = analysis_cache.peek(analysis_cache_key(other_url, analysis_type, mode))
+        if payload is not None:
+            fingerprint.fingerprints.count_reuse()
+            logger.info("Reusing analysis of duplicate paper", key=key, duplicate_of=other_url, similarity=round(similarity, 3))
+            if 'paper_id' in payload:
+                payload = dict(payload, paper_id=extract_paper_id(url) or '[Unknown source]')
+            return payload
+    return None
+
+
+def _analyze_and_store(key, url, analysis_type, mode="standard", reuse_duplicates=True):
+    """
+    Run the fetch -> build -> call -> parse pipeline once and cache a successful result.
+
+    Under a deadline, fetching and extraction stop QUICK_SUMMARY_SECONDS early (keeping the
+    pages read so far), and a full analysis with less than FULL_ANALYSIS_MIN_SECONDS left
+    becomes a quick summary; the payload's 'degraded' lists what happened.
+    With reuse_duplicates, text matching an already analyzed paper skips the OpenAI call;
+    either way the text's fingerprint is recorded.
+    Raises Overloaded when OpenAI has no capacity, so callers can ask the client to retry.
+    """
+    missing = 0
+    try:
+        with deadline.reserve(QUICK_SUMMARY_SECONDS):
+            paper_text = fetch_paper_text(url)
+        duplicate = _duplicate_analysis(key, url, paper_text, analysis_type, mode, reuse_duplicates)
+        if duplicate is not None:
+            return _store_result(key, url, duplicate)
+        run_type = _type_for_time_left(analysis_type, paper_text)
+        if _runs_long(mode, run_type, paper_text):
+            result, usage, missing = mapreduce.analyze_long(url, paper_text)
+        else:
+            with metrics.timer('prompt'):
+                request = build_chat_request(url, paper_text, run_type)
+            result, usage = call_openai(request)
+        record_usage(key, usage)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("Analysis failed", key=key, url=url)
+        return error_payload(e)
+
+    payload, ok = parse_analysis_result(result)
+
+    # Only successful, structured analyses are worth keeping
+    if ok and 'error' not in payload:
+        payload = _store_result(key, url, payload, _result_reasons(paper_text, missing))
+        related.record(url, paper_text, payload)
+
+    return payload
+
+
+def _progress_event(path, value):
+    """Map a completed JSON value to a progress event, or None if it is not reported on its own."""
+    if len(path) == 1:
+        if path[0] in ('title', 'scores'):
+            return path[0], value
+        if path[0] not in ('summary', 'key_insights', 'eli12'):
+            return 'field', {'name': path[0], 'value': value}
+    elif len(path) == 2:
+        if path[0] == 'summary':
+            return 'summary', {'variant': path[1], 'text': value}
+        if path[0] == 'key_insights':
+            return 'insight', {'index': path[1], 'insight': value}
+    return None
+
+
+def _replay_events(payload):
+    """The progress events a stream of payload would have sent."""
+    for name, value in payload.items():
+        if name == 'summary' and isinstance(value, dict):
+            parts = [(('summary', variant), text) for variant, text in value.items()]
+        elif name == 'key_insights' and isinstance(value, list):
+            parts = [(('key_insights', index), insight) for index, insight in enumerate(value)]
+        else:
+            parts = [((name,), value)]
+        for path, part in parts:
+            event = _progress_event(path, part)
+            if event:
+                yield event
+
+
+def _stream_and_store(key, url, analysis_type, emit, reuse_duplicates=True):
+    """
+    _analyze_and_store with the OpenAI call streamed: emit(path, value) is called for each
+    part of the model's JSON as it completes. Returns the payload like _analyze_and_store.
+    """
+    parser = IncrementalJSONParser()
+    usage = {}
+    try:
+        with deadline.reserve(QUICK_SUMMARY_SECONDS):
+            paper_text = fetch_paper_text(url)
+        duplicate = _duplicate_analysis(key, url, paper_text, analysis_type, "standard", reuse_duplicates)
+        if duplicate is not None:
+            return _store_result(key, url, duplicate)
+        run_type = _type_for_time_left(analysis_type, paper_text)
+        with metrics.timer('prompt'):
+            request = build_chat_request(url, paper_text, run_type)
+        with metrics.timer('llm'):
+            for delta in stream_openai(request, usage):
+                for path, value in parser.feed(delta):
+                    emit(path, value)
+        record_usage(key, usage)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("Analysis failed", key=key, url=url)
+        return error_payload(e)
+
+    payload, ok = parse_analysis_result(parser.buffer)
+
+    if ok and 'error' not in payload:
+        payload = _store_result(key, url, payload, _result_reasons(paper_text, 0))
+        related.record(url, paper_text, payload)
+
+    return payload
+
+
+# Marks the end of a stream's events; its value is the in_flight outcome
+_STREAM_DONE = object()
+
+
+def stream_analysis(url, analysis_type="full", eli12=False, no_cache=False, timeout=deadline.ANALYSIS_TIMEOUT_SECONDS):
+    """
+    Analyze a paper progressively, yielding (event, data) pairs: 'title', 'scores',
+    'summary', 'insight' and 'field' as each part of the model's JSON completes,
+    then 'complete' with the full payload (or 'error'). Cached analyses, and ones
+    another request was already running, are replayed as the same events once ready.
+
+    The analysis runs like run_analysis (coalesced, under a deadline, reusing mirror
+    copies) on a thread of its own, so a client that disconnects does not stop it.
+    Quick summaries in ELI12 send no 'field' events, which carry the regular wording.
+    """
+    key = analysis_cache_key(url, analysis_type)
+    metrics.set_labels(source_type(url), analysis_type)
+
+    if not no_cache:
+        cached, tier = analysis_cache.lookup(key)
+        if cached is not None:
+            payload = select_analysis_view(cached, analysis_type, eli12)
+            yield from _replay_events(payload)
+            yield 'complete', {'cache': tier, 'analysis': payload}
+            return
+
+    events = queue.Queue()
+    context = contextvars.copy_context()
+
+    def run():
+        last_usage.set(None)
+        try:
+            with deadline.deadline(timeout):
+                outcome = in_flight.do(key, _stream_and_store, key, url, analysis_type,
+                                       lambda path, value: events.put((path, value)), not no_cache)
+        except Exception as e:
+            outcome = e
+        events.put((_STREAM_DONE, outcome))
+
+    threading.Thread(target=context.run, args=(run,), name='elacity-stream', daemon=True).start()
+
+    hold_fields = analysis_type == 'quick' and eli12
+    streamed = False
+    while True:
+        path, value = events.get()
+        if path is _STREAM_DONE:
+            break
+        streamed = True
+        event = _progress_event(path, value)
+        if event and not (hold_fields and event[0] == 'field'):
+            yield event
+
+    if isinstance(value, Overloaded):
+        yield 'error', {'error': str(value), 'retry_after': value.retry_after}
+        return
+    if isinstance(value, Exception):
+        yield 'error', {'error': f"Error analyzing paper: {str(value)}"}
+        return
+
+    payload, shared = value
+    if 'error' in payload:
+        yield 'error', {'error': payload['error']}
+        return
+
+    payload = _select_view(payload, analysis_type, eli12)
+    if not streamed:
+        # Shared with another request, or reused from a mirror copy
+        yield from _replay_events(payload)
+
+    complete = {'cache': 'coalesced' if shared else 'bypass' if no_cache else 'miss', 'analysis': payload}
+    usage = context.get(last_usage)
+    if usage:
+        complete['usage'] = usage
+    yield 'complete', complete
+
+
+async def run_analysis_async(url, analysis_type="full", eli12=False, no_cache=False, invalidate=False,
+                             timeout=deadline.ANALYSIS_TIMEOUT_SECONDS, mode="standard"):
+    """Event-loop counterpart of run_analysis, with the same caching and coalescing behaviour."""
+    key = analysis_cache_key(url, analysis_type, mode)
+    last_usage.set(None)
+    metrics.set_labels(source_type(url), analysis_type)
+
+    if invalidate:
+        analysis_cache.invalidate(key)
+        document_store.invalidate(url)
+
+    if not no_cache:
+        cached, tier = analysis_cache.lookup(key)
+        if cached is not None:
+            return select_analysis_view(cached, analysis_type, eli12), tier
+
+    with deadline.deadline(_timeout_for_mode(timeout, mode)):
+        payload, shared = await async_in_flight.do(key, _analyze_and_store_async, key, url, analysis_type, mode,
+                                                 not (no_cache or invalidate))
+    payload = _select_view(payload, analysis_type, eli12)
+    if shared:
+        return payload, 'coalesced'
+
+    return payload, 'bypass' if no_cache else 'miss'
+
+
+async def _analyze_and_store_async(key, url, analysis_type, mode="standard", reuse_duplicates=True):
+    """Run the async fetch -> build -> call -> parse pipeline once and cache a successful result."""
+    missing = 0
+    try:
+        with deadline.reserve(QUICK_SUMMARY_SECONDS):
+            paper_text = await fetch_paper_text_async(url)
+        duplicate = await asyncio.to_thread(_duplicate_analysis, key, url, paper_text, analysis_type, mode, reuse_duplicates)
+        if duplicate is not None:
+            return _store_result(key, url, duplicate)
+        run_type = _type_for_time_left(analysis_type, paper_text)
+        if _runs_long(mode, run_type, paper_text):
+            result, usage, missing = await mapreduce.analyze_long_async(url, paper_text)
+        else:
+            with metrics.timer('prompt'):
+                request = await asyncio.to_thread(build_chat_request, url, paper_text, run_type)
+            result, usage = await call_openai_async(request)
+        record_usage(key, usage)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.exception("Analysis failed", key=key, url=url)
+        return error_payload(e)
+
+    payload, ok = parse_analysis_result(result)
+
+    if ok and 'error' not in payload:
+        payload = _store_result(key, url, payload, _result_reasons(paper_text, missing))
+        related.record(url, paper_text, payload)
+
+    return payload
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Elacity Cache Pre-Warming
+Reads the arXiv listing feeds for configured categories and analyzes new papers
+ahead of demand, so the first reader of a fresh paper gets a cache hit.
+
+Runs are capped in two ways: ELACITY_PREWARM_CONCURRENCY analyses at a time, and
+ELACITY_PREWARM_DAILY_BUDGET_USD of estimated OpenAI spend per UTC day (tracked
+across runs). Run it from cron, or with --interval to keep it going.
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+import datetime
+import requests
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from prompt import HEADERS, fetch_paper_text, build_chat_request, document_key
+from pipeline import analysis_cache, analysis_cache_key, last_usage, run_analysis
+from cache import CACHE_DIR
+from log import get_logger
+from ratelimit import Overloaded
+
+logger = get_logger('prewarm')
+
+CATEGORIES = [c.strip() for c in os.getenv('ELACITY_PREWARM_CATEGORIES', 'cs.CL,cs.LG,cs.AI').split(',') if c.strip()]
+FEED_URL = os.getenv('ELACITY_PREWARM_FEED_URL', 'https://rss.arxiv.org/rss/{category}')
+ANALYSIS_TYPES = [t.strip() for t in os.getenv('ELACITY_PREWARM_TYPES', 'full').split(',') if t.strip()]
+CONCURRENCY = int(os.getenv('ELACITY_PREWARM_CONCURRENCY', 4))
+DAILY_BUDGET_USD = float(os.getenv('ELACITY_PREWARM_DAILY_BUDGET_USD', 2.0))
+
+# USD per million tokens for OPENAI_MODEL (defaults are gpt-4o-mini list prices)
+INPUT_PRICE_PER_MTOK = float(os.getenv('OPENAI_INPUT_PRICE_PER_MTOK', 0.15))
+OUTPUT_PRICE_PER_MTOK = float(os.getenv('OPENAI_OUTPUT_PRICE_PER_MTOK', 0.60))
+
+# Replacements are re-announced old papers; only new submissions and cross-lists are fetched
+ANNOUNCE_TYPES = ('new', 'cross')
+
+ARXIV_NS = '{http://arxiv.org/schemas/atom}'
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+
+
+def parse_feed(xml_text):
+    """Paper URLs from an arXiv RSS 2.0 listing or an arXiv API Atom feed."""
+    root = ET.fromstring(xml_text)
+    urls = []
+
+    for item in root.iter('item'):
+        announce_type = item.findtext(f'{ARXIV_NS}announce_type')
+        if announce_type and announce_type not in ANNOUNCE_TYPES:
+            continue
+        link = (item.findtext('link') or '').strip()
+        if link:
+            urls.append(link)
+
+    for entry in root.iter(f'{ATOM_NS}entry'):
+        link = (entry.findtext(f'{ATOM_NS}id') or '').strip()
+        if link:
+            urls.append(link)
+
+    return urls
+
+
+def read_feed(source):
+    """Paper URLs from a feed URL or a local feed file (useful as a fixture)."""
+    if os.path.exists(source):
+        with open(source, encoding='utf-8') as f:
+            return parse_feed(f.read())
+
+    response = requests.get(source, headers=HEADERS, timeout=30)
+    response.raise_for_status()
+    return parse_feed(response.content)
+
+
+def estimate_cost(request):
+    """Upper-bound USD cost of one chat request: ~4 characters per input token, full output allowance."""
+    input_tokens = sum(len(message['content']) for message in request['messages']) / 4
+    output_tokens = int(os.getenv('OPENAI_MAX_TOKENS', 4000))
+    return (input_tokens * INPUT_PRICE_PER_MTOK + output_tokens * OUTPUT_PRICE_PER_MTOK) / 1_000_000
+
+
+def usage_cost(usage):
+    """USD cost of a call's token usage (as in prompt.usage_summary); 0 for no call."""
+    if not usage:
+        return 0.0
+    return (usage['prompt_tokens'] * INPUT_PRICE_PER_MTOK + usage['completion_tokens'] * OUTPUT_PRICE_PER_MTOK) / 1_000_000
+
+
+class SpendLedger:
+    """Estimated spend per UTC day, persisted in SQLite so separate (and concurrent) runs share the cap."""
+
+    def __init__(self, path, daily_budget):
+        self.path = path
+        self.daily_budget = daily_budget
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit mode, so reserve can hold a write lock across its read and update
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS spend (day TEXT PRIMARY KEY, usd REAL NOT NULL)')
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+    def spent_today(self):
+        with self._lock:
+            row = self._conn.execute('SELECT usd FROM spend WHERE day = ?', (self._today(),)).fetchone()
+        return row[0] if row else 0.0
+
+    def reserve(self, amount):
+        """Record amount against today's budget; False (nothing recorded) if it would exceed it."""
+        today = self._today()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the database write lock, so no other run can reserve in between
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT usd FROM spend WHERE day = ?', (today,)).fetchone()
+                spent = row[0] if row else 0.0
+                if spent + amount > self.daily_budget:
+                    return False
+                # Only today's total matters; older days are dropped
+                self._conn.execute('DELETE FROM spend WHERE day != ?', (today,))
+                self._conn.execute('INSERT OR REPLACE INTO spend (day, usd) VALUES (?, ?)', (today, spent + amount))
+                return True
+            finally:
+                self._conn.execute('COMMIT')
+
+    def settle(self, reserved, actual):
+        """Replace a reservation made today with the actual spend (0 refunds it)."""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE spend SET usd = MAX(0, usd + ?) WHERE day = ?', (actual - reserved, self._today())
+            )
+
+
+ledger = SpendLedger(os.path.join(CACHE_DIR, 'prewarm_spend.sqlite3'), DAILY_BUDGET_USD)
+
+
+def prewarm_paper(url, analysis_type, budget):
+    """
+    Fetch and analyze one paper unless it is cached. Returns 'cached', 'unavailable',
+    'over_budget', 'throttled' (no OpenAI capacity), 'analyzed' or 'failed'.
+    The budget is charged the estimate up front, then settled to what the OpenAI call
+    cost (nothing if another request's analysis or the cache served it, or it failed).
+    """
+    if analysis_cache.get(analysis_cache_key(url, analysis_type)) is not None:
+        return 'cached'
+
+    paper_text = fetch_paper_text(url)
+    if not paper_text:
+        return 'unavailable'
+
+    reserved = estimate_cost(build_chat_request(url, paper_text, analysis_type))
+    if not budget.reserve(reserved):
+        return 'over_budget'
+
+    try:
+        # Nobody is waiting on a pre-warm; let it take as long as a complete analysis needs
+        payload, status = run_analysis(url, analysis_type, timeout=None)
+    except Overloaded:
+        return 'throttled'
+    finally:
+        # run_analysis leaves the usage of an OpenAI call it made itself in last_usage
+        budget.settle(reserved, usage_cost(last_usage.get()))
+    if status in ('memory', 'disk', 'coalesced'):
+        return 'cached'
+    return 'failed' if 'error' in payload else 'analyzed'
+
+
+def prewarm(sources, analysis_types=None, concurrency=CONCURRENCY, budget=ledger):
+    """Pre-analyze every new paper listed in sources (feed URLs or files). Returns counts per outcome."""
+    urls = {}
+    for source in sources:
+        try:
+            listed = read_feed(source)
+        except Exception as e:
+            logger.warning("Error reading feed", source=source, error=str(e))
+            continue
+        logger.info("Read feed", source=source, papers=len(listed))
+        # A paper cross-listed in several categories (or versions) is analyzed once
+        for url in listed:
+            urls.setdefault(document_key(url), url)
+    urls = list(urls.values())
+
+    counts = {}
+    tasks = [(url, analysis_type) for url in urls for analysis_type in (analysis_types or ANALYSIS_TYPES)]
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = [pool.submit(prewarm_paper, url, analysis_type, budget) for url, analysis_type in tasks]
+        for (url, analysis_type), future in zip(tasks, futures):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logger.error("Error pre-warming paper", url=url, analysis_type=analysis_type, error=str(e))
+                outcome = 'failed'
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    return counts
+
+
+def main():
+    """Main function for command line usage."""
+    if '--help' in sys.argv:
+        print("Usage: python ai/prewarm.py [category ...] [--feed URL_OR_FILE ...] [--interval SECONDS]")
+        print(f"Default categories: {', '.join(CATEGORIES)} (ELACITY_PREWARM_CATEGORIES)")
+        return
+
+    categories = []
+    feeds = []
+    interval = None
+
+    # Parse arguments
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg == '--feed':
+            feeds.append(next(args))
+        elif arg == '--interval':
+            interval = float(next(args))
+        else:
+            categories.append(arg)
+
+    if not feeds:
+        feeds = [FEED_URL.format(category=category) for category in categories or CATEGORIES]
+
+    while True:
+        counts = prewarm(feeds)
+        print(f"Pre-warm run: {counts} (spent today: ${ledger.spent_today():.2f} of ${ledger.daily_budget:.2f})")
+        if interval is None:
+            break
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,517 +8,488 @@ import os
 import re
 import sys
 import requests
-import io
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 from openai import OpenAI
-from PyPDF2 import PdfReader
+import pdf_extract
+import metrics
+import deadline
+from log import get_logger
 from bs4 import BeautifulSoup
+from cache import CACHE_DIR
+from docstore import DocumentStore
+from identity import resolve, paper_key, arxiv_pdf_url
+from condense import condense_text
+from ratelimit import openai_admission
 
 # Load environment variables from root directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+logger = get_logger('prompt')
+
+# Initialize OpenAI client (retries go through the admission controller instead)
+client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+
+# Bump whenever a prompt template changes so cached analyses are not reused
+PROMPT_VERSION = "4"
+
+# Most text kept per paper at extraction time; prompts get a condensed version of it
+MAX_PAPER_CHARS = int(os.getenv('ELACITY_MAX_PAPER_CHARS', 120000))
+
+# Token budgets for the paper text in each prompt (see condense.py)
+PAPER_TOKEN_BUDGET = int(os.getenv('ELACITY_PAPER_TOKEN_BUDGET', 3500))
+QUICK_PAPER_TOKEN_BUDGET = int(os.getenv('ELACITY_QUICK_PAPER_TOKEN_BUDGET', 2000))
+
+
+def truncate_text(text, char_limit=MAX_PAPER_CHARS):
+    """Cut text to char_limit characters, marking it as truncated."""
+    if len(text) > char_limit:
+        text = text[:char_limit] + "... [truncated]"
+    return text
+
+
+@metrics.timed('extract')
+def extract_pdf_text(content, char_limit=MAX_PAPER_CHARS):
+    """
+    Extract whitespace-normalized text from PDF bytes with the configured backend.
+    Pages are read only until char_limit characters have been collected,
+    so long papers are not parsed past what the prompt can hold.
+    """
+    return truncate_text(pdf_extract.extract_text(content, char_limit), char_limit)
 
 
 def extract_paper_id(url):
-    """Extract paper ID from various sources."""
-    # arXiv patterns
-    arxiv_patterns = [
-        r'arxiv\.org/abs/(\d+\.\d+)',
-        r'arxiv\.org/pdf/(\d+\.\d+)',
-        r'arxiv\.org/abs/(cs/\d+)',
-        r'arxiv\.org/pdf/(cs/\d+)',
-        r'(\d{4}\.\d{4,5})',
-        r'(cs/\d+)'
+    """The paper's stable ID ('arXiv:1706.03762', 'PhilPapers:SMITAB'), or None for unrecognized sources."""
+    return resolve(url).key
+
+
+def document_key(url):
+    """Store key for extracted text: the paper's ID when known (every URL variant shares it), else the canonical URL."""
+    return paper_key(url)
+
+
+# Browser-like headers for sites that reject default HTTP clients
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# Extracted paper text shared by full and quick analyses
+document_store = DocumentStore(
+    db_path=os.getenv('ELACITY_DOCUMENT_DB', os.path.join(CACHE_DIR, 'documents.sqlite3')),
+    key_fn=document_key,
+    max_memory_chars=int(os.getenv('ELACITY_DOCUMENT_MEMORY_CHARS', 8_000_000)),
+    ttl_seconds=int(os.getenv('ELACITY_DOCUMENT_TTL_SECONDS', 30 * 24 * 3600))
+)
+
+
+@metrics.timed('fetch')
+def _download(url, headers=None):
+    """GET url and return the response body, raising on HTTP errors or once the analysis deadline passes."""
+    # requests' timeout bounds each socket read, not the whole body; check the deadline between reads
+    with requests.get(url, headers=headers, timeout=deadline.timeout(30, deadline.PARTIAL_TEXT), stream=True) as response:
+        response.raise_for_status()
+        # read1 returns whatever has arrived, so a trickling body cannot block past the deadline
+        read = getattr(response.raw, 'read1', None) or response.raw.read
+        chunks = []
+        while True:
+            chunk = read(64 * 1024, decode_content=True)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+            deadline.check(deadline.PARTIAL_TEXT)
+
+
+@metrics.timed('extract')
+def parse_philpapers_html(html):
+    """Extract title, abstract and content text from a PhilPapers HTML page."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = ""
+    title_elem = soup.find('h1') or soup.find('title')
+    if title_elem:
+        title = title_elem.get_text().strip()
+
+    # Extract abstract or description
+    abstract = ""
+    abstract_selectors = [
+        '.abstract',
+        '.description',
+        '.summary',
+        '[class*="abstract"]',
+        '[class*="description"]'
     ]
-    
-    for pattern in arxiv_patterns:
-        match = re.search(pattern, url)
-        if match:
-            return f"arXiv:{match.group(1)}"
-    
-    # PhilPapers patterns
-    if 'philpapers.org' in url:
-        # Extract paper ID from PhilPapers URLs
-        phil_patterns = [
-            r'philpapers\.org/archive/([A-Z0-9]+)',
-            r'philpapers\.org/rec/([A-Z0-9]+)',
-            r'philpapers\.org/browse/([A-Z0-9]+)'
-        ]
-        for pattern in phil_patterns:
-            match = re.search(pattern, url)
-            if match:
-                return f"PhilPapers:{match.group(1)}"
-    
-    # Harvard Math patterns
-    if 'people.math.harvard.edu' in url:
-        # Extract author/paper info from Harvard URLs
-        harvard_match = re.search(r'people\.math\.harvard\.edu/~([^/]+)', url)
-        if harvard_match:
-            return f"Harvard:{harvard_match.group(1)}"
-    
-    # Personal site patterns
-    if 'abrahamdada.com/essays' in url:
-        # Extract essay ID from personal site
-        essay_match = re.search(r'abrahamdada\.com/essays/([^/]+)', url)
-        if essay_match:
-            return f"Essay:{essay_match.group(1)}"
-    
-    return None
 
+    for selector in abstract_selectors:
+        abstract_elem = soup.select_one(selector)
+        if abstract_elem:
+            abstract = abstract_elem.get_text().strip()
+            break
+
+    # Extract main content
+    content = ""
+    content_selectors = [
+        '.content',
+        '.main-content',
+        '.paper-content',
+        '.entry-content',
+        'main',
+        'article'
+    ]
+
+    for selector in content_selectors:
+        content_elem = soup.select_one(selector)
+        if content_elem:
+            content = content_elem.get_text().strip()
+            break
+
+    # If no specific content found, get all paragraphs
+    if not content:
+        paragraphs = soup.find_all('p')
+        content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+
+    # Combine all text
+    full_text = f"Title: {title}\n\nAbstract: {abstract}\n\nContent: {content}"
+
+    # Clean up the text
+    full_text = re.sub(r'\s+', ' ', full_text)
+    full_text = full_text.strip()
+
+    # Limit text length
+    return truncate_text(full_text)
+
+
+@metrics.timed('extract')
+def parse_harvard_html(url, html):
+    """
+    Extract title and paper text from a Harvard Math page.
+    Returns (title, content, pdf_url) where pdf_url is the first linked PDF
+    when the page itself has no usable content, else None.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = ""
+    title_elem = soup.find('h1') or soup.find('title')
+    if title_elem:
+        title = title_elem.get_text().strip()
+
+    # Extract paper content
+    content = ""
+
+    # Look for common academic page structures
+    content_selectors = [
+        '.paper',
+        '.abstract',
+        '.content',
+        '.main',
+        'main',
+        'article',
+        '.publication',
+        '.research'
+    ]
+
+    for selector in content_selectors:
+        content_elem = soup.select_one(selector)
+        if content_elem:
+            content = content_elem.get_text().strip()
+            break
+
+    # If no specific content found, get all paragraphs
+    if not content:
+        paragraphs = soup.find_all('p')
+        content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+
+    # Look for PDF links to extract from if HTML content is insufficient
+    pdf_url = None
+    pdf_links = soup.find_all('a', href=re.compile(r'\.pdf$', re.I))
+    if pdf_links and not content:
+        pdf_url = pdf_links[0]['href']
+        if not pdf_url.startswith('http'):
+            pdf_url = requests.compat.urljoin(url, pdf_url)
+
+    return title, content, pdf_url
+
+
+def harvard_full_text(title, content):
+    """Combine a Harvard page's title and content into cleaned, length-limited text."""
+    # Combine all text
+    full_text = f"Title: {title}\n\nContent: {content}"
+
+    # Clean up the text
+    full_text = re.sub(r'\s+', ' ', full_text)
+    full_text = full_text.strip()
+
+    # Limit text length
+    return truncate_text(full_text)
+
+
+@metrics.timed('extract')
+def parse_personal_essay_html(html):
+    """Extract title and essay text from a personal essay page."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = ""
+    title_elem = soup.find('h1') or soup.find('title')
+    if title_elem:
+        title = title_elem.get_text().strip()
+
+    # Extract essay content
+    content = ""
+
+    # Look for common blog/essay structures
+    content_selectors = [
+        '.essay',
+        '.post-content',
+        '.entry-content',
+        '.article-content',
+        '.content',
+        'main',
+        'article',
+        '.post',
+        '.blog-post'
+    ]
+
+    for selector in content_selectors:
+        content_elem = soup.select_one(selector)
+        if content_elem:
+            content = content_elem.get_text().strip()
+            break
+
+    # If no specific content found, get all paragraphs
+    if not content:
+        paragraphs = soup.find_all('p')
+        content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+
+    # Combine all text
+    full_text = f"Title: {title}\n\nContent: {content}"
+
+    # Clean up the text
+    full_text = re.sub(r'\s+', ' ', full_text)
+    full_text = full_text.strip()
+
+    # Limit text length
+    return truncate_text(full_text)
+
+
+@metrics.timed('extract')
+def parse_generic_html(html):
+    """Extract title and main content text from an arbitrary web page."""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Extract title
+    title = ""
+    title_elem = soup.find('h1') or soup.find('title')
+    if title_elem:
+        title = title_elem.get_text().strip()
+
+    # Extract main content
+    content = ""
+
+    # Try common content selectors
+    content_selectors = [
+        'main',
+        'article',
+        '.content',
+        '.main-content',
+        '.post-content',
+        '.entry-content',
+        '.article-content',
+        '#content',
+        '#main'
+    ]
+
+    for selector in content_selectors:
+        content_elem = soup.select_one(selector)
+        if content_elem:
+            content = content_elem.get_text().strip()
+            break
+
+    # If no specific content found, get all paragraphs
+    if not content:
+        paragraphs = soup.find_all('p')
+        content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
+
+    # Combine all text
+    full_text = f"Title: {title}\n\nContent: {content}"
+
+    # Clean up the text
+    full_text = re.sub(r'\s+', ' ', full_text)
+    full_text = full_text.strip()
 
+    # Limit text length
+    return truncate_text(full_text)
+
+
+@document_store.cached
 def fetch_arxiv_paper_text(url):
     """Fetch and extract text from arXiv paper PDF."""
     try:
-        # Convert to PDF URL if it's an abstract URL
-        if '/abs/' in url:
-            pdf_url = url.replace('/abs/', '/pdf/') + '.pdf'
-        elif '/pdf/' in url and not url.endswith('.pdf'):
-            pdf_url = url + '.pdf'
-        else:
-            pdf_url = url
-        
         # Download the PDF
-        response = requests.get(pdf_url, timeout=30)
-        response.raise_for_status()
-        
-        # Extract text from PDF
-        pdf_file = io.BytesIO(response.content)
-        pdf_reader = PdfReader(pdf_file)
-        
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        
-        # Clean up the text
-        text = re.sub(r'\s+', ' ', text)  # Replace multiple whitespace with single space
-        text = text.strip()
+        content = _download(arxiv_pdf_url(url))
         
-        # Limit text length to avoid token limits (keep first ~15000 chars)
-        if len(text) > 15000:
-            text = text[:15000] + "... [truncated]"
-        
-        return text
+        # Extract text from PDF, stopping once the text budget is met
+        return extract_pdf_text(content)
         
     except Exception as e:
-        print(f"Error fetching arXiv paper: {e}")
+        logger.warning("Error fetching arXiv paper", url=url, error=str(e))
         return None
 
 
+@document_store.cached
 def fetch_philpapers_text(url):
     """Fetch and extract text from PhilPapers page or PDF."""
     try:
         # Check if this is a PDF URL
         if url.endswith('.pdf'):
             # Handle PDF directly
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            # Extract text from PDF
-            pdf_file = io.BytesIO(response.content)
-            pdf_reader = PdfReader(pdf_file)
-            
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+            content = _download(url)
             
-            # Clean up the text
-            text = re.sub(r'\s+', ' ', text)  # Replace multiple whitespace with single space
-            text = text.strip()
-            
-            # Limit text length to avoid token limits (keep first ~15000 chars)
-            if len(text) > 15000:
-                text = text[:15000] + "... [truncated]"
-            
-            return text
+            # Extract text from PDF, stopping once the text budget is met
+            return extract_pdf_text(content)
         
         # Handle HTML page
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = ""
-        title_elem = soup.find('h1') or soup.find('title')
-        if title_elem:
-            title = title_elem.get_text().strip()
-        
-        # Extract abstract or description
-        abstract = ""
-        abstract_selectors = [
-            '.abstract',
-            '.description',
-            '.summary',
-            '[class*="abstract"]',
-            '[class*="description"]'
-        ]
-        
-        for selector in abstract_selectors:
-            abstract_elem = soup.select_one(selector)
-            if abstract_elem:
-                abstract = abstract_elem.get_text().strip()
-                break
-        
-        # Extract main content
-        content = ""
-        content_selectors = [
-            '.content',
-            '.main-content',
-            '.paper-content',
-            '.entry-content',
-            'main',
-            'article'
-        ]
-        
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                content = content_elem.get_text().strip()
-                break
-        
-        # If no specific content found, get all paragraphs
-        if not content:
-            paragraphs = soup.find_all('p')
-            content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-        
-        # Combine all text
-        full_text = f"Title: {title}\n\nAbstract: {abstract}\n\nContent: {content}"
-        
-        # Clean up the text
-        full_text = re.sub(r'\s+', ' ', full_text)
-        full_text = full_text.strip()
-        
-        # Limit text length
-        if len(full_text) > 15000:
-            full_text = full_text[:15000] + "... [truncated]"
+        content = _download(url, headers=HEADERS)
         
-        return full_text
+        return parse_philpapers_html(content)
         
     except Exception as e:
-        print(f"Error fetching PhilPapers content: {e}")
+        logger.warning("Error fetching PhilPapers content", url=url, error=str(e))
         return None
 
 
+@document_store.cached
 def fetch_harvard_paper_text(url):
     """Fetch and extract text from Harvard Math department page."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
         # If URL is a direct PDF, extract from PDF immediately
         if url.lower().endswith('.pdf'):
             try:
-                pdf_response = requests.get(url, headers=headers, timeout=30)
-                pdf_response.raise_for_status()
-                
-                pdf_file = io.BytesIO(pdf_response.content)
-                pdf_reader = PdfReader(pdf_file)
+                pdf_content = _download(url, headers=HEADERS)
                 
-                pdf_text = ""
-                for page in pdf_reader.pages:
-                    pdf_text += page.extract_text() + "\n"
-                
-                if pdf_text.strip():
-                    # Clean up the text
-                    pdf_text = re.sub(r'\s+', ' ', pdf_text)
-                    pdf_text = pdf_text.strip()
-                    
-                    # Limit text length
-                    if len(pdf_text) > 15000:
-                        pdf_text = pdf_text[:15000] + "... [truncated]"
-                    
+                pdf_text = extract_pdf_text(pdf_content)
+                if pdf_text:
                     return pdf_text
             except Exception as pdf_e:
-                print(f"Error fetching PDF directly from Harvard: {pdf_e}")
+                logger.warning("Error fetching PDF directly from Harvard", url=url, error=str(pdf_e))
                 return None
         
         # Otherwise, try HTML parsing first
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = ""
-        title_elem = soup.find('h1') or soup.find('title')
-        if title_elem:
-            title = title_elem.get_text().strip()
-        
-        # Extract paper content
-        content = ""
-        
-        # Look for common academic page structures
-        content_selectors = [
-            '.paper',
-            '.abstract',
-            '.content',
-            '.main',
-            'main',
-            'article',
-            '.publication',
-            '.research'
-        ]
+        html = _download(url, headers=HEADERS)
         
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                content = content_elem.get_text().strip()
-                break
+        title, content, pdf_url = parse_harvard_html(url, html)
         
-        # If no specific content found, get all paragraphs
-        if not content:
-            paragraphs = soup.find_all('p')
-            content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-        
-        # Look for PDF links and try to extract from PDF if HTML content is insufficient
-        pdf_links = soup.find_all('a', href=re.compile(r'\.pdf$', re.I))
-        if pdf_links and not content:
-            pdf_url = pdf_links[0]['href']
-            if not pdf_url.startswith('http'):
-                pdf_url = requests.compat.urljoin(url, pdf_url)
-            
+        # Fall back to the linked PDF if HTML content is insufficient
+        if pdf_url:
             try:
-                pdf_response = requests.get(pdf_url, headers=headers, timeout=30)
-                pdf_response.raise_for_status()
-                
-                pdf_file = io.BytesIO(pdf_response.content)
-                pdf_reader = PdfReader(pdf_file)
-                
-                pdf_text = ""
-                for page in pdf_reader.pages:
-                    pdf_text += page.extract_text() + "\n"
+                pdf_content = _download(pdf_url, headers=HEADERS)
                 
-                if pdf_text.strip():
+                pdf_text = extract_pdf_text(pdf_content)
+                if pdf_text:
                     content = pdf_text
             except Exception as pdf_e:
-                print(f"Error fetching PDF from Harvard page: {pdf_e}")
-        
-        # Combine all text
-        full_text = f"Title: {title}\n\nContent: {content}"
-        
-        # Clean up the text
-        full_text = re.sub(r'\s+', ' ', full_text)
-        full_text = full_text.strip()
-        
-        # Limit text length
-        if len(full_text) > 15000:
-            full_text = full_text[:15000] + "... [truncated]"
+                logger.warning("Error fetching PDF from Harvard page", url=url, error=str(pdf_e))
         
-        return full_text
+        return harvard_full_text(title, content)
         
     except Exception as e:
-        print(f"Error fetching Harvard content: {e}")
+        logger.warning("Error fetching Harvard content", url=url, error=str(e))
         return None
 
 
+@document_store.cached
 def fetch_personal_essay_text(url):
     """Fetch and extract text from personal essay site."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        content = _download(url, headers=HEADERS)
         
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = ""
-        title_elem = soup.find('h1') or soup.find('title')
-        if title_elem:
-            title = title_elem.get_text().strip()
-        
-        # Extract essay content
-        content = ""
-        
-        # Look for common blog/essay structures
-        content_selectors = [
-            '.essay',
-            '.post-content',
-            '.entry-content',
-            '.article-content',
-            '.content',
-            'main',
-            'article',
-            '.post',
-            '.blog-post'
-        ]
-        
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                content = content_elem.get_text().strip()
-                break
-        
-        # If no specific content found, get all paragraphs
-        if not content:
-            paragraphs = soup.find_all('p')
-            content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-        
-        # Combine all text
-        full_text = f"Title: {title}\n\nContent: {content}"
-        
-        # Clean up the text
-        full_text = re.sub(r'\s+', ' ', full_text)
-        full_text = full_text.strip()
-        
-        # Limit text length
-        if len(full_text) > 15000:
-            full_text = full_text[:15000] + "... [truncated]"
-        
-        return full_text
+        return parse_personal_essay_html(content)
         
     except Exception as e:
-        print(f"Error fetching personal essay: {e}")
+        logger.warning("Error fetching personal essay", url=url, error=str(e))
         return None
 
 
+def source_type(url):
+    """Which fetcher handles url: arxiv, philpapers, harvard, essay or generic."""
+    return resolve(url).source
+
+
 def fetch_paper_text(url):
     """Fetch and extract text from various paper sources."""
     try:
         # Determine source type and use appropriate fetcher
-        if 'arxiv.org' in url:
+        source = source_type(url)
+        if source == 'arxiv':
             return fetch_arxiv_paper_text(url)
-        elif 'philpapers.org' in url:
+        elif source == 'philpapers':
             return fetch_philpapers_text(url)
-        elif 'people.math.harvard.edu' in url:
+        elif source == 'harvard':
             return fetch_harvard_paper_text(url)
-        elif 'abrahamdada.com/essays' in url:
+        elif source == 'essay':
             return fetch_personal_essay_text(url)
         else:
             # Generic web page fetcher for other sources
-            print(f"DEBUG: Unknown source, attempting generic web fetch for: {url}")
+            logger.debug("Unknown source, attempting generic web fetch", url=url)
             return fetch_generic_web_text(url)
             
     except Exception as e:
-        print(f"Error in fetch_paper_text: {e}")
+        logger.warning("Error in fetch_paper_text", url=url, error=str(e))
         return None
 
 
+@document_store.cached
 def fetch_generic_web_text(url):
     """Generic web page text fetcher for unknown sources."""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        content = _download(url, headers=HEADERS)
         
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Extract title
-        title = ""
-        title_elem = soup.find('h1') or soup.find('title')
-        if title_elem:
-            title = title_elem.get_text().strip()
-        
-        # Extract main content
-        content = ""
-        
-        # Try common content selectors
-        content_selectors = [
-            'main',
-            'article',
-            '.content',
-            '.main-content',
-            '.post-content',
-            '.entry-content',
-            '.article-content',
-            '#content',
-            '#main'
-        ]
-        
-        for selector in content_selectors:
-            content_elem = soup.select_one(selector)
-            if content_elem:
-                content = content_elem.get_text().strip()
-                break
-        
-        # If no specific content found, get all paragraphs
-        if not content:
-            paragraphs = soup.find_all('p')
-            content = '\n'.join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-        
-        # Combine all text
-        full_text = f"Title: {title}\n\nContent: {content}"
-        
-        # Clean up the text
-        full_text = re.sub(r'\s+', ' ', full_text)
-        full_text = full_text.strip()
-        
-        # Limit text length
-        if len(full_text) > 15000:
-            full_text = full_text[:15000] + "... [truncated]"
-        
-        return full_text
+        return parse_generic_html(content)
         
     except Exception as e:
-        print(f"Error fetching generic web content: {e}")
+        logger.warning("Error fetching generic web content", url=url, error=str(e))
         return None
 
 
 
-def generate_analysis_prompt(url, eli12=False):
-    """Generate analysis prompt for academic paper URL that matches the extension UI structure."""
-    
-    paper_id = extract_paper_id(url)
-    
-    # Fetch the actual paper text from any supported source
-    paper_text = fetch_paper_text(url)
-    
-    eli12_instruction = """
-    
-🧒 **IMPORTANT: Explain Like I'm 12 Mode**
-When providing the summary and key insights, also include ELI12 versions that explain technical concepts using simple language that a 12-year-old could understand. Use analogies, everyday examples, and avoid jargon. Make it engaging and fun while still being accurate.
-""" if eli12 else ""
+# Static instructions go in the system message, ahead of any per-paper text, so every
+# request starts with the same long prefix and OpenAI's automatic prompt caching can
+# reuse it. Keep anything paper-specific out of these constants.
+SYSTEM_PREAMBLE = "You are Elacity, an expert AI research copilot that helps users read academic papers faster and more intelligently. CRITICAL: You MUST respond with ONLY valid JSON. NO markdown. NO code blocks. NO ```json. NO ``` at all. Just pure JSON starting with { and ending with }. The response_format is set to json_object so you MUST return valid JSON only."
 
-    if paper_text:
-        print(f"DEBUG: Successfully fetched paper text, length: {len(paper_text)}")
-        print(f"DEBUG: First 200 chars: {paper_text[:200]}")
-        paper_id_value = paper_id if paper_id else '[Unknown source]'
-        
-        base_prompt = """You are Elacity, an AI research copilot that helps users read academic papers faster and more intelligently. 
+ANALYSIS_SYSTEM_PROMPT = SYSTEM_PREAMBLE + """
 
-Please analyze this academic paper:{eli12_instruction}
+You will be given one academic paper (or, if its text could not be fetched, its URL) and its paper ID.
 
-PAPER CONTENT:
-{paper_text}
+🧒 **IMPORTANT: Explain Like I'm 12 Mode**
+When providing the summary and key insights, also include ELI12 versions that explain technical concepts using simple language that a 12-year-old could understand. Use analogies, everyday examples, and avoid jargon. Make it engaging and fun while still being accurate.
 
-CRITICAL: Respond with ONLY raw JSON. Do NOT use markdown code blocks. Do NOT use ```json. Start directly with {{ and end with }}. Use this EXACT format:
+Respond with ONLY raw JSON in this EXACT format:
 
-{{
+{
   "title": "[Extract exact paper title]",
   "authors": "[REQUIRED: First author's name] et al." or "[Full author list if 3 or fewer authors]",
-  "paper_id": "{paper_id_value}",
-  "scores": {{
+  "paper_id": "[The PAPER ID given with the paper, copied exactly]",
+  "scores": {
     "methodological_rigor": [Score 1-10],
     "data_quality": [Score 1-10], 
     "innovation_level": [Score 1-10]
-  }},
-  "summary": {{
+  },
+  "summary": {
     "regular": "[2-3 paragraph summary of the paper in technical language]",
     "eli12": "[2-3 paragraph summary explaining the paper like to a 12-year-old with analogies and simple terms]"
-  }},
+  },
   "key_insights": [
-    {{
+    {
       "insight": "[Brief insight category like 'key_findings', 'methodology_strength', 'data_concern', 'innovation_highlight']",
       "level": "[Either 'Insight' or 'Flaw']",
       "description": "[Technical description of the insight]",
       "eli12_description": "[Simple explanation of the insight for a 12-year-old]",
       "color": "[#3b82f6 for Insight, #ef4444 for Flaw]"
-    }}
+    }
   ]
-}}
+}
 
 ## SCORING GUIDELINES:
 
@@ -546,143 +517,244 @@ CRITICAL: Respond with ONLY raw JSON. Do NOT use markdown code blocks. Do NOT us
 - Each insight should be specific and actionable
 - ELI12 versions should use analogies and simple language
 
-Focus on accuracy and providing actionable insights that help researchers quickly understand the paper's value, methodology, and limitations."""
-        
-        prompt = base_prompt.format(eli12_instruction=eli12_instruction, paper_text=paper_text, paper_id_value=paper_id_value)
-    else:
-        print(f"DEBUG: Failed to fetch paper text for URL: {url}")
-        paper_id_value = paper_id if paper_id else '[Unknown source]'
-        
-        # Use string formatting to avoid f-string issues with nested braces
-        base_prompt = """You are Elacity, an AI research copilot that helps users read academic papers faster and more intelligently. 
-
-Please analyze the academic paper at this URL: {url}
+Focus on accuracy and providing actionable insights that help researchers quickly understand the paper's value, methodology, and limitations.
 
-IMPORTANT: You must analyze the ACTUAL paper at this URL. If you cannot access the URL directly, use your knowledge of the paper if you know it, but be accurate about the specific paper at this URL.{eli12_instruction}
+## EXAMPLE RESPONSE
+For reference only - this is a different paper. Match its format, level of detail and tone, never its content:
 
-CRITICAL: Respond with ONLY raw JSON. Do NOT use markdown code blocks. Do NOT use ```json. Start directly with {{ and end with }}. Use this EXACT format:
-
-{{
-  "title": "[Extract exact paper title]",
-  "authors": "[REQUIRED: First author's name] et al." or "[Full author list if 3 or fewer authors]",
-  "paper_id": "{paper_id_value}",
-  "scores": {{
-    "methodological_rigor": [Score 1-10],
-    "data_quality": [Score 1-10], 
-    "innovation_level": [Score 1-10]
-  }},
-  "summary": {{
-    "regular": "[2-3 paragraph summary of the paper in technical language]",
-    "eli12": "[2-3 paragraph summary explaining the paper like to a 12-year-old with analogies and simple terms]"
-  }},
+{
+  "title": "Attention Is All You Need",
+  "authors": "Ashish Vaswani et al.",
+  "paper_id": "arXiv:1706.03762",
+  "scores": {
+    "methodological_rigor": 8,
+    "data_quality": 8,
+    "innovation_level": 10
+  },
+  "summary": {
+    "regular": "The paper introduces the Transformer, a sequence transduction architecture built entirely on attention, dispensing with recurrence and convolutions. Encoder and decoder stacks combine multi-head scaled dot-product self-attention with position-wise feed-forward layers, and sinusoidal positional encodings supply word order.\n\nOn WMT 2014 English-German and English-French translation the model reaches 28.4 and 41.8 BLEU, surpassing previous single models and ensembles, while training in a fraction of the time thanks to full parallelism across sequence positions. Ablations over the number of heads, key dimension and model size show which components matter, and the model transfers to English constituency parsing.",
+    "eli12": "Imagine reading a sentence by looking at every word at once and deciding which other words each one should pay attention to, instead of reading one word at a time from left to right. That is what the Transformer does, and it is why it learns much faster than older models.\n\nThe authors tested it on translating between languages and it beat every earlier computer translator while needing far less training time - like a student who finishes the exam first and still gets the top grade."
+  },
   "key_insights": [
-    {{
-      "insight": "[Brief insight category like 'key_findings', 'methodology_strength', 'data_concern', 'innovation_highlight']",
-      "level": "[Either 'Insight' or 'Flaw']",
-      "description": "[Technical description of the insight]",
-      "eli12_description": "[Simple explanation of the insight for a 12-year-old]",
-      "color": "[#3b82f6 for Insight, #ef4444 for Flaw]"
-    }}
+    {
+      "insight": "innovation_highlight",
+      "level": "Insight",
+      "description": "Self-attention alone gives constant path length between any two positions and parallel training, replacing recurrent encoders.",
+      "eli12_description": "Every word can look at every other word directly, so nothing gets forgotten along the way and the computer can work on all words at the same time.",
+      "color": "#3b82f6"
+    },
+    {
+      "insight": "data_concern",
+      "level": "Flaw",
+      "description": "Evaluation is limited to two translation benchmarks and one parsing task, and attention cost grows quadratically with sequence length.",
+      "eli12_description": "It was only tested on a few kinds of homework, and it gets slow when the text is very long.",
+      "color": "#ef4444"
+    }
   ]
-}}
+}"""
 
-## SCORING GUIDELINES:
+QUICK_SUMMARY_SYSTEM_PROMPT = SYSTEM_PREAMBLE + """
 
-**Methodological Rigor (1-10):**
-- 9-10: Rigorous experimental design, proper controls, statistical significance testing
-- 7-8: Good methodology with minor limitations
-- 5-6: Adequate methodology but notable weaknesses
-- 1-4: Poor methodology, significant flaws
+You will be given one academic paper. Provide a quick 2-minute summary of it, plus a version of it in simple language that anyone can understand - avoid technical jargon and use everyday analogies.
 
-**Data Quality (1-10):**
-- 9-10: Large, diverse, high-quality datasets with proper validation
-- 7-8: Good data quality with some limitations
-- 5-6: Adequate data but concerns about size/diversity/quality
-- 1-4: Poor data quality, small samples, or questionable sources
+Return ONLY a JSON object with this structure:
 
-**Innovation Level (1-10):**
-- 9-10: Groundbreaking novel approach, paradigm-shifting insights
-- 7-8: Significant innovation building on existing work
-- 5-6: Moderate innovation, incremental improvements
-- 1-4: Limited novelty, primarily reproduces existing work
+{
+  "title": "[Paper title]",
+  "quick_summary": "[2-3 sentence summary of what the paper does and why it matters]",
+  "main_finding": "[One key result with specific numbers/metrics if available]",
+  "relevance": "[Why should researchers care about this work?]",
+  "eli12": {
+    "quick_summary": "[The same summary in simple language with an everyday analogy]",
+    "main_finding": "[The key result in simple language]",
+    "relevance": "[Why it matters, in simple language]"
+  }
+}
 
-## KEY INSIGHTS GUIDELINES:
-- Provide 2-4 key insights
-- Mix of "Insight" (positive findings) and "Flaw" (limitations/concerns)
-- Each insight should be specific and actionable
-- ELI12 versions should use analogies and simple language
+Keep it concise but informative - perfect for busy researchers who need to quickly assess if this paper is relevant to their work.
 
-Focus on accuracy and providing actionable insights that help researchers quickly understand the paper's value, methodology, and limitations."""
+If the user says the paper could not be fetched, return exactly:
 
-        prompt = base_prompt.format(url=url, eli12_instruction=eli12_instruction, paper_id_value=paper_id_value)
+{
+  "title": "Error: Unable to fetch paper",
+  "quick_summary": "Could not retrieve paper content from the provided URL",
+  "main_finding": "No analysis available",
+  "relevance": "Please check the URL and try again"
+}"""
+
+
+def generate_analysis_prompt(url, eli12=False):
+    """
+    Generate the per-paper analysis prompt for academic paper URL (the user message;
+    the instructions are in ANALYSIS_SYSTEM_PROMPT).
+    The response always carries both regular and ELI12 text, so eli12 does not change the prompt.
+    """
+    
+    # Fetch the actual paper text from any supported source
+    return build_analysis_prompt(url, fetch_paper_text(url))
+
+
+def build_analysis_prompt(url, paper_text):
+    """Build the full-analysis user message from already-fetched paper text (None if fetching failed)."""
+    
+    paper_id = extract_paper_id(url)
+    paper_id_value = paper_id if paper_id else '[Unknown source]'
+
+    if paper_text:
+        # Fit the most useful sections into the token budget
+        paper_text = condense_text(paper_text, PAPER_TOKEN_BUDGET)
+        logger.debug("Condensed paper text", url=url, chars=len(paper_text))
+        logger.payload("Condensed paper text sample", paper_text, url=url)
+
+        prompt = f"""Please analyze this academic paper.
+
+PAPER ID: {paper_id_value}
+
+PAPER CONTENT:
+{paper_text}"""
+    else:
+        logger.info("No paper text; prompting with the URL", url=url)
+
+        prompt = f"""Please analyze the academic paper at this URL: {url}
+
+IMPORTANT: You must analyze the ACTUAL paper at this URL. If you cannot access the URL directly, use your knowledge of the paper if you know it, but be accurate about the specific paper at this URL.
+
+PAPER ID: {paper_id_value}"""
 
     return prompt
 
 
 def generate_quick_summary_prompt(url, eli12=False):
-    """Generate a shorter summary prompt for quick analysis."""
+    """
+    Generate the per-paper quick-summary prompt (the user message; the instructions
+    are in QUICK_SUMMARY_SYSTEM_PROMPT).
+    Both the regular and the ELI12 wording are requested in one response; see select_analysis_view.
+    """
     
     # Fetch the actual paper text from any supported source
-    paper_text = fetch_paper_text(url)
-    
-    eli12_instruction = " Use simple language that anyone can understand - avoid technical jargon and use everyday analogies." if eli12 else ""
+    return build_quick_summary_prompt(url, fetch_paper_text(url))
+
+
+def build_quick_summary_prompt(url, paper_text):
+    """Build the quick-summary user message from already-fetched paper text (None if fetching failed)."""
     
     if paper_text:
-        prompt = f"""Please provide a quick 2-minute summary of this academic paper:{eli12_instruction}
+        paper_text = condense_text(paper_text, QUICK_PAPER_TOKEN_BUDGET)
+        prompt = f"""PAPER CONTENT:
+{paper_text}"""
+    else:
+        prompt = f"""The paper could not be fetched from {url}."""
 
-PAPER CONTENT:
-{paper_text}
+    return prompt
 
-Return ONLY a JSON object with this structure:
 
-{{
-  "title": "[Paper title]",
-  "quick_summary": "[2-3 sentence summary of what the paper does and why it matters]",
-  "main_finding": "[One key result with specific numbers/metrics if available]",
-  "relevance": "[Why should researchers care about this work?]"
-}}
+def select_analysis_view(result, analysis_type="full", eli12=False):
+    """
+    Return the view of a combined analysis for the requested ELI12 flag.
+
+    Full analyses already carry summary.regular/summary.eli12 and per-insight
+    eli12_description, so they are returned unchanged. Quick summaries (and the
+    section and Q&A payloads, viewed as 'quick') carry their simple-language wording
+    under "eli12", which replaces the regular fields when eli12 is requested.
+    """
+    if analysis_type != "quick" or not isinstance(result, dict) or 'eli12' not in result:
+        return result
+
+    view = {key: value for key, value in result.items() if key != 'eli12'}
+    if eli12 and isinstance(result['eli12'], dict):
+        view.update(result['eli12'])
+    return view
+
+
+def chat_completion_request(prompt, analysis_type="full"):
+    """
+    Keyword arguments for chat.completions.create, shared by the sync, async and batch paths.
+    The system message is identical for every request of an analysis type; prompt is the per-paper part.
+    """
+    system_prompt = QUICK_SUMMARY_SYSTEM_PROMPT if analysis_type == "quick" else ANALYSIS_SYSTEM_PROMPT
+    return {
+        'model': os.getenv('OPENAI_MODEL', 'gpt-4o-mini'),
+        'response_format': {"type": "json_object"},
+        'messages': [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        'max_completion_tokens': int(os.getenv('OPENAI_MAX_TOKENS', 4000))
+    }
 
-Keep it concise but informative - perfect for busy researchers who need to quickly assess if this paper is relevant to their work."""
+
+def build_chat_request(url, paper_text, analysis_type="full"):
+    """chat.completions.create arguments for one paper whose text has already been fetched."""
+    if analysis_type == "quick":
+        prompt = build_quick_summary_prompt(url, paper_text)
     else:
-        prompt = f"""I was unable to fetch the content from {url}. Please return an error message in JSON format:
+        prompt = build_analysis_prompt(url, paper_text)
+    return chat_completion_request(prompt, analysis_type)
 
-{{
-  "title": "Error: Unable to fetch paper",
-  "quick_summary": "Could not retrieve paper content from the provided URL",
-  "main_finding": "No analysis available",
-  "relevance": "Please check the URL and try again"
-}}"""
 
-    return prompt
+def usage_summary(usage):
+    """Token counts from a completion's usage, including prompt tokens served from OpenAI's prompt cache."""
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens') or 0,
+        'cached_tokens': details.get('cached_tokens') or 0,
+        'completion_tokens': usage.get('completion_tokens') or 0
+    }
+
+
+@metrics.timed('llm')
+def call_openai(request):
+    """
+    Run one chat completion within the OpenAI rate limits. Returns (content, usage) with
+    usage as in usage_summary; raises ratelimit.Overloaded if there is no capacity.
+    """
+    response, estimated = openai_admission.call(client.chat.completions.create, request)
+    usage = usage_summary(response.usage)
+    openai_admission.settle(estimated, usage)
+    return response.choices[0].message.content, usage
 
 
 def analyze_paper_with_openai(url, analysis_type="full", eli12=False):
-    """Analyze paper using OpenAI API."""
+    """Analyze paper using OpenAI API. The result holds both regular and ELI12 variants."""
     
     try:
-        # Generate appropriate prompt
-        if analysis_type == "quick":
-            prompt = generate_quick_summary_prompt(url, eli12)
-        else:
-            prompt = generate_analysis_prompt(url, eli12)
+        # Fetch the paper, build the request and call OpenAI
+        request = build_chat_request(url, fetch_paper_text(url), analysis_type)
+        content, _ = call_openai(request)
         
-        # Call OpenAI API
-        response = client.chat.completions.create(
-            model=os.getenv('OPENAI_MODEL', 'gpt-4o-mini'),
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are Elacity, an expert AI research copilot. CRITICAL: You MUST respond with ONLY valid JSON. NO markdown. NO code blocks. NO ```json. NO ``` at all. Just pure JSON starting with { and ending with }. The response_format is set to json_object so you MUST return valid JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            max_completion_tokens=int(os.getenv('OPENAI_MAX_TOKENS', 4000))
-        )
-        
-        return response.choices[0].message.content
+        return content
         
     except Exception as e:
         return f"Error analyzing paper: {str(e)}"
 
 
+def stream_paper_analysis_with_openai(url, analysis_type="full", usage=None):
+    """
+    Analyze paper with a streaming OpenAI completion, yielding the response text
+    in pieces as it is generated. Errors are raised rather than returned as text.
+    If a usage dict is passed, it is filled in (see usage_summary) once the stream ends.
+    """
+    request = build_chat_request(url, fetch_paper_text(url), analysis_type)
+    yield from stream_openai(request, usage)
+
+
+def stream_openai(request, usage=None):
+    """Stream one chat completion's text; fills usage (if given) when the stream ends."""
+    request = dict(request, stream=True, stream_options={"include_usage": True})
+    stream, estimated = openai_admission.call(client.chat.completions.create, request)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        if chunk.usage is not None:
+            openai_admission.settle(estimated, usage_summary(chunk.usage))
+            if usage is not None:
+                usage.update(usage_summary(chunk.usage))
+
+
 def main():
     """Main function for command line usage."""
     if len(sys.argv) < 2:
@@ -715,7 +787,9 @@ def main():
             prompt = generate_analysis_prompt(url, eli12)
         
         print("=== GENERATED PROMPT ===")
-        print(prompt)
+        for message in chat_completion_request(prompt, analysis_type)['messages']:
+            print(f"--- {message['role']} ---")
+            print(message['content'])
         print("\n=== NOTE ===")
         print("Set up your .env file with OPENAI_API_KEY to get actual analysis results!")
 
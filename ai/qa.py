@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Elacity Paper Q&A
+Backs /api/qa: questions about a paper are answered from its most relevant passages
+rather than from the whole paper.
+
+The extracted text is split into short section-aligned chunks and indexed with BM25
+(pure Python, no external service). The index is stored in the document store next
+to the paper's text, so it is built once per paper. Each question's prompt holds only
+the QA_TOP_K best-matching chunks, which can come from anywhere in the extracted text.
+"""
+
+import os
+import math
+import asyncio
+import hashlib
+from collections import Counter
+import metrics
+import deadline
+from condense import strip_boilerplate, split_by_tokens, index_terms
+from cache import CACHE_DIR, LRUCache, AnalysisCache, make_cache_key
+from prompt import (
+    SYSTEM_PREAMBLE,
+    document_store,
+    fetch_paper_text,
+    source_type,
+    extract_paper_id,
+    select_analysis_view
+)
+from async_prompt import fetch_paper_text_async
+from pipeline import in_flight, async_in_flight, call_and_store, call_and_store_async
+from sections import segment, PaperTextUnavailable
+from log import get_logger
+
+logger = get_logger('qa')
+
+# Paper tokens per indexed chunk
+QA_CHUNK_TOKENS = int(os.getenv('ELACITY_QA_CHUNK_TOKENS', 250))
+# Chunks sent with each question
+QA_TOP_K = int(os.getenv('ELACITY_QA_TOP_K', 5))
+QA_COMPLETION_TOKENS = int(os.getenv('ELACITY_QA_COMPLETION_TOKENS', 600))
+QA_MAX_QUESTION_CHARS = 1000
+# Parsed indexes kept in memory (each is rebuilt from the document store on a miss)
+QA_INDEX_MEMORY_ENTRIES = 64
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Bump when chunking or condense.index_terms changes (stored indexes are rebuilt), or QA_SYSTEM_PROMPT changes
+INDEX_VERSION = "1"
+QA_PROMPT_VERSION = "1"
+
+INDEX_NAME = f'bm25-v{INDEX_VERSION}'
+
+# Answers, kept apart so they neither evict analyses nor skew its counters
+qa_cache = AnalysisCache(
+    db_path=os.getenv('ELACITY_QA_DB', os.path.join(CACHE_DIR, 'answers.sqlite3')),
+    max_entries=int(os.getenv('ELACITY_QA_MEMORY_ENTRIES', 256)),
+    ttl_seconds=int(os.getenv('ELACITY_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+)
+
+QA_SYSTEM_PROMPT = SYSTEM_PREAMBLE + """
+
+You will be given numbered excerpts from one academic paper, chosen because they match a reader's question, and the question itself. Answer the question from the excerpts, plus a version of the answer in simple language that anyone can understand.
+
+Return ONLY a JSON object with this structure:
+
+{
+  "answer": "[A direct answer in 1-4 sentences, with specific numbers from the excerpts where relevant]",
+  "sources": [1, 3],
+  "eli12": {
+    "answer": "[The same answer in simple language]"
+  }
+}
+
+"sources" lists the numbers of the excerpts the answer relies on. Use only what the excerpts say; if they do not answer the question, say so in "answer" and return an empty "sources" list."""
+
+
+class BM25Index:
+    """BM25 over a paper's chunks. Chunks are (section_title, start, end) offsets into the clean text."""
+
+    def __init__(self, chunks, postings, lengths):
+        self.chunks = chunks
+        self.postings = postings
+        self.lengths = lengths
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, text):
+        """Index paper text. Returns (clean_text, index)."""
+        clean_text, sections = segment(text)
+        chunks, postings, lengths = [], {}, []
+        for section in sections:
+            body = clean_text[section['start']:section['end']]
+            position = section['start']
+            for part in split_by_tokens(body, QA_CHUNK_TOKENS):
+                position = clean_text.index(part, position)
+                terms = Counter(index_terms(part))
+                for term, count in terms.items():
+                    postings.setdefault(term, []).append([len(chunks), count])
+                lengths.append(sum(terms.values()))
+                chunks.append([section['title'], position, position + len(part)])
+                position += len(part)
+        return clean_text, cls(chunks, postings, lengths)
+
+    def to_dict(self):
+        return {'chunks': self.chunks, 'postings': self.postings, 'lengths': self.lengths}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['chunks'], data['postings'], data['lengths'])
+
+    def search(self, query, k=QA_TOP_K):
+        """The k best chunks for query as [(score, chunk_index)], best first; only chunks sharing a term score."""
+        count = len(self.lengths)
+        scores = {}
+        for term in set(index_terms(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk, frequency in postings:
+                norm = K1 * (1 - B + B * self.lengths[chunk] / self.average_length)
+                scores[chunk] = scores.get(chunk, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(score, chunk) for chunk, score in best]
+
+
+_indexes = LRUCache(max_entries=QA_INDEX_MEMORY_ENTRIES)
+
+
+def load_index(url, text):
+    """
+    The paper's index, from memory, then the document store, building (and storing) it
+    on a miss. Returns (clean_text, index).
+    """
+    if not text:
+        raise PaperTextUnavailable('Could not extract text from this paper')
+
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    index = _indexes.get(digest)
+    if index is None:
+        data = document_store.get_index(url, INDEX_NAME, digest)
+        if data is not None:
+            index = BM25Index.from_dict(data)
+        else:
+            with metrics.timer('prompt'):
+                _, index = BM25Index.build(text)
+            # Text cut short by the deadline is not stored, and neither is its index
+            if deadline.PARTIAL_TEXT not in deadline.degraded():
+                document_store.put_index(url, INDEX_NAME, digest, index.to_dict())
+            logger.info("Indexed paper", url=url, chunks=len(index.chunks), terms=len(index.postings))
+        _indexes.set(digest, index)
+    return strip_boilerplate(text), index
+
+
+def qa_request(url, question, clean_text, index):
+    """
+    chat.completions.create arguments for question, the excerpts it carries as
+    [(title, text)], and the cache key for its answer.
+    """
+    hits = index.search(question)
+    # Nothing matched: fall back to the opening chunks, which hold the abstract
+    chunks = [chunk for _, chunk in hits] or list(range(min(QA_TOP_K, len(index.chunks))))
+    # In reading order, so neighbouring excerpts read naturally
+    excerpts = [(index.chunks[chunk][0], clean_text[index.chunks[chunk][1]:index.chunks[chunk][2]]) for chunk in sorted(chunks)]
+
+    numbered = '\n\n'.join(f"[{number}] ({title})\n{text}" for number, (title, text) in enumerate(excerpts, 1))
+    prompt = f"""PAPER ID: {extract_paper_id(url) or url}
+
+EXCERPTS:
+{numbered}
+
+QUESTION: {question}"""
+
+    model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+    request = {
+        'model': model,
+        'response_format': {"type": "json_object"},
+        'messages': [
+            {"role": "system", "content": QA_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        'max_completion_tokens': QA_COMPLETION_TOKENS
+    }
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return request, excerpts, make_cache_key(f'qa:{digest}', 'qa', model, QA_PROMPT_VERSION)
+
+
+def _answer_view(url, question, excerpts, payload, eli12):
+    view = {'paper_id': extract_paper_id(url) or url, 'question': question}
+    view.update(select_analysis_view(payload, 'quick', eli12))
+    view['excerpts'] = [{'number': number, 'section': title, 'text': text} for number, (title, text) in enumerate(excerpts, 1)]
+    reasons = deadline.degraded()
+    if reasons:
+        view['degraded'] = reasons
+    return view
+
+
+def answer_question(url, question, eli12=False, timeout=deadline.ANALYSIS_TIMEOUT_SECONDS):
+    """
+    Answer a question about a paper from its best-matching chunks.
+    Returns (payload, cache_status) with cache_status as for pipeline.run_analysis.
+    Raises PaperTextUnavailable, or Overloaded when OpenAI has no capacity.
+    """
+    metrics.set_labels(source_type(url), 'qa')
+    with deadline.deadline(timeout):
+        clean_text, index = load_index(url, fetch_paper_text(url))
+        request, excerpts, key = qa_request(url, question, clean_text, index)
+        payload, status = qa_cache.lookup(key)
+        if payload is None:
+            payload, shared = in_flight.do(key, call_and_store, qa_cache, key, request)
+            status = 'coalesced' if shared else 'miss'
+        return _answer_view(url, question, excerpts, payload, eli12), status
+
+
+async def answer_question_async(url, question, eli12=False, timeout=deadline.ANALYSIS_TIMEOUT_SECONDS):
+    """Event-loop counterpart of answer_question."""
+    metrics.set_labels(source_type(url), 'qa')
+    with deadline.deadline(timeout):
+        text = await fetch_paper_text_async(url)
+        clean_text, index = await asyncio.to_thread(load_index, url, text)
+        request, excerpts, key = qa_request(url, question, clean_text, index)
+        payload, status = qa_cache.lookup(key)
+        if payload is None:
+            payload, shared = await async_in_flight.do(key, call_and_store_async, qa_cache, key, request)
+            status = 'coalesced' if shared else 'miss'
+        return _answer_view(url, question, excerpts, payload, eli12), status
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Elacity Rate Limiting
+Two layers keep bursts from reaching OpenAI as 429s:
+
+- ClientRateLimiter: a token bucket per client on the analysis endpoints
+  (MAX_REQUESTS_PER_MINUTE, with bursts of ELACITY_RATE_LIMIT_BURST).
+- AdmissionController: one process-wide budget of OpenAI tokens and requests per
+  minute (OPENAI_TPM_LIMIT / OPENAI_RPM_LIMIT). Each call reserves its estimated
+  prompt tokens plus its completion allowance, and waits for the budget to refill
+  if needed; calls that would wait longer than OPENAI_ADMISSION_MAX_WAIT_SECONDS
+  are shed with Overloaded. 429s that still get through are retried with backoff
+  and pause every caller for the provider's Retry-After; server errors and dropped
+  connections are retried too (the OpenAI clients' own retries are turned off so
+  every attempt goes through admission).
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import OrderedDict
+import openai
+import deadline
+from condense import count_tokens
+from log import get_logger
+
+logger = get_logger('ratelimit')
+
+# Per-client limit on the analysis endpoints (0 disables it)
+MAX_REQUESTS_PER_MINUTE = int(os.getenv('MAX_REQUESTS_PER_MINUTE', 60))
+RATE_LIMIT_BURST = int(os.getenv('ELACITY_RATE_LIMIT_BURST', 10))
+# Header carrying the client address when behind a proxy (e.g. X-Real-IP); the socket address otherwise
+RATE_LIMIT_KEY_HEADER = os.getenv('ELACITY_RATE_LIMIT_KEY_HEADER')
+
+# The account's OpenAI limits for OPENAI_MODEL (0 disables that budget)
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', 200000))
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', 500))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv('OPENAI_ADMISSION_MAX_WAIT_SECONDS', 20))
+
+# Retries of 429s, 5xx and connection errors: Retry-After when OpenAI sends one, else exponential backoff with jitter
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
+
+class Overloaded(Exception):
+    """Raised when OpenAI capacity will not be available within the allowed wait."""
+
+    def __init__(self, retry_after):
+        super().__init__('OpenAI capacity exhausted; try again later')
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    """Refills at rate per second up to capacity. Not thread-safe; callers hold a lock."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        # now may predate a bucket created after it was read
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount can be taken (amounts above capacity wait for a full bucket)."""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.tokens) / self.rate)
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+    def take(self, amount, now):
+        """Take amount, going into debt if the bucket holds less; later callers wait it off."""
+        self._refill(now)
+        self.tokens -= amount
+
+    def give(self, amount, now):
+        """Return amount taken earlier, up to capacity."""
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ClientRateLimiter:
+    """A token bucket per client key, keeping the most recently seen max_clients."""
+
+    def __init__(self, requests_per_minute, burst, max_clients=10000):
+        self.requests_per_minute = requests_per_minute
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limited = 0
+
+    def check(self, client, amount=1):
+        """
+        Count a request from client costing amount requests (a batch costs one per paper).
+        Returns 0 if allowed, else seconds until it may retry. A cost above the burst waits
+        for a full bucket and leaves the client in debt, so its next requests wait it off.
+        """
+        if self.requests_per_minute <= 0:
+            return 0
+
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(client, None)
+            if bucket is None:
+                bucket = TokenBucket(self.requests_per_minute / 60, self.burst)
+            self._buckets[client] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+            wait = bucket.wait_time(amount, now)
+            if wait > 0:
+                self._limited += 1
+                return max(1, int(wait + 0.999))
+            bucket.take(amount, now)
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._buckets), 'limited': self._limited}
+
+
+def estimate_tokens(request):
+    """Tokens OpenAI counts against TPM for a chat request: the prompt plus the completion allowance."""
+    prompt = sum(count_tokens(message['content']) for message in request['messages'])
+    return prompt + request.get('max_completion_tokens', 0)
+
+
+def _is_retryable(error):
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota is also a 429, but waiting will not fix it
+        return getattr(error, 'code', None) != 'insufficient_quota'
+    return isinstance(error, (openai.InternalServerError, openai.APIConnectionError))
+
+
+def _retry_delay(error, attempt):
+    """Seconds before retry attempt: OpenAI's Retry-After if given, else capped exponential backoff with jitter."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _with_deadline(request):
+    """request with an OpenAI timeout of the time left before the analysis deadline, if there is one."""
+    left = deadline.timeout()
+    return request if left is None else dict(request, timeout=left)
+
+
+class AdmissionController:
+    """Process-wide OpenAI TPM/RPM budget shared by every thread and event loop."""
+
+    def __init__(self, tokens_per_minute, requests_per_minute, max_wait_seconds, max_retries=OPENAI_MAX_RETRIES):
+        self._tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute > 0 else None
+        self._requests = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute > 0 else None
+        self.max_wait_seconds = max_wait_seconds
+        self.max_retries = max_retries
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._counts = {'admitted': 0, 'delayed': 0, 'shed': 0, 'retried': 0}
+
+    def _reserve(self, tokens):
+        """Reserve capacity for one call. Returns the seconds the caller must wait before making it."""
+        # Never queue past the analysis deadline
+        deadline.check()
+        left = deadline.remaining()
+        max_wait = self.max_wait_seconds if left is None else min(self.max_wait_seconds, left)
+
+        now = time.monotonic()
+        with self._lock:
+            wait = max(0.0, self._paused_until - now)
+            if self._tokens is not None:
+                wait = max(wait, self._tokens.wait_time(tokens, now))
+            if self._requests is not None:
+                wait = max(wait, self._requests.wait_time(1, now))
+
+            if wait > max_wait:
+                self._counts['shed'] += 1
+                raise Overloaded(wait)
+
+            if self._tokens is not None:
+                self._tokens.take(tokens, now)
+            if self._requests is not None:
+                self._requests.take(1, now)
+            self._counts['admitted'] += 1
+            if wait > 0:
+                self._counts['delayed'] += 1
+            return wait
+
+    def settle(self, estimated, usage):
+        """Charge tokens a call used beyond its estimate (usage as in prompt.usage_summary)."""
+        if not usage or self._tokens is None:
+            return
+        extra = usage['prompt_tokens'] + usage['completion_tokens'] - estimated
+        if extra > 0:
+            with self._lock:
+                self._tokens.take(extra, time.monotonic())
+
+    def pause(self, seconds):
+        """Hold every new call for seconds (after OpenAI has throttled us)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _retry_delay_or_raise(self, error, attempt, estimated):
+        """
+        Seconds to sleep before retrying a failed call, or raise if it should not be retried.
+        A retried call's estimated tokens are released, since the retry reserves them again.
+        """
+        if not _is_retryable(error):
+            raise error
+        throttled = isinstance(error, openai.RateLimitError)
+        delay = _retry_delay(error, attempt)
+        if throttled:
+            # Everyone waits out a 429, not just this caller
+            self.pause(delay)
+        left = deadline.remaining()
+        if attempt >= self.max_retries or (left is not None and delay >= left):
+            if throttled:
+                raise Overloaded(delay) from error
+            raise error
+
+        with self._lock:
+            self._counts['retried'] += 1
+            if self._tokens is not None:
+                self._tokens.give(estimated, time.monotonic())
+        logger.warning("Retrying OpenAI call", error=type(error).__name__, attempt=attempt + 1, delay_seconds=round(delay, 2))
+        return 0 if throttled else delay
+
+    def call(self, create, request):
+        """
+        Run create(**request) once capacity allows, retrying throttled and failed attempts.
+        Returns (response, estimated_tokens). Raises Overloaded if capacity does not free up in time.
+        """
+        estimated = estimate_tokens(request)
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated)
+            if wait:
+                time.sleep(wait)
+            try:
+                return create(**_with_deadline(request)), estimated
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                time.sleep(self._retry_delay_or_raise(e, attempt, estimated))
+                attempt += 1
+
+    async def call_async(self, create, request):
+        """Event-loop counterpart of call for an async create."""
+        estimated = await asyncio.to_thread(estimate_tokens, request)
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                return await create(**_with_deadline(request)), estimated
+            except (openai.APIStatusError, openai.APIConnectionError) as e:
+                await asyncio.sleep(self._retry_delay_or_raise(e, attempt, estimated))
+                attempt += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            stats = dict(self._counts)
+            if self._tokens is not None:
+                stats['tokens_available'] = int(self._tokens.available(now))
+            if self._requests is not None:
+                stats['requests_available'] = int(self._requests.available(now))
+            stats['paused_seconds'] = round(max(0.0, self._paused_until - now), 1)
+        return stats
+
+
+# Shared by the sync, async and streaming OpenAI calls in this process
+openai_admission = AdmissionController(OPENAI_TPM_LIMIT, OPENAI_RPM_LIMIT, ADMISSION_MAX_WAIT_SECONDS)
+
+# Per-client limit on the analysis endpoints of either server
+client_limiter = ClientRateLimiter(MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST)
+
+
+def client_key(headers, remote_addr):
+    """The rate-limit key for a request: the configured proxy header, or the socket address."""
+    if RATE_LIMIT_KEY_HEADER and headers.get(RATE_LIMIT_KEY_HEADER):
+        # X-Forwarded-For lists the original client first
+        return headers.get(RATE_LIMIT_KEY_HEADER).split(',')[0].strip()
+    return remote_addr or 'unknown'
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Elacity Reading List Analysis
+Analyzes many paper URLs at once: duplicates are merged by paper ID, documents are
+downloaded concurrently under a per-host limit, and analyses run with bounded
+parallelism, so a whole list takes about as long as its slowest paper.
+"""
+
+import os
+import queue
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from prompt import fetch_paper_text, document_key, select_analysis_view, source_type
+from pipeline import run_analysis, analysis_cache, analysis_cache_key, last_usage
+from log import get_logger
+from ratelimit import Overloaded
+
+logger = get_logger('reading_list')
+
+# Most URLs accepted in one request
+MAX_URLS = int(os.getenv('ELACITY_BATCH_MAX_URLS', 100))
+# Concurrent OpenAI analyses per request
+ANALYSIS_WORKERS = int(os.getenv('ELACITY_BATCH_CONCURRENCY', 8))
+# Concurrent downloads per request, and per host within them (arXiv throttles bursts)
+FETCH_WORKERS = int(os.getenv('ELACITY_BATCH_FETCH_WORKERS', 16))
+PER_HOST_FETCHES = int(os.getenv('ELACITY_BATCH_PER_HOST', 4))
+
+
+def _host(url):
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+def group_urls(urls):
+    """
+    Merge URLs that point at the same paper (abs/pdf links, versions, repeats).
+    Returns a list of (paper_id, [(index, url), ...]) in first-seen order.
+    """
+    groups = {}
+    for index, url in enumerate(urls):
+        groups.setdefault(document_key(url), []).append((index, url))
+    return list(groups.items())
+
+
+def analyze_reading_list(urls, analysis_type="full", eli12=False, no_cache=False):
+    """
+    Analyze every paper in urls, yielding one result dict per distinct paper as
+    soon as it is ready (cached papers first):
+    {paper_id, urls, indexes, cache, analysis} or {paper_id, urls, indexes, error}.
+    Papers that needed an OpenAI call also carry its token usage.
+    indexes are the positions in urls the result answers.
+    """
+    pending = []
+    for paper_id, entries in group_urls(urls):
+        record = {
+            'paper_id': paper_id,
+            'urls': [url for _, url in entries],
+            'indexes': [index for index, _ in entries]
+        }
+        url = entries[0][1]
+
+        if not no_cache:
+            cached, tier = analysis_cache.lookup(analysis_cache_key(url, analysis_type))
+            if cached is not None:
+                yield dict(record, cache=tier, analysis=select_analysis_view(cached, analysis_type, eli12))
+                continue
+
+        pending.append((record, url))
+
+    if not pending:
+        return
+
+    results = queue.Queue()
+    host_limits = {}
+    for _, url in pending:
+        host_limits.setdefault(_host(url), threading.BoundedSemaphore(PER_HOST_FETCHES))
+
+    fetch_pool = ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(pending)), thread_name_prefix='elacity-batch-fetch')
+    analysis_pool = ThreadPoolExecutor(max_workers=min(ANALYSIS_WORKERS, len(pending)), thread_name_prefix='elacity-batch-analyze')
+
+    def analyze(record, url):
+        try:
+            payload, cache_status = run_analysis(url, analysis_type, eli12, no_cache=no_cache)
+            result = dict(record, cache=cache_status, analysis=payload)
+            if last_usage.get():
+                result['usage'] = last_usage.get()
+            results.put(result)
+        except Overloaded as e:
+            results.put(dict(record, error=str(e), retry_after=e.retry_after))
+        except Exception as e:
+            results.put(dict(record, error=str(e)))
+
+    def prefetch(record, url):
+        # Warm the document store so the analysis step never waits on the network
+        metrics.set_labels(source_type(url), analysis_type)
+        try:
+            with host_limits[_host(url)]:
+                fetch_paper_text(url)
+        except Exception as e:
+            logger.warning("Error prefetching paper", url=url, error=str(e))
+        try:
+            analysis_pool.submit(analyze, record, url)
+        except RuntimeError:
+            # Client went away and the pools were shut down
+            pass
+
+    try:
+        for record, url in pending:
+            fetch_pool.submit(prefetch, record, url)
+
+        for _ in pending:
+            yield results.get()
+    finally:
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+        analysis_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Elacity Related Papers
+A local similarity index over every paper this server has analyzed, so related papers
+come from our own corpus in milliseconds instead of from an external service.
+
+Each paper is a hashed term-frequency vector (its analysis plus its extracted text)
+in a NumPy array memory-mapped from disk, alongside per-bucket document frequencies.
+IDF weights are applied at query time, so older vectors stay comparable as the corpus
+grows. Papers are added as they are analyzed; `python ai/related.py rebuild` rebuilds
+the index from the document store and analysis cache.
+
+The index files are written by one process; run the server with a single worker
+process, or rebuild while it is stopped.
+"""
+
+import os
+import sys
+import time
+import zlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import deadline
+from cache import CACHE_DIR
+from condense import index_terms
+from prompt import document_key, document_store
+from log import get_logger
+
+logger = get_logger('related')
+
+RELATED_DIR = os.getenv('ELACITY_RELATED_DIR', os.path.join(CACHE_DIR, 'related'))
+# Hash buckets per vector (4 bytes each per paper); changing it needs a rebuild
+DIMENSIONS = int(os.getenv('ELACITY_RELATED_DIMENSIONS', 4096))
+DEFAULT_RESULTS = 10
+MAX_RESULTS = 50
+# Candidates taken from the fast pass and re-scored exactly, per result requested
+RERANK_FACTOR = 4
+
+# Analysis fields that say nothing about the paper's topic
+_SKIPPED_FIELDS = {'eli12', 'eli12_description', 'color', 'level', 'insight', 'scores', 'degraded'}
+
+
+class NotIndexed(LookupError):
+    """Raised for a paper that is neither in the index nor in the document store."""
+
+
+def analysis_text(payload):
+    """The topical text of an analysis payload: every string except ELI12 wording and display fields."""
+    if isinstance(payload, str):
+        return payload
+    if isinstance(payload, dict):
+        return ' '.join(analysis_text(value) for key, value in payload.items() if key not in _SKIPPED_FIELDS)
+    if isinstance(payload, list):
+        return ' '.join(analysis_text(value) for value in payload)
+    return ''
+
+
+def vectorize(text, dimensions=DIMENSIONS):
+    """Unit-length sublinear term-frequency vector of text, with terms hashed into dimensions buckets."""
+    buckets = [zlib.crc32(term.encode('utf-8')) % dimensions for term in index_terms(text)]
+    counts = np.bincount(np.asarray(buckets, dtype=np.int64), minlength=dimensions).astype(np.float32)
+    present = counts > 0
+    counts[present] = 1 + np.log(counts[present])
+    norm = np.linalg.norm(counts)
+    return counts / norm if norm else counts
+
+
+class RelatedIndex:
+    """Paper vectors in a growable memory-mapped array, with paper details in SQLite."""
+
+    def __init__(self, directory, dimensions=DIMENSIONS):
+        self.directory = directory
+        self.dimensions = dimensions
+        os.makedirs(directory, exist_ok=True)
+        # The file names carry the dimensions, so changing them starts a fresh index
+        self._vectors_path = os.path.join(directory, f'vectors-{dimensions}.f32')
+        self._df_path = os.path.join(directory, f'df-{dimensions}.i32')
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(os.path.join(directory, f'papers-{dimensions}.sqlite3'), check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS papers ('
+            'row INTEGER PRIMARY KEY, '
+            'key TEXT UNIQUE NOT NULL, '
+            'url TEXT NOT NULL, '
+            'title TEXT, '
+            'updated_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+        self._open()
+
+    def _open(self):
+        self._count = self._conn.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+        self._keys = {}
+        self._papers = []
+        for row, key, url, title in self._conn.execute('SELECT row, key, url, title FROM papers ORDER BY row'):
+            self._keys[key] = row
+            self._papers.append((key, url, title))
+
+        if not os.path.exists(self._df_path):
+            np.zeros(self.dimensions, dtype=np.int32).tofile(self._df_path)
+        self._df = np.memmap(self._df_path, dtype=np.int32, mode='r+', shape=(self.dimensions,))
+        self._vectors = None
+        self._capacity = 0
+        self._map_vectors(max(self._count, 1))
+
+    def _map_vectors(self, rows):
+        """Map the vector file with room for at least rows papers, growing it by doubling."""
+        row_bytes = self.dimensions * 4
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        capacity = size // row_bytes
+        if capacity < rows:
+            capacity = max(rows, capacity * 2, 64)
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._vectors = None
+            with open(self._vectors_path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dimensions))
+        self._capacity = capacity
+
+    def add(self, key, url, title, text):
+        """Add or replace the vector for paper key."""
+        vector = vectorize(text, self.dimensions)
+        with self._lock:
+            row = self._keys.get(key)
+            if row is None:
+                row = self._count
+                if row >= self._capacity:
+                    self._map_vectors(row + 1)
+                self._count += 1
+                self._keys[key] = row
+                self._papers.append((key, url, title))
+            else:
+                self._df -= (self._vectors[row] > 0).astype(np.int32)
+                self._papers[row] = (key, url, title)
+
+            self._vectors[row] = vector
+            self._df += (vector > 0).astype(np.int32)
+            self._vectors.flush()
+            self._df.flush()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO papers (row, key, url, title, updated_at) VALUES (?, ?, ?, ?, ?)',
+                (row, key, url, title, time.time())
+            )
+            self._conn.commit()
+
+    def vector_for(self, key):
+        """The stored vector for paper key, or None."""
+        with self._lock:
+            row = self._keys.get(key)
+            return None if row is None else np.array(self._vectors[row])
+
+    def query(self, vector, n=DEFAULT_RESULTS, exclude=None):
+        """The n papers most similar to vector as [{'paper_id', 'url', 'title', 'score'}], best first."""
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return []
+            idf = np.log((1 + count) / (1 + self._df.astype(np.float32))) + 1
+            vectors = self._vectors[:count]
+
+            # Fast pass over every paper, then exact IDF-weighted cosine for the best candidates
+            scores = vectors @ (vector * idf * idf)
+            candidates = min(count, n * RERANK_FACTOR + 1)
+            rows = np.argpartition(-scores, candidates - 1)[:candidates]
+            weighted = vectors[rows] * idf
+            query = vector * idf
+            norms = np.linalg.norm(weighted, axis=1) * (np.linalg.norm(query) or 1.0)
+            exact = (weighted @ query) / np.where(norms > 0, norms, 1.0)
+            papers = [(float(score), self._papers[row]) for row, score in zip(rows.tolist(), exact.tolist())]
+
+        papers.sort(key=lambda item: -item[0])
+        return [
+            {'paper_id': key, 'url': url, 'title': title, 'score': round(score, 4)}
+            for score, (key, url, title) in papers
+            if key != exclude and score > 0
+        ][:n]
+
+    def clear(self):
+        """Drop every paper (before a rebuild)."""
+        with self._lock:
+            self._conn.execute('DELETE FROM papers')
+            self._conn.commit()
+            self._vectors = None
+            self._df = None
+            for path in (self._vectors_path, self._df_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._open()
+
+    def stats(self):
+        with self._lock:
+            return {'papers': self._count, 'dimensions': self.dimensions, 'capacity': self._capacity}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+# Updates run one at a time, off the request path
+_updates = ThreadPoolExecutor(max_workers=1, thread_name_prefix='elacity-related')
+
+
+def get_index():
+    """The process's RelatedIndex, opened on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RelatedIndex(RELATED_DIR)
+        return _index
+
+
+def _add(url, text, payload):
+    try:
+        get_index().add(document_key(url), url, payload.get('title'), f"{analysis_text(payload)} {text or ''}")
+    except Exception:
+        logger.exception("Related index update failed", url=url)
+
+
+def record(url, text, payload):
+    """Add a freshly analyzed paper to the index in the background (skipped for results from partial or missing text)."""
+    if set(payload.get('degraded', ())) & {deadline.PARTIAL_TEXT, deadline.NO_TEXT}:
+        return
+    _updates.submit(_add, url, text, payload)
+
+
+def related_to(url, n=DEFAULT_RESULTS):
+    """
+    The n indexed papers most similar to the paper at url. Papers not indexed yet are
+    compared by their stored text; raises NotIndexed if there is none.
+    """
+    index = get_index()
+    key = document_key(url)
+    vector = index.vector_for(key)
+    if vector is None:
+        text = document_store.get(url)
+        if not text:
+            raise NotIndexed('Paper has not been analyzed yet')
+        vector = vectorize(text, index.dimensions)
+    return index.query(vector, n, exclude=key)
+
+
+def rebuild(index=None):
+    """Rebuild the index from every stored document and its cached analysis. Returns the number of papers."""
+    # Imported here: the pipeline records into this module as it analyzes
+    from pipeline import analysis_cache, analysis_cache_key
+
+    index = index or get_index()
+    index.clear()
+    count = 0
+    for url, text in document_store.items():
+        payload = analysis_cache.get(analysis_cache_key(url, 'full')) or analysis_cache.get(analysis_cache_key(url, 'quick')) or {}
+        index.add(document_key(url), url, payload.get('title'), f"{analysis_text(payload)} {text}")
+        count += 1
+    return count
+
+
+def main():
+    """Main function for command line usage."""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('rebuild', 'query'):
+        print("Usage: python ai/related.py rebuild")
+        print("       python ai/related.py query <paper_url> [n]")
+        return
+
+    if sys.argv[1] == 'rebuild':
+        started = time.perf_counter()
+        count = rebuild()
+        print(f"Indexed {count} papers in {time.perf_counter() - started:.1f}s ({RELATED_DIR})")
+        return
+
+    n = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_RESULTS
+    try:
+        results = related_to(sys.argv[2], n)
+    except NotIndexed as e:
+        print(e)
+        return
+    for result in results:
+        print(f"{result['score']:.3f}  {result['paper_id']}  {result['title'] or result['url']}")
+
+
+if __name__ == "__main__":
+    main()
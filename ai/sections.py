@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Elacity Section-by-Section Analysis
+Backs /api/section: a paper is segmented once into addressable sections, and each
+section is explained on its own with a small prompt as the reader scrolls to it.
+
+The segmentation is cached by the paper text's content and each section's result by
+its prompt, so scrolling back and forth never repeats a call. After a section is
+served, the next ELACITY_SECTION_PREFETCH sections are analyzed in the background;
+a request that arrives while its prefetch is still running waits for it instead of
+making a second call.
+"""
+
+import os
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import deadline
+from condense import (
+    find_sections,
+    strip_boilerplate,
+    count_tokens,
+    split_by_tokens,
+    section_title,
+    DROPPED_KINDS
+)
+from cache import CACHE_DIR, AnalysisCache, make_cache_key
+from prompt import (
+    SYSTEM_PREAMBLE,
+    fetch_paper_text,
+    source_type,
+    extract_paper_id,
+    select_analysis_view
+)
+from async_prompt import fetch_paper_text_async
+from pipeline import in_flight, async_in_flight, call_and_store, call_and_store_async
+from log import get_logger
+
+logger = get_logger('sections')
+
+# Sections longer than this many tokens are split into parts of their own
+SECTION_MAX_TOKENS = int(os.getenv('ELACITY_SECTION_MAX_TOKENS', 2500))
+# Fragments shorter than this (stray headings) are merged into the next section
+SECTION_MIN_TOKENS = 40
+# Completion allowance for one section's explanation
+SECTION_COMPLETION_TOKENS = int(os.getenv('ELACITY_SECTION_COMPLETION_TOKENS', 800))
+# Paper tokens (title and abstract first) sent with every section for context
+CONTEXT_TOKENS = 150
+# Sections after the requested one to analyze ahead of the reader (0 disables prefetching)
+PREFETCH_AHEAD = int(os.getenv('ELACITY_SECTION_PREFETCH', 1))
+PREFETCH_WORKERS = int(os.getenv('ELACITY_SECTION_PREFETCH_WORKERS', 2))
+
+# Bump when segmentation changes, or SECTION_SYSTEM_PROMPT changes, so cached entries are not reused
+SEGMENTATION_VERSION = "1"
+SECTION_PROMPT_VERSION = "1"
+
+# Segmentations and section explanations, kept apart so they neither evict analyses nor skew its counters
+section_cache = AnalysisCache(
+    db_path=os.getenv('ELACITY_SECTION_DB', os.path.join(CACHE_DIR, 'sections.sqlite3')),
+    max_entries=int(os.getenv('ELACITY_SECTION_MEMORY_ENTRIES', 256)),
+    ttl_seconds=int(os.getenv('ELACITY_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+)
+
+SECTION_SYSTEM_PROMPT = SYSTEM_PREAMBLE + """
+
+You will be given one section of an academic paper, with the paper's opening for context. Explain that section to a reader who has just scrolled to it, plus a version of it in simple language that anyone can understand.
+
+Return ONLY a JSON object with this structure:
+
+{
+  "heading": "[The section's heading]",
+  "summary": "[2-3 sentences: what this section says and how it fits the paper]",
+  "key_points": ["[The section's main claims, methods or results, with specific numbers if given - at most 4]"],
+  "terms": [{"term": "[Technical term used in this section]", "definition": "[One-sentence definition]"}],
+  "eli12": {
+    "summary": "[The same summary in simple language with an everyday analogy]",
+    "key_points": ["[The key points in simple language]"]
+  }
+}
+
+Only explain what this section contains; do not summarize the rest of the paper."""
+
+
+class PaperTextUnavailable(Exception):
+    """Raised when no text could be extracted for the paper, so it cannot be segmented."""
+
+
+class SectionNotFound(LookupError):
+    """Raised for a section index outside the paper's outline."""
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def segment(text):
+    """
+    Split paper text into addressable sections. Returns (clean_text, sections), where each
+    section is {'kind', 'title', 'start', 'end', 'tokens'} over clean_text (the text without
+    boilerplate). References, acknowledgments and appendices are left out; sections over
+    SECTION_MAX_TOKENS become numbered parts.
+    """
+    text = strip_boilerplate(text)
+    sections = []
+    carry = None
+    for kind, heading, end in find_sections(text):
+        if kind in DROPPED_KINDS:
+            continue
+        start = heading if carry is None else carry
+        carry = None
+        body = text[start:end].strip()
+        tokens = count_tokens(body) if body else 0
+        if tokens < SECTION_MIN_TOKENS:
+            carry = start
+            continue
+
+        # Named after its own heading, even with a fragment merged in front of it
+        title = section_title(kind, text[heading:end].strip())
+        # Long sections become parts of equal size rather than full parts and a stub
+        count = -(-tokens // SECTION_MAX_TOKENS)
+        parts = split_by_tokens(body, -(-tokens // count) + 1) if count > 1 else [body]
+        position = start
+        for number, part in enumerate(parts, 1):
+            position = text.index(part, position)
+            sections.append({
+                'kind': kind,
+                'title': title if len(parts) == 1 else f'{title} ({number}/{len(parts)})',
+                'start': position,
+                'end': position + len(part),
+                'tokens': tokens if len(parts) == 1 else count_tokens(part)
+            })
+            position += len(part)
+
+    if carry is not None and sections:
+        # A trailing fragment belongs to the last section
+        sections[-1]['end'] = len(text.rstrip())
+    return text, sections
+
+
+def segmentation_cache_key(text):
+    return make_cache_key(f'text:{_digest(text)}', 'sections', 'segmentation', SEGMENTATION_VERSION)
+
+
+def _outline(url, text):
+    """
+    The paper's segmentation, from the cache when this exact text was segmented before.
+    Returns (outline, cache_status) with cache_status 'memory', 'disk' or 'miss'.
+    """
+    if not text:
+        raise PaperTextUnavailable('Could not extract text from this paper')
+
+    key = segmentation_cache_key(text)
+    sections, status = section_cache.lookup(key)
+    if sections is None:
+        with metrics.timer('prompt'):
+            clean_text, sections = segment(text)
+        # Text cut short by the deadline would leave the outline incomplete
+        if deadline.PARTIAL_TEXT not in deadline.degraded():
+            section_cache.set(key, sections)
+        logger.info("Segmented paper", url=url, sections=len(sections))
+    else:
+        clean_text = strip_boilerplate(text)
+    outline = {'paper_id': extract_paper_id(url) or url, 'text': clean_text, 'sections': sections}
+    return outline, status or 'miss'
+
+
+def outline_view(outline):
+    """The outline as returned by /api/section: every section's index, kind, title and size."""
+    payload = {
+        'paper_id': outline['paper_id'],
+        'sections': [
+            {'index': index, 'kind': section['kind'], 'title': section['title'], 'tokens': section['tokens']}
+            for index, section in enumerate(outline['sections'])
+        ]
+    }
+    reasons = deadline.degraded()
+    if reasons:
+        payload['degraded'] = reasons
+    return payload
+
+
+def section_request(outline, index):
+    """chat.completions.create arguments for one section, and the cache key for its result."""
+    sections = outline['sections']
+    if not 0 <= index < len(sections):
+        raise SectionNotFound(f'Section {index} not found; the paper has {len(sections)} sections')
+
+    section = sections[index]
+    text = outline['text']
+    opening = split_by_tokens(text[:CONTEXT_TOKENS * 8], CONTEXT_TOKENS)[0] if text else ''
+    prompt = f"""PAPER ID: {outline['paper_id']}
+
+PAPER OPENING:
+{opening}
+
+SECTION {index + 1} OF {len(sections)}: {section['title']}
+{text[section['start']:section['end']]}"""
+
+    model = os.getenv('OPENAI_MODEL', 'gpt-4o-mini')
+    request = {
+        'model': model,
+        'response_format': {"type": "json_object"},
+        'messages': [
+            {"role": "system", "content": SECTION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        'max_completion_tokens': SECTION_COMPLETION_TOKENS
+    }
+    # Keyed by the prompt itself, so a changed text or segmentation never reuses a stale result
+    return request, make_cache_key(f'section:{_digest(prompt)}', 'section', model, SECTION_PROMPT_VERSION)
+
+
+def _section_view(outline, index, payload, eli12):
+    section = outline['sections'][index]
+    view = {
+        'paper_id': outline['paper_id'],
+        'section': {'index': index, 'kind': section['kind'], 'title': section['title'], 'tokens': section['tokens']},
+        'sections': len(outline['sections']),
+        'next': index + 1 if index + 1 < len(outline['sections']) else None,
+        'analysis': select_analysis_view(payload, 'quick', eli12)
+    }
+    reasons = deadline.degraded()
+    if reasons:
+        view['degraded'] = reasons
+    return view
+
+
+def _prefetch_targets(outline, index):
+    """(key, request) for each upcoming section whose result is not cached."""
+    targets = []
+    for upcoming in range(index + 1, min(index + 1 + PREFETCH_AHEAD, len(outline['sections']))):
+        request, key = section_request(outline, upcoming)
+        if section_cache.peek(key) is None:
+            targets.append((key, request))
+    return targets
+
+
+_prefetch_pool = None
+
+
+def _prefetch(key, request):
+    try:
+        in_flight.do(key, call_and_store, section_cache, key, request)
+    except Exception as e:
+        logger.debug("Section prefetch failed", key=key, error=str(e))
+
+
+def prefetch(outline, index):
+    """Analyze the sections after index in the background (no deadline; shed if OpenAI is busy)."""
+    global _prefetch_pool
+    targets = _prefetch_targets(outline, index)
+    if not targets:
+        return
+    if _prefetch_pool is None:
+        _prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='elacity-prefetch')
+    for key, request in targets:
+        _prefetch_pool.submit(_prefetch, key, request)
+
+
+# Background prefetch tasks, referenced until they finish
+_prefetch_tasks = set()
+
+
+async def _prefetch_async(key, request):
+    with deadline.detached():
+        try:
+            await async_in_flight.do(key, call_and_store_async, section_cache, key, request)
+        except Exception as e:
+            logger.debug("Section prefetch failed", key=key, error=str(e))
+
+
+def prefetch_async(outline, index):
+    """Event-loop counterpart of prefetch: background tasks on the running loop."""
+    for key, request in _prefetch_targets(outline, index):
+        task = asyncio.create_task(_prefetch_async(key, request))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+
+
+def analyze_section(url, index=None, eli12=False, timeout=deadline.ANALYSIS_TIMEOUT_SECONDS):
+    """
+    Explain one section of a paper, or return the paper's outline when index is None.
+    Returns (payload, cache_status) with cache_status as for pipeline.run_analysis.
+    Raises PaperTextUnavailable, SectionNotFound, or Overloaded when OpenAI has no capacity.
+    """
+    metrics.set_labels(source_type(url), 'section')
+    with deadline.deadline(timeout):
+        outline, status = _outline(url, fetch_paper_text(url))
+        if index is None:
+            return outline_view(outline), status
+
+        request, key = section_request(outline, index)
+        payload, status = section_cache.lookup(key)
+        if payload is None:
+            payload, shared = in_flight.do(key, call_and_store, section_cache, key, request)
+            status = 'coalesced' if shared else 'miss'
+        view = _section_view(outline, index, payload, eli12)
+
+    if PREFETCH_AHEAD > 0:
+        prefetch(outline, index)
+    return view, status
+
+
+async def analyze_section_async(url, index=None, eli12=False, timeout=deadline.ANALYSIS_TIMEOUT_SECONDS):
+    """Event-loop counterpart of analyze_section."""
+    metrics.set_labels(source_type(url), 'section')
+    with deadline.deadline(timeout):
+        text = await fetch_paper_text_async(url)
+        outline, status = await asyncio.to_thread(_outline, url, text)
+        if index is None:
+            return outline_view(outline), status
+
+        request, key = section_request(outline, index)
+        payload, status = section_cache.lookup(key)
+        if payload is None:
+            payload, shared = await async_in_flight.do(key, call_and_store_async, section_cache, key, request)
+            status = 'coalesced' if shared else 'miss'
+        view = _section_view(outline, index, payload, eli12)
+
+    if PREFETCH_AHEAD > 0:
+        prefetch_async(outline, index)
+    return view, status
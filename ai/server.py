@@ -5,11 +5,22 @@ Flask server that handles API requests from the browser extension.
 """
 
 import os
-import json
 import re
-from flask import Flask, request, jsonify
+import json
+import time
+import metrics
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from prompt import analyze_paper_with_openai
+from pipeline import run_analysis, stream_analysis, analysis_cache, in_flight, usage_headers, usage_totals, TEST_ANALYSIS
+from prompt import document_store
+from jobs import JobQueue, QueueFull
+from reading_list import analyze_reading_list, MAX_URLS
+from ratelimit import Overloaded, client_limiter, client_key, openai_admission
+from mapreduce import mode_error, notes_cache
+from sections import section_cache, analyze_section, PaperTextUnavailable, SectionNotFound
+from qa import qa_cache, answer_question, QA_MAX_QUESTION_CHARS
+from fingerprint import fingerprints
+from related import related_to, get_index as related_index, NotIndexed, DEFAULT_RESULTS, MAX_RESULTS
 from dotenv import load_dotenv
 
 # Load environment variables from root directory
@@ -17,7 +28,43 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for browser extension requests
+CORS(app, expose_headers=['Retry-After', 'Location', 'X-Elacity-Cache', 'X-Elacity-Prompt-Tokens', 'X-Elacity-Cached-Tokens', 'X-Elacity-Completion-Tokens'])  # Enable CORS for browser extension requests
+
+# Background analyses for clients that poll instead of holding a request open
+analysis_jobs = JobQueue(
+    handler=run_analysis,
+    workers=int(os.getenv('ELACITY_JOB_WORKERS', 4)),
+    max_queue=int(os.getenv('ELACITY_JOB_QUEUE_SIZE', 100)),
+    result_ttl_seconds=int(os.getenv('ELACITY_JOB_RESULT_TTL_SECONDS', 3600))
+)
+
+
+def _job_metrics():
+    stats = analysis_jobs.stats()
+    return [
+        ('elacity_job_queue_depth', 'gauge', 'Analysis jobs waiting for a worker.', [({}, stats['queue_depth'])]),
+        ('elacity_jobs', 'gauge', 'Tracked analysis jobs by status.',
+         [({'status': status}, count) for status, count in sorted(stats['jobs'].items())])
+    ]
+
+
+metrics.registry.add_collector(_job_metrics)
+
+
+def _too_many_requests(error, retry_after):
+    """429 response telling the client when to come back."""
+    response = jsonify({'error': error, 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _client_limited(amount=1):
+    """A 429 response if this client is over MAX_REQUESTS_PER_MINUTE (counting amount requests), else None."""
+    retry_after = client_limiter.check(client_key(request.headers, request.remote_addr), amount)
+    if retry_after:
+        return _too_many_requests('Too many requests', retry_after)
+    return None
 
 
 # Helper to strip markdown code fences
@@ -31,6 +78,11 @@ def _strip_code_fences(raw: str) -> str:
 @app.route('/api/analyze', methods=['POST'])
 def analyze_paper():
     """Analyze a paper from URL."""
+    started = time.perf_counter()
+    limited = _client_limited()
+    if limited:
+        return limited
+
     try:
         data = request.get_json()
 
@@ -42,58 +94,240 @@ def analyze_paper():
         if not url:
             return jsonify({'error': 'URL is required'}), 400
 
-        # Analyze the paper
-        result = analyze_paper_with_openai(url, analysis_type, eli12)
-        
-        # Debug: Print the raw result
-        print(f"DEBUG: Raw OpenAI result: {repr(result)}")
-        print(f"DEBUG: Result type: {type(result)}")
-        print(f"DEBUG: Result length: {len(result) if result else 'None'}")
-
-        # Check if result is empty or None
-        if not result or result.strip() == "":
-            print("DEBUG: Empty result from OpenAI API")
-            return jsonify({
-                'title': 'Analysis Error',
-                'error': 'OpenAI API returned empty response',
-                'raw_analysis': result
-            })
-
-        # Strip all markdown and parse JSON - BULLETPROOF approach
-        clean_result = result.strip()
-        
-        # Remove any ```json or ``` at the start
-        if clean_result.startswith('```json'):
-            clean_result = clean_result[7:]  # Remove ```json
-        elif clean_result.startswith('```'):
-            clean_result = clean_result[3:]   # Remove ```
-            
-        # Remove any ``` at the end
-        if clean_result.endswith('```'):
-            clean_result = clean_result[:-3]  # Remove trailing ```
-            
-        # Strip whitespace and newlines
-        clean_result = clean_result.strip()
-        
-        print(f"DEBUG: Clean result: {repr(clean_result)}")
-        print(f"DEBUG: Clean result length: {len(clean_result)}")
-        
-        try:
-            parsed_result = json.loads(clean_result)
-            return jsonify(parsed_result)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing failed: {e}")
-            print(f"DEBUG: Failed to parse: {repr(clean_result[:200])}")
-            return jsonify({
-                'title': 'Analysis Complete',
-                'raw_analysis': result,
-                'clean_result': clean_result,
-                'error': 'Could not parse analysis as structured data'
-            })
+        # 'long' covers the whole paper with several OpenAI calls (see mapreduce.py)
+        mode = data.get('mode', 'standard')
+        mode_problem = mode_error(mode, analysis_type)
+        if mode_problem:
+            return jsonify({'error': mode_problem}), 400
+
+        # Cache controls: no_cache skips the lookup, invalidate drops the stored entry
+        no_cache = bool(data.get('no_cache', False))
+        invalidate = bool(data.get('invalidate', False))
+
+        # Analyze the paper (served from cache when possible)
+        payload, cache_status = run_analysis(url, analysis_type, eli12, no_cache=no_cache, invalidate=invalidate, mode=mode)
+
+        with metrics.timer('serialize'):
+            response = jsonify(payload)
+        response.headers['X-Elacity-Cache'] = cache_status
+        response.headers.update(usage_headers())
+
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint='analyze', cache=cache_status, **metrics.current_labels())
+        return response
 
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_paper_stream():
+    """Analyze a paper from URL, streaming results as Server-Sent Events."""
+    limited = _client_limited()
+    if limited:
+        return limited
+
+    data = request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    analysis_type = data.get('type', 'full')
+    eli12 = data.get('eli12', False)
+    no_cache = bool(data.get('no_cache', False))
+
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    def generate():
+        started = time.perf_counter()
+        cache_status = 'error'
+        for event, payload in stream_analysis(url, analysis_type, eli12, no_cache=no_cache):
+            if event == 'complete':
+                cache_status = payload['cache']
+            yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        metrics.request_seconds.observe(time.perf_counter() - started, endpoint='analyze_stream', cache=cache_status, **metrics.current_labels())
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze a list of paper URLs, streaming one JSON line per paper as each finishes."""
+    data = request.get_json(silent=True) or {}
+
+    urls = data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) and url for url in urls):
+        return jsonify({'error': 'urls must be a non-empty list of URLs'}), 400
+    if len(urls) > MAX_URLS:
+        return jsonify({'error': f'At most {MAX_URLS} URLs per batch'}), 400
+
+    # Each paper counts as one request against the client's limit
+    limited = _client_limited(len(urls))
+    if limited:
+        return limited
+
+    analysis_type = data.get('type', 'full')
+    eli12 = data.get('eli12', False)
+    no_cache = bool(data.get('no_cache', False))
+
+    def generate():
+        for result in analyze_reading_list(urls, analysis_type, eli12, no_cache=no_cache):
+            yield json.dumps(result) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/section', methods=['POST'])
+def analyze_paper_section():
+    """Explain one section of a paper, or list its sections when no section index is given."""
+    started = time.perf_counter()
+    limited = _client_limited()
+    if limited:
+        return limited
+
+    data = request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    index = data.get('section')
+    if index is not None and (isinstance(index, bool) or not isinstance(index, int)):
+        return jsonify({'error': 'section must be a section index from the outline'}), 400
+
+    try:
+        payload, cache_status = analyze_section(url, index, data.get('eli12', False))
+    except PaperTextUnavailable as e:
+        return jsonify({'error': str(e)}), 422
+    except SectionNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(payload)
+    response.headers['X-Elacity-Cache'] = cache_status
+    response.headers.update(usage_headers())
+    metrics.request_seconds.observe(time.perf_counter() - started, endpoint='section', cache=cache_status, **metrics.current_labels())
+    return response
+
+@app.route('/api/qa', methods=['POST'])
+def ask_question():
+    """Answer a question about a paper from its most relevant passages."""
+    started = time.perf_counter()
+    limited = _client_limited()
+    if limited:
+        return limited
+
+    data = request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    question = data.get('question')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    if not isinstance(question, str) or not question.strip():
+        return jsonify({'error': 'question is required'}), 400
+    if len(question) > QA_MAX_QUESTION_CHARS:
+        return jsonify({'error': f'question must be at most {QA_MAX_QUESTION_CHARS} characters'}), 400
+
+    try:
+        payload, cache_status = answer_question(url, question.strip(), data.get('eli12', False))
+    except PaperTextUnavailable as e:
+        return jsonify({'error': str(e)}), 422
+    except Overloaded as e:
+        return _too_many_requests(str(e), e.retry_after)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(payload)
+    response.headers['X-Elacity-Cache'] = cache_status
+    response.headers.update(usage_headers())
+    metrics.request_seconds.observe(time.perf_counter() - started, endpoint='qa', cache=cache_status, **metrics.current_labels())
+    return response
+
+@app.route('/api/related', methods=['GET'])
+def related_papers():
+    """Papers from our own corpus most similar to the one at ?url=."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    try:
+        n = min(max(int(request.args.get('n', DEFAULT_RESULTS)), 1), MAX_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'n must be a number'}), 400
+
+    try:
+        results = related_to(url, n)
+    except NotIndexed as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'url': url, 'related': results})
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a paper analysis; poll GET /api/jobs/<job_id> for the result."""
+    limited = _client_limited()
+    if limited:
+        return limited
+
+    data = request.get_json(silent=True) or {}
+
+    url = data.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+
+    analysis_type = data.get('type', 'full')
+    mode = data.get('mode', 'standard')
+    mode_problem = mode_error(mode, analysis_type)
+    if mode_problem:
+        return jsonify({'error': mode_problem}), 400
+
+    params = {
+        'url': url,
+        'analysis_type': analysis_type,
+        'eli12': data.get('eli12', False),
+        'no_cache': bool(data.get('no_cache', False)),
+        'invalidate': bool(data.get('invalidate', False)),
+        'mode': mode
+    }
+
+    try:
+        job = analysis_jobs.submit(params)
+    except QueueFull as e:
+        return _too_many_requests(str(e), e.retry_after)
+
+    status_url = f"/api/jobs/{job['job_id']}"
+    response = jsonify({'job_id': job['job_id'], 'status': job['status'], 'status_url': status_url})
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a queued analysis, with its result once done."""
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+
+    body = {
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'done':
+        body['result'] = job['result']
+        body['cache'] = job['cache']
+    elif job['status'] == 'failed':
+        body['error'] = job['error']
+    return jsonify(body)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint."""
@@ -102,38 +336,33 @@ def health_check():
         'openai_configured': bool(os.getenv('OPENAI_API_KEY') and os.getenv('OPENAI_API_KEY') != 'your-actual-api-key-here')
     })
 
+@app.route('/api/cache', methods=['GET'])
+def cache_stats():
+    """Analysis and document cache hit/miss counters and in-flight analyses."""
+    stats = analysis_cache.stats()
+    stats['in_flight'] = in_flight.in_flight()
+    stats['in_flight_waiters'] = in_flight.waiting()
+    stats['documents'] = document_store.stats()
+    stats['jobs'] = analysis_jobs.stats()
+    stats['openai_usage'] = usage_totals.stats()
+    stats['openai_admission'] = openai_admission.stats()
+    stats['rate_limit'] = client_limiter.stats()
+    stats['related_index'] = related_index().stats()
+    stats['fingerprints'] = fingerprints.stats()
+    stats['long_notes'] = notes_cache.stats()
+    stats['sections'] = section_cache.stats()
+    stats['qa'] = qa_cache.stats()
+    return jsonify(stats)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage latency histograms, cache and in-flight gauges in Prometheus text format."""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/api/test', methods=['POST'])
 def test_analysis():
     """Test endpoint with mock data."""
-    return jsonify({
-        'title': 'Test Paper Analysis',
-        'arxiv_id': '2023.01234',
-        'scores': {
-            'methodological_rigor': 8,
-            'data_quality': 9,
-            'innovation_level': 7
-        },
-        'summary': {
-            'regular': 'This is a test summary of the paper with technical details about the methodology and findings.',
-            'eli12': 'This is a simple explanation that a 12-year-old could understand, using analogies and simple language.'
-        },
-        'key_insights': [
-            {
-                'insight': 'key_findings',
-                'level': 'Insight',
-                'description': 'Novel approach shows significant improvements over baseline methods',
-                'eli12_description': 'The new method works much better than old ways of doing things',
-                'color': '#3b82f6'
-            },
-            {
-                'insight': 'methodology_strength',
-                'level': 'Insight',
-                'description': 'Comprehensive evaluation across multiple datasets and metrics',
-                'eli12_description': 'The scientists tested their idea in many different ways to make sure it works',
-                'color': '#3b82f6'
-            }
-        ]
-    })
+    return jsonify(TEST_ANALYSIS)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Elacity Single-Flight Registry
+Coalesces concurrent calls for the same key onto one running computation.
+"""
+
+import asyncio
+import threading
+import contextvars
+
+
+class _Call:
+    """One in-flight computation and the outcome its waiters will receive."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Registry of in-flight calls; duplicates wait for the leader's result."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless a call for key is already running,
+        in which case wait for it. Returns (result, shared) where shared is
+        True for callers that attached to another caller's run. If the run
+        raises, every caller attached to it receives the same exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+    def in_flight(self):
+        """Number of distinct computations currently running."""
+        with self._lock:
+            return len(self._calls)
+
+    def waiting(self):
+        """Number of callers currently attached to someone else's run."""
+        with self._lock:
+            return sum(call.waiters for call in self._calls.values())
+
+
+class AsyncSingleFlight:
+    """Event-loop counterpart of SingleFlight for coroutine functions."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) once per key; returns (result, shared) like SingleFlight.do.
+
+        The run is a task of its own, so no caller disconnecting (the one that started it
+        included) cancels it for the others. The caller that started it sees the context
+        variables the run set, as if it had awaited fn itself.
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            result, _ = await asyncio.shield(task)
+            return result, True
+
+        task = asyncio.create_task(_run_in_context(fn, *args, **kwargs))
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._finished(key, task))
+
+        result, context = await asyncio.shield(task)
+        for var, value in context.items():
+            if var.get(_UNSET) is not value:
+                var.set(value)
+        return result, False
+
+    def _finished(self, key, task):
+        del self._calls[key]
+        # Retrieve the error so a run every caller abandoned is not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self):
+        """Number of distinct computations currently running."""
+        return len(self._calls)
+
+
+_UNSET = object()
+
+
+async def _run_in_context(fn, *args, **kwargs):
+    """fn's result and the context it finished in (the task's copy of its starter's context)."""
+    result = await fn(*args, **kwargs)
+    return result, contextvars.copy_context()
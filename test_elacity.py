@@ -107,6 +107,34 @@ def test_command_line_tool():
         print_error(f"Command line tool error: {e}")
         return False
 
+def test_section_headings():
+    """Test that numbered headings after sentences ending in short words are not taken for cross-references."""
+    print_header("Section Heading Test")
+
+    try:
+        from condense import find_sections
+
+        filler = "The model is evaluated on held-out data. " * 20
+        text = (
+            "A Model for Everything Jane Doe jane@example.org Abstract We study models. " + filler +
+            "1 Introduction Models matter. " + filler +
+            "2 Method " + filler + "We propose a model trained on the new domain. " +
+            "3 Results " + filler + "The model reduces the error. " +
+            "4 Conclusion It works. " + filler +
+            "References [1] A. Author. A paper. 2020."
+        )
+        kinds = [kind for kind, _, _ in find_sections(text)]
+        expected = ['front', 'abstract', 'introduction', 'method', 'results', 'conclusion', 'references']
+        if kinds == expected:
+            print_success("Headings after \"domain.\" and \"error.\" are recognized")
+            return True
+        print_error(f"Unexpected sections: {kinds}")
+        return False
+
+    except Exception as e:
+        print_error(f"Section heading test error: {e}")
+        return False
+
 def start_server():
     """Start the Flask server."""
     print_info("Starting Flask server...")
@@ -277,7 +305,7 @@ def main():
     os.chdir(Path(__file__).parent)
     
     tests_passed = 0
-    total_tests = 4
+    total_tests = 5
     
     # Test 1: Environment
     if test_environment():
@@ -287,7 +315,11 @@ def main():
     if test_command_line_tool():
         tests_passed += 1
     
-    # Test 3: API server
+    # Test 3: Section headings
+    if test_section_headings():
+        tests_passed += 1
+
+    # Test 4: API server
     server_process = start_server()
     if server_process:
         if test_api_endpoints(server_process):
@@ -298,7 +330,7 @@ def main():
         server_process.terminate()
         server_process.wait()
     
-    # Test 4: Extension integration
+    # Test 5: Extension integration
     if test_extension_integration():
         tests_passed += 1
     